@@ -0,0 +1,119 @@
+"""Benchmarks for PRD export (services/export.py).
+
+Run with: python bench_export.py [pages] [concurrency]
+
+Builds a synthetic PRD of the given number of pages (100 by default, about
+50 lines each) and reports:
+  render   the legacy inline DOCX build against render_docx
+  loop     the worst event-loop stall while `concurrency` exports run, with
+           the legacy in-handler build against the worker pool
+  cache    time to serve an export that was already rendered
+"""
+import io
+import sys
+import time
+import asyncio
+import tempfile
+from pathlib import Path
+
+import docx
+
+from services.export import DocumentExporter, render_docx
+
+LINES_PER_PAGE = 50
+
+def build_prd(pages):
+    lines = ["# Roadmap Planner PRD"]
+    for page in range(pages):
+        lines.append(f"## Section {page + 1}")
+        for item in range(LINES_PER_PAGE // 5):
+            lines.append(f"### Requirement {page + 1}.{item + 1}")
+            lines.append("Product managers score initiatives with RICE and track success metrics every quarter.")
+            lines.append("- The planner keeps attachments next to each roadmap item.")
+            lines.append("* Reviewers approve or request changes before the PRD is published.")
+            lines.append("")
+    return "\n".join(lines)
+
+def legacy_render(content):
+    """The pre-rewrite implementation, as it ran inside the request handler."""
+    doc = docx.Document()
+    doc.add_heading('Product Requirements Document', 0)
+    for line in content.split('\n'):
+        if line.startswith('# '):
+            doc.add_heading(line[2:], level=1)
+        elif line.startswith('## '):
+            doc.add_heading(line[3:], level=2)
+        elif line.startswith('### '):
+            doc.add_heading(line[4:], level=3)
+        elif line.startswith('- ') or line.startswith('* '):
+            doc.add_paragraph(line[2:], style='List Bullet')
+        elif line.strip():
+            doc.add_paragraph(line)
+    byte_io = io.BytesIO()
+    doc.save(byte_io)
+    return byte_io.getvalue()
+
+def bench_render(content, directory):
+    started = time.perf_counter()
+    legacy_render(content)
+    legacy = time.perf_counter() - started
+    started = time.perf_counter()
+    render_docx(content, str(directory / "render.docx"))
+    current = time.perf_counter() - started
+    print(f"render   legacy {legacy:.2f}s  render_docx {current:.2f}s  ({legacy / current:.1f}x)")
+
+async def worst_stall(work):
+    """Longest gap between 10ms ticks of a heartbeat task while work runs."""
+    worst, last, done = 0.0, time.perf_counter(), False
+
+    async def heartbeat():
+        nonlocal worst, last
+        while not done:
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            worst, last = max(worst, now - last - 0.01), now
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.02)
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    done = True
+    await beat
+    return elapsed, worst
+
+async def bench_loop(content, concurrency, directory):
+    async def legacy():
+        async def one():
+            legacy_render(content)
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+
+    exporter = DocumentExporter(directory / "pool")
+
+    async def pooled():
+        # Distinct content per request so every export is rendered
+        await asyncio.gather(*(exporter.export(f"{content}\n{i}", "docx") for i in range(concurrency)))
+
+    try:
+        for name, work in (("legacy", legacy), ("pool", pooled)):
+            elapsed, stall = await worst_stall(work)
+            print(f"loop     {name:<7} {concurrency} exports in {elapsed:.2f}s, worst loop stall {stall * 1000:.0f}ms")
+
+        started = time.perf_counter()
+        await exporter.export(f"{content}\n0", "docx")
+        print(f"cache    hit served in {(time.perf_counter() - started) * 1000:.1f}ms")
+    finally:
+        exporter.shutdown()
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    content = build_prd(pages)
+    print(f"PRD: {pages} pages, {len(content.splitlines())} lines, {len(content) / 1024:.0f} KB")
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        bench_render(content, directory)
+        asyncio.run(bench_loop(content, concurrency, directory))
+
+if __name__ == "__main__":
+    main()
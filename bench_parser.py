@@ -0,0 +1,162 @@
+"""Benchmarks for services/parser.py.
+
+Run with: python bench_parser.py [pdf] [structure] [incremental]
+
+The PDF suite builds a corpus of synthetic 10-1000 page PDFs in a temporary
+directory and compares the legacy PyPDF2-first extraction against
+extract_pdf_pages. The structure suite reports parse_prd_structure
+throughput in MB/s on large synthetic PRDs, and the incremental suite
+times a one-word edit against a full re-parse.
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import PyPDF2
+
+from services.parser import extract_pdf_pages, parse_prd_structure
+from services.structure import IncrementalStructure
+
+PDF_PAGE_COUNTS = [10, 100, 500, 1000]
+PRD_SIZES_MB = [1, 5, 10]
+
+PAGE_TEXT = (
+    "The Roadmap Planner lets product managers score initiatives with RICE, "
+    "track success metrics and attach requirements for every quarter. "
+)
+
+def build_pdf(path, pages):
+    """Write a synthetic PDF with roughly a full page of text per page."""
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {i + 1}\n" + PAGE_TEXT * 25, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def legacy_extract(filepath):
+    """The pre-rewrite implementation: PyPDF2 first, string concatenation."""
+    text = ""
+    with open(filepath, 'rb') as f:
+        pdf_reader = PyPDF2.PdfReader(f)
+        for page in pdf_reader.pages:
+            extracted = page.extract_text()
+            if extracted:
+                text += extracted + "\n"
+    if not text.strip():
+        doc = fitz.open(filepath)
+        for page in doc:
+            text += page.get_text() + "\n"
+    return text
+
+def current_extract(filepath):
+    return "".join(page + "\n" for page in extract_pdf_pages(filepath))
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def bench_pdf():
+    print(f"{'pages':>6} {'legacy (s)':>12} {'current (s)':>12} {'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in PDF_PAGE_COUNTS:
+            path = str(Path(tmp) / f"synthetic_{pages}.pdf")
+            build_pdf(path, pages)
+            legacy_time, _ = timed(legacy_extract, path)
+            current_time, text = timed(current_extract, path)
+            assert text.count("Page ") >= pages
+            print(f"{pages:>6} {legacy_time:>12.3f} {current_time:>12.3f} {legacy_time / current_time:>8.1f}x")
+
+PRD_TEMPLATE = """# Overview
+The planner replaces spreadsheet-based AOP tracking for every business unit.
+We will track metrics weekly and refine scope as adoption grows.
+
+## Goals
+- Reduce planning cycle time by 30%
+- Single source of truth for roadmap items
+
+## Functional Requirements
+1. Users can upload PRDs in PDF, DOCX and Markdown.
+2. Each roadmap item carries a RICE score and quarter.
+
+## Success Metrics (KPIs)
+| Metric | Target |
+| Weekly active PMs | 200 |
+
+## Timeline
+Q1 beta, Q2 GA, Q3 integrations with the existing scope and schedule.
+
+## Risks & Assumptions
+Data migration from legacy sheets may slip the timeline.
+
+"""
+
+def build_prd(size_mb):
+    repeats = size_mb * 1024 * 1024 // len(PRD_TEMPLATE) + 1
+    return PRD_TEMPLATE * repeats
+
+def legacy_structure(text):
+    """The pre-rewrite implementation: nine substring chains per line."""
+    sections = dict.fromkeys(['overview', 'objectives', 'scope', 'features', 'user_stories',
+                              'requirements', 'success_metrics', 'timeline', 'risks'], '')
+    current_section = None
+    for line in text.split('\n'):
+        line_lower = line.strip().lower()
+        if any(k in line_lower for k in ['overview', 'introduction', 'background']):
+            current_section = 'overview'
+        elif any(k in line_lower for k in ['objectives', 'goals', 'purpose']):
+            current_section = 'objectives'
+        elif any(k in line_lower for k in ['scope', 'in scope', 'out of scope']):
+            current_section = 'scope'
+        elif any(k in line_lower for k in ['features', 'functionality']):
+            current_section = 'features'
+        elif any(k in line_lower for k in ['user stories', 'user personas', 'user journey']):
+            current_section = 'user_stories'
+        elif any(k in line_lower for k in ['requirements', 'functional requirements', 'non-functional']):
+            current_section = 'requirements'
+        elif any(k in line_lower for k in ['success metrics', 'kpis', 'metrics']):
+            current_section = 'success_metrics'
+        elif any(k in line_lower for k in ['timeline', 'milestones', 'schedule']):
+            current_section = 'timeline'
+        elif any(k in line_lower for k in ['risks', 'assumptions', 'constraints']):
+            current_section = 'risks'
+        elif line.strip() and current_section:
+            sections[current_section] += line + '\n'
+    return sections
+
+def bench_structure():
+    print(f"{'size':>6} {'legacy MB/s':>12} {'current MB/s':>13}")
+    for size_mb in PRD_SIZES_MB:
+        text = build_prd(size_mb)
+        mb = len(text.encode('utf-8')) / (1024 * 1024)
+        legacy_time, _ = timed(legacy_structure, text)
+        current_time, _ = timed(parse_prd_structure, text)
+        print(f"{size_mb:>4}MB {mb / legacy_time:>12.1f} {mb / current_time:>13.1f}")
+
+def bench_incremental():
+    print(f"{'size':>6} {'full (ms)':>10} {'incremental (ms)':>17}")
+    for size_mb in PRD_SIZES_MB:
+        text = build_prd(size_mb)
+        index = IncrementalStructure(text)
+        lines = text.split('\n')
+        lines[len(lines) // 2] += " edited"
+        edited = "\n".join(lines)
+        full_time, expected = timed(parse_prd_structure, edited)
+        incremental_time, result = timed(index.update, edited)
+        assert result == expected
+        print(f"{size_mb:>4}MB {full_time * 1000:>10.1f} {incremental_time * 1000:>17.1f}")
+
+SUITES = {
+    "pdf": bench_pdf,
+    "structure": bench_structure,
+    "incremental": bench_incremental,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(SUITES)
+    for name in selected:
+        print(f"== {name} ==")
+        SUITES[name]()
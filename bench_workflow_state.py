@@ -0,0 +1,97 @@
+"""Benchmark of checkpointed workflow state across feedback rounds.
+
+Run with: python bench_workflow_state.py [rounds]
+
+Starts one improvement workflow against an in-process mock LLM (every
+round returns a different ~40 KB document) and sends feedback rounds
+through human_review, reporting after each round the size of the newest
+checkpoint and of everything the thread keeps in the store (checkpoints,
+pending writes and documents). Three stores are compared: unbounded
+without compaction (what MemorySaver retained), the per-thread checkpoint
+cap alone, and the cap with document compaction.
+"""
+import sys
+import uuid
+import asyncio
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import httpx
+
+from dependencies import ChatModelRegistry, create_llm_http_client
+from services import llm
+from services.tracing import tracer
+from workflows.checkpointer import BoundedSqliteSaver
+from workflows.prd_agent import compile_graph
+
+PRD_PARAGRAPH = "The checkout flow serves 10000 merchants; abandonment is 18% and must drop to 12% by Q3.\n"
+PRD = "# Overview\n" + PRD_PARAGRAPH * 450
+
+STORES = [
+    ("unbounded", dict(max_checkpoints=10 ** 9, compact_documents=False)),
+    ("capped", dict(compact_documents=False)),
+    ("capped+compacted", dict(compact_documents=True)),
+]
+
+def mock_registry():
+    rounds = [0]
+
+    async def handler(request):
+        rounds[0] += 1
+        content = f"# Overview (revision {rounds[0]})\n" + PRD_PARAGRAPH * 450
+        return httpx.Response(200, json={
+            "id": "bench", "object": "chat.completion", "created": 0, "model": "bench",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        })
+
+    registry = ChatModelRegistry()
+    registry.configure("bench", "http://llm.bench/v1")
+    registry._http_clients[registry.base_url] = create_llm_http_client(transport=httpx.MockTransport(handler))
+    return registry
+
+def store_sizes(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        latest = conn.execute("SELECT LENGTH(checkpoint) FROM checkpoints ORDER BY checkpoint_id DESC LIMIT 1").fetchone()[0]
+        total = conn.execute("SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()[0]
+        total += conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+        has_documents = conn.execute("SELECT name FROM sqlite_master WHERE name = 'documents'").fetchone()
+        if has_documents:
+            total += conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM documents").fetchone()[0]
+        return latest, total
+    finally:
+        conn.close()
+
+async def run_rounds(path, rounds, **options):
+    graph = compile_graph(BoundedSqliteSaver(path, **options))
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    await graph.ainvoke({"prd_content": PRD, "improvement_type": "comprehensive", "messages": []}, config=config)
+    sizes = [store_sizes(path)]
+    for round_number in range(1, rounds + 1):
+        await graph.aupdate_state(config, {"feedback": f"Round {round_number}: tighten the metrics"})
+        await graph.ainvoke(None, config=config)
+        sizes.append(store_sizes(path))
+    state = await graph.aget_state(config)
+    return sizes, len(state.values["messages"])
+
+def main(rounds=20):
+    llm.model_registry = mock_registry()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the bench's spans out of data/workflow_traces.jsonl
+        tracer.path = Path(tmp) / "traces.jsonl"
+        for name, options in STORES:
+            results[name] = asyncio.run(run_rounds(Path(tmp) / f"{name}.sqlite", rounds, **options))
+
+    print(f"PRD {len(PRD) / 1024:.0f} KB, {rounds} feedback rounds; sizes in KB (newest checkpoint / whole thread)")
+    print(f"{'round':>5}" + "".join(f"{name:>26}" for name, _ in STORES))
+    for round_number in range(rounds + 1):
+        row = "".join(f"{latest / 1024:>14.1f} /{total / 1024:>9.1f}"
+                      for latest, total in (results[name][0][round_number] for name, _ in STORES))
+        print(f"{round_number:>5}{row}")
+    for name, _ in STORES:
+        print(f"{name}: {results[name][1]} messages retained in state")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -1,12 +1,15 @@
 import os
 import json
 import logging
+import threading
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 from fastapi import Request, Depends
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from langchain_openai import ChatOpenAI
 
 # Load env vars
 load_dotenv()
@@ -33,10 +36,105 @@ logger = logging.getLogger("aop_planner")
 # Templates
 templates = Jinja2Templates(directory="templates")
 
+# LLM HTTP connection pool, shared by every async completion
+DEFAULT_MODEL = "Azure-GPT-5-chat"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# Concurrent requests allowed per model; LLM_MODEL_LIMITS overrides per model,
+# e.g. '{"Azure-GPT-5-chat": 4}'
+LLM_MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "8"))
+LLM_MODEL_LIMITS = json.loads(os.getenv("LLM_MODEL_LIMITS", "{}"))
+
+def create_llm_http_client(**kwargs) -> httpx.AsyncClient:
+    """Async HTTP client with the tuned pool limits and timeouts for LLM calls."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        **kwargs
+    )
+
+class ChatModelRegistry:
+    """Process-wide chat models keyed by (model, temperature, base_url).
+
+    All models and the raw AsyncOpenAI client for a base_url share one
+    pooled HTTP client, so connections stay warm across workflow runs.
+    Concurrent requests per model are capped by services.llm_scheduler.
+    """
+
+    def __init__(self):
+        self.api_key = None
+        self.base_url = None
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._models: Dict[tuple, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, api_key: str, base_url: str):
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def http_client(self, base_url: Optional[str] = None) -> httpx.AsyncClient:
+        base_url = base_url or self.base_url
+        with self._lock:
+            if base_url not in self._http_clients:
+                self._http_clients[base_url] = create_llm_http_client()
+            return self._http_clients[base_url]
+
+    def chat_model(self, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                   base_url: Optional[str] = None) -> ChatOpenAI:
+        base_url = base_url or self.base_url
+        key = (model, temperature, base_url)
+        llm = self._models.get(key)
+        if llm is None:
+            http_client = self.http_client(base_url)
+            with self._lock:
+                llm = self._models.get(key)
+                if llm is None:
+                    llm = ChatOpenAI(
+                        api_key=self.api_key,
+                        base_url=base_url,
+                        model=model,
+                        temperature=temperature,
+                        http_async_client=http_client,
+                        timeout=http_client.timeout,
+                        # Retries happen in services.resilience, honoring the circuit breaker
+                        max_retries=0,
+                    )
+                    self._models[key] = llm
+                    logger.info(f"Registered chat model {model} (temperature={temperature}) for {base_url}")
+        return llm
+
+    async def warm_up(self):
+        """Open a pooled connection to each upstream ahead of the first request."""
+        for base_url, client in list(self._http_clients.items()):
+            try:
+                await client.get(f"{base_url.rstrip('/')}/models",
+                                 headers={"Authorization": f"Bearer {self.api_key}"})
+            except Exception as e:
+                logger.warning(f"LLM warm-up failed for {base_url}: {e}")
+
+    async def aclose(self):
+        for client in self._http_clients.values():
+            await client.aclose()
+        self._http_clients.clear()
+        self._models.clear()
+
+model_registry = ChatModelRegistry()
+
 # OpenAI Client
 class LLMClient:
     def __init__(self):
         self.client = None
+        self.async_client = None
+        self.http_client = None
+        self.api_key = None
+        self.base_url = None
         self.available = False
         try:
             api_key = os.getenv("OPENAI_API_KEY")
@@ -49,16 +147,31 @@ class LLMClient:
             base_url = os.getenv("OPENAI_BASE_URL", "https://cloudverse.freshworkscorp.com/api/v1")
             
             self.client = OpenAI(api_key=api_key, base_url=base_url)
+            model_registry.configure(api_key, base_url)
+            self.http_client = model_registry.http_client(base_url)
+            self.async_client = AsyncOpenAI(
+                api_key=api_key, base_url=base_url,
+                http_client=self.http_client, timeout=self.http_client.timeout,
+                max_retries=0
+            )
+            self.api_key = api_key
+            self.base_url = base_url
             self.available = True
             logger.info(f"OpenAI client initialized targeting {base_url}")
         except Exception as e:
             logger.error(f"Failed to init OpenAI: {e}")
 
+    async def aclose(self):
+        await model_registry.aclose()
+
 llm_service = LLMClient()
 
 def get_llm_client():
     return llm_service.client
 
+def get_async_llm_client():
+    return llm_service.async_client
+
 def get_templates():
     return templates
 
@@ -74,6 +187,9 @@ def get_users_data() -> List[Dict]:
 def save_users_data(users: List[Dict]):
     USERS_FILE.write_text(json.dumps(users, indent=2))
 
+# Serializes writes to roadmaps.json between request handlers and background jobs
+roadmap_lock = threading.RLock()
+
 def get_roadmaps_data() -> List[Dict]:
     if ROADMAP_FILE.exists():
         try:
@@ -83,4 +199,36 @@ def get_roadmaps_data() -> List[Dict]:
     return []
 
 def save_roadmaps_data(data: List[Dict]):
-    ROADMAP_FILE.write_text(json.dumps(data, indent=2))
+    with roadmap_lock:
+        ROADMAP_FILE.write_text(json.dumps(data, indent=2))
+
+def update_roadmap_item(item_id: str, fields: Dict[str, Any]) -> Optional[Dict]:
+    """Merge fields into one roadmap item, re-reading the file under the lock.
+
+    Returns the updated item, or None if it no longer exists.
+    """
+    with roadmap_lock:
+        roadmaps = get_roadmaps_data()
+        item = next((r for r in roadmaps if r.get('id') == item_id), None)
+        if item is None:
+            return None
+        item.update(fields)
+        save_roadmaps_data(roadmaps)
+        return item
+
+def add_roadmap_items(items: List[Dict]):
+    """Append items to roadmaps.json, re-reading the file under the lock."""
+    with roadmap_lock:
+        roadmaps = get_roadmaps_data()
+        roadmaps.extend(items)
+        save_roadmaps_data(roadmaps)
+
+def delete_roadmap_item(item_id: str) -> bool:
+    """Remove one roadmap item under the lock; False if it did not exist."""
+    with roadmap_lock:
+        roadmaps = get_roadmaps_data()
+        remaining = [r for r in roadmaps if r.get('id') != item_id]
+        if len(remaining) == len(roadmaps):
+            return False
+        save_roadmaps_data(remaining)
+        return True
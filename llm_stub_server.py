@@ -0,0 +1,242 @@
+"""Offline OpenAI-compatible LLM server for tests, load tests and benchmarks.
+
+Run with: python llm_stub_server.py [--port 8001] [--mode stub|record|replay] [--latency 0.5] ...
+then start the app with OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+
+Serves /v1/chat/completions (plain, JSON mode and streamed) and /v1/models.
+Modes:
+  stub    answer every request with a deterministic synthetic completion
+  record  forward to the real upstream (--upstream, OPENAI_API_KEY) and save
+          each response as a cassette keyed by the request hash
+  replay  answer from cassettes only; a request without one fails with 404
+
+Latency, streaming speed and upstream errors (--error-rate, --error-status)
+can be injected in every mode; errors are drawn from a seeded random
+generator, so a run is reproducible. In-process users can skip the network:
+create_stub_app() returns an ASGI app to wrap in httpx.ASGITransport.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_MODES = ("stub", "record", "replay")
+STUB_CASSETTE_DIR = Path(os.getenv("STUB_CASSETTE_DIR", str(Path(__file__).parent / "cassettes")))
+# Synthetic completions are about this many tokens, capped by the request's max_tokens
+STUB_COMPLETION_TOKENS = int(os.getenv("STUB_COMPLETION_TOKENS", "200"))
+# Reply to JSON-mode requests; the default has the shape of the app's RICE analysis
+STUB_JSON_REPLY = json.loads(os.getenv("STUB_JSON_REPLY", json.dumps({
+    "reach": 1000, "impact": 1.0, "confidence": 80, "effort": 2.0, "total_score": 400.0,
+    "verdict": "Stub analysis: worth doing."
+})))
+# Request fields that do not change the completion, left out of the cassette key
+VOLATILE_FIELDS = ("stream", "stream_options", "user")
+
+def cassette_key(body: Dict[str, Any]) -> str:
+    """Hash of everything in a chat request that determines its completion.
+
+    Streamed and plain requests share a key, so one cassette serves both.
+    """
+    payload = {k: v for k, v in body.items() if k not in VOLATILE_FIELDS}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def error_response(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    kind = "rate_limit_error" if status == 429 else "invalid_request_error" if status < 500 else "server_error"
+    return JSONResponse({"error": {"message": message, "type": kind, "code": None}}, status_code=status, headers=headers)
+
+class StubLLM:
+    """Produces (or records, or replays) completions and injects latency and errors."""
+
+    def __init__(self, mode: str = "stub", cassette_dir: Path = STUB_CASSETTE_DIR,
+                 latency: float = 0.0, jitter: float = 0.0, tokens_per_second: float = 0.0,
+                 error_rate: float = 0.0, error_status: List[int] = (503,), seed: int = 0,
+                 completion_tokens: int = STUB_COMPLETION_TOKENS, json_reply: Optional[Dict] = None,
+                 upstream: Optional[str] = None, api_key: Optional[str] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if mode not in STUB_MODES:
+            raise ValueError(f"Unknown stub mode: {mode}")
+        self.mode = mode
+        self.cassette_dir = Path(cassette_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = list(error_status)
+        self.completion_tokens = completion_tokens
+        self.json_reply = STUB_JSON_REPLY if json_reply is None else json_reply
+        self.upstream = upstream
+        self.api_key = api_key
+        self.transport = transport
+        self._random = random.Random(seed)
+        self.stats = {"requests": 0, "streamed": 0, "injected_errors": 0, "recorded": 0, "replayed": 0,
+                      "cassette_misses": 0}
+
+    def injected_error(self) -> Optional[JSONResponse]:
+        if self.error_rate <= 0 or self._random.random() >= self.error_rate:
+            return None
+        self.stats["injected_errors"] += 1
+        status = self._random.choice(self.error_status)
+        headers = {"retry-after": "1"} if status == 429 else None
+        return error_response(status, f"Injected stub error ({status})", headers)
+
+    async def delay(self):
+        seconds = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def synthesize(self, body: Dict[str, Any], key: str) -> Dict[str, Any]:
+        """Deterministic completion for a request: same request, same reply."""
+        messages = body.get("messages") or []
+        if (body.get("response_format") or {}).get("type") in ("json_object", "json_schema"):
+            content = json.dumps(self.json_reply)
+        else:
+            last_user = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+            tokens = min(self.completion_tokens, body.get("max_tokens") or body.get("max_completion_tokens") or self.completion_tokens)
+            header = f"# Stub response {key[:8]}\n\n"
+            filler = (f"Reply to: {' '.join(last_user.split()[:12])}\n\n" +
+                      "This section was written by the offline LLM stub. " * tokens)
+            content = (header + filler)[:max(len(header), tokens * 4)]
+        prompt = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+        return completion(key, body.get("model", "stub"), content, prompt, estimate_tokens(content))
+
+    def cassette_path(self, key: str) -> Path:
+        return self.cassette_dir / f"{key}.json"
+
+    async def record(self, body: Dict[str, Any], key: str, authorization: Optional[str]) -> Dict[str, Any]:
+        """Ask the real upstream (never streamed) and keep its answer as a cassette."""
+        request_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        headers = {"Authorization": authorization or f"Bearer {self.api_key}"}
+        async with httpx.AsyncClient(base_url=self.upstream, transport=self.transport, timeout=300) as client:
+            response = await client.post("/chat/completions", json=request_body, headers=headers)
+        response.raise_for_status()
+        result = response.json()
+        self.cassette_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cassette_path(key).with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"request": request_body, "response": result}, indent=2, sort_keys=True))
+        os.replace(tmp_path, self.cassette_path(key))
+        self.stats["recorded"] += 1
+        return result
+
+    def replay(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.cassette_path(key)
+        if not path.exists():
+            self.stats["cassette_misses"] += 1
+            return None
+        self.stats["replayed"] += 1
+        return json.loads(path.read_text())["response"]
+
+    async def stream(self, result: Dict[str, Any], include_usage: bool):
+        """Server-sent events of a completion, a few words per chunk."""
+        content = result["choices"][0]["message"].get("content") or ""
+        words = content.split(" ")
+        pieces = [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+
+        def chunk(delta, finish_reason=None):
+            return {"id": result["id"], "object": "chat.completion.chunk", "created": result["created"],
+                    "model": result["model"], "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n"
+        for piece in pieces:
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(estimate_tokens(piece) / self.tokens_per_second)
+            yield f"data: {json.dumps(chunk({'content': piece}))}\n\n"
+        yield f"data: {json.dumps(chunk({}, 'stop'))}\n\n"
+        if include_usage:
+            usage = {"id": result["id"], "object": "chat.completion.chunk", "created": result["created"],
+                     "model": result["model"], "choices": [], "usage": result.get("usage")}
+            yield f"data: {json.dumps(usage)}\n\n"
+        yield "data: [DONE]\n\n"
+
+def completion(key: str, model: str, content: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-stub-{key[:16]}", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+def create_stub_app(stub: Optional[StubLLM] = None, **settings) -> FastAPI:
+    """ASGI app serving the OpenAI chat API from a StubLLM (built from settings if not given)."""
+    stub = stub or StubLLM(**settings)
+    app = FastAPI(title="LLM stub")
+    app.state.stub = stub
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/v1/stub/stats")
+    async def stub_stats():
+        return stub.stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stub.stats["requests"] += 1
+        await stub.delay()
+        error = stub.injected_error()
+        if error is not None:
+            return error
+
+        key = cassette_key(body)
+        if stub.mode == "replay":
+            result = stub.replay(key)
+            if result is None:
+                return error_response(404, f"No cassette for request {key} in {stub.cassette_dir}")
+        elif stub.mode == "record":
+            try:
+                result = await stub.record(body, key, request.headers.get("authorization"))
+            except httpx.HTTPStatusError as e:
+                return JSONResponse(e.response.json(), status_code=e.response.status_code)
+        else:
+            result = stub.synthesize(body, key)
+
+        if body.get("stream"):
+            stub.stats["streamed"] += 1
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(stub.stream(result, include_usage), media_type="text/event-stream")
+        return result
+
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--mode", choices=STUB_MODES, default="stub")
+    parser.add_argument("--cassettes", type=Path, default=STUB_CASSETTE_DIR, help="cassette directory")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="streaming speed; 0 sends at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed on purpose")
+    parser.add_argument("--error-status", default="503", help="comma-separated status codes to inject")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--completion-tokens", type=int, default=STUB_COMPLETION_TOKENS)
+    parser.add_argument("--upstream", default=os.getenv("STUB_UPSTREAM_URL", "https://api.openai.com/v1"),
+                        help="real API recorded from in record mode")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    stub = StubLLM(mode=args.mode, cassette_dir=args.cassettes, latency=args.latency, jitter=args.jitter,
+                   tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                   error_status=[int(s) for s in args.error_status.split(",")], seed=args.seed,
+                   completion_tokens=args.completion_tokens, upstream=args.upstream,
+                   api_key=os.getenv("OPENAI_API_KEY"))
+    print(f"LLM stub ({args.mode}) on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    uvicorn.run(create_stub_app(stub), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
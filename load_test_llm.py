@@ -0,0 +1,58 @@
+"""Load test: concurrent assistant chat requests must overlap on the event loop.
+
+Run with: python load_test_llm.py [concurrency] [upstream_latency_seconds]
+
+The app is driven in-process and the LLM upstream is the offline stub
+(llm_stub_server.py) answering every completion after a fixed delay, so no
+network is needed. With a non-blocking client, N concurrent requests finish in
+roughly one upstream latency instead of N.
+"""
+import sys
+import time
+import asyncio
+
+import httpx
+from openai import AsyncOpenAI
+
+from dependencies import llm_service, create_llm_http_client
+from llm_stub_server import create_stub_app
+
+def slow_upstream(latency):
+    return httpx.ASGITransport(app=create_stub_app(latency=latency))
+
+async def run(concurrency, latency):
+    from main import app
+
+    http_client = create_llm_http_client(transport=slow_upstream(latency))
+    llm_service.async_client = AsyncOpenAI(api_key="load-test", base_url="http://llm.local/v1",
+                                           http_client=http_client)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+        async def one_request(i):
+            start = time.perf_counter()
+            response = await client.post("/api/workflow/chat", json={
+                "messages": [{"role": "user", "content": f"Request {i}"}],
+                "prd_context": "# Overview\nLoad test PRD",
+            })
+            assert response.json()["success"], response.text
+            return start, time.perf_counter()
+
+        started = time.perf_counter()
+        spans = await asyncio.gather(*(one_request(i) for i in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    await http_client.aclose()
+    overlapping = sum(1 for start, end in spans if start < min(e for _, e in spans))
+    print(f"requests:          {concurrency}")
+    print(f"upstream latency:  {latency:.2f}s")
+    print(f"wall clock:        {wall:.2f}s (serialized would be {concurrency * latency:.2f}s)")
+    print(f"in flight at once: {overlapping}")
+    return wall
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    wall = asyncio.run(run(concurrency, latency))
+    if wall > latency * max(2, concurrency / 4):
+        sys.exit("FAILURE: requests did not overlap")
+    print("SUCCESS: concurrent requests overlapped.")
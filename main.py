@@ -1,16 +1,15 @@
 import os
 import shutil
+import asyncio
 import logging
 import uuid
 import json
 from datetime import datetime
-import io
-import docx
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer
 from starlette.middleware.sessions import SessionMiddleware
@@ -19,11 +18,23 @@ from authlib.integrations.starlette_client import OAuth
 
 from dependencies import (
     templates, get_users_data, save_users_data, 
-    get_roadmaps_data, save_roadmaps_data,
-    get_llm_client, UPLOAD_DIR, FORM_CONFIG_FILE,
-    ROADMAP_FILE
+    get_roadmaps_data, update_roadmap_item,
+    add_roadmap_items, delete_roadmap_item,
+    llm_service, model_registry,
+    UPLOAD_DIR, FORM_CONFIG_FILE, ROADMAP_FILE
 )
-from services.parser import parse_document, parse_prd_structure
+from services.parser import parse_document, parse_docx_document, parse_prd_structure, shutdown_pdf_pool
+from services.structure import structure_cache
+from services.rice import get_rice_analysis, rice_cache
+from services.rice_batch import rice_batch
+from workflows.prd_agent import checkpointer
+from services.llm import single_flight
+from services.llm_scheduler import llm_scheduler, llm_request
+from services.resilience import llm_breaker, llm_deadline, retry_stats
+from services.cancellation import cancellation_stats, cancel_on_disconnect, ClientDisconnected
+from services.chat_sessions import chat_sessions
+from services.usage import usage_meter, LLMBudgetExceeded
+from services.export import document_exporter, DOCX_MEDIA_TYPE
 
 # Logging
 logger = logging.getLogger("aop_planner.main")
@@ -33,9 +44,20 @@ logger = logging.getLogger("aop_planner.main")
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting AOP Planner (FastAPI)...")
+    warm_up = asyncio.create_task(model_registry.warm_up())
+    await asyncio.to_thread(checkpointer.prune_expired)
+    usage_flusher = asyncio.create_task(usage_meter.flush_periodically())
     yield
     # Shutdown
     logger.info("Shutting down...")
+    warm_up.cancel()
+    usage_flusher.cancel()
+    await rice_batch.stop()
+    await workflow.workflow_runner.shutdown()
+    await llm_service.aclose()
+    document_exporter.shutdown()
+    shutdown_pdf_pool()
+    checkpointer.close()
 
 app = FastAPI(lifespan=lifespan, title="AOP Planner")
 
@@ -205,8 +227,14 @@ async def upload_prd_file(file: UploadFile = File(...)):
         
     try:
         # Parse
-        parsed_data = parse_document(str(filepath), filename)
-        structure = parse_prd_structure(parsed_data['content'])
+        if filename.lower().endswith(('.docx', '.doc')):
+            # Sections come straight from the DOCX heading styles
+            parsed_data, structure = await asyncio.to_thread(parse_docx_document, str(filepath), filename)
+            structure_cache.discard(filename)
+        else:
+            # Large PDFs are extracted on the parser's process pool; keep the loop free meanwhile
+            parsed_data = await asyncio.to_thread(parse_document, str(filepath), filename)
+            structure = structure_cache.update(filename, parsed_data['content'])
         
         metadata = {
             'original_filename': filename,
@@ -269,8 +297,8 @@ async def save_prd(request: Request):
         save_path = UPLOAD_DIR / filename
         save_path.write_text(content, encoding='utf-8')
             
-        # Parse for metadata consistency
-        structure = parse_prd_structure(content)
+        # Parse for metadata consistency, re-classifying only the edited lines
+        structure = structure_cache.update(filename, content)
         metadata = {
             'original_filename': filename,
             'uploaded_at': datetime.now().isoformat(),
@@ -296,39 +324,23 @@ async def save_prd(request: Request):
         logger.error(f"Save error: {e}")
         return JSONResponse({"error": f'Save failed: {str(e)}'}, status_code=500)
 
-async def get_rice_analysis(content: str):
-    """Extract RICE scores from PRD content using AI."""
-    client = get_llm_client()
-    if not client:
-        return None
-        
-    try:
-        response = client.chat.completions.create(
-            model="Azure-GPT-5-chat",
-            messages=[
-                {"role": "system", "content": "You are a product management consultant. Analyze the provided PRD and extract RICE (Reach, Impact, Confidence, Effort) scores.\n\nReach: Number of users/customers affected (e.g., 500, 10000).\nImpact: Value to the user (0.25 to 3.0: 3=Massive, 2=High, 1=Medium, 0.5=Low, 0.25=Minimal).\nConfidence: Percentage certainty (50% to 100%).\nEffort: Person-months (e.g., 0.5, 3.0).\n\nReturn ONLY a JSON object with keys: reach, impact, confidence, effort, total_score, and verdict (a 1-sentence strategic summary)."},
-                {"role": "user", "content": f"Analyze this PRD for RICE scores:\n\n{content}"}
-            ],
-            response_format={ "type": "json_object" }
-        )
-        return json.loads(response.choices[0].message.content)
-    except Exception as e:
-        logger.error(f"RICE extraction error: {e}")
-        return None
-
 @app.post("/api/analyze")
 async def analyze_prd_endpoint(request: Request):
     """Analyze PRD for completeness and RICE prioritization."""
-    login_required(request)
+    user = login_required(request)
     data = await request.json()
     prd_content = data.get('content', '')
+    filename = data.get('filename')
     
     if not prd_content:
         raise HTTPException(status_code=400, detail="No content provided")
     
     try:
         # 1. Structure Analysis
-        structure = parse_prd_structure(prd_content)
+        if filename:
+            structure = structure_cache.update(filename, prd_content)
+        else:
+            structure = parse_prd_structure(prd_content)
         
         # 2. Completeness Check
         missing_sections = []
@@ -340,8 +352,9 @@ async def analyze_prd_endpoint(request: Request):
         filled_sections = sum(1 for section_content in structure.values() if section_content.strip())
         completeness_score = (filled_sections / total_sections) * 100
         
-        # 3. RICE Analysis
-        rice_data = await get_rice_analysis(prd_content)
+        # 3. RICE Analysis (the user is waiting on it; dropped if they leave)
+        with llm_request("interactive", user.get('username'), "/api/analyze"), llm_deadline("analyze"):
+            rice_data = await cancel_on_disconnect(request, get_rice_analysis(prd_content), "/api/analyze")
         
         # 4. Final Payload
         return {
@@ -359,6 +372,10 @@ async def analyze_prd_endpoint(request: Request):
                 ]
             }
         }
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except LLMBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=429)
     except Exception as e:
         logger.error(f"Analysis error: {e}")
         return JSONResponse({"error": f'Analysis failed: {str(e)}'}, status_code=500)
@@ -376,49 +393,68 @@ async def export_prd_endpoint(request: Request):
         
     try:
         if target_format in ['docx', 'doc']:
-            # Generate DOCX
-            doc = docx.Document()
-            doc.add_heading('Product Requirements Document', 0)
-            
-            # Simple markdown parsing for the docx
-            for line in content.split('\n'):
-                if line.startswith('# '):
-                    doc.add_heading(line[2:], level=1)
-                elif line.startswith('## '):
-                    doc.add_heading(line[3:], level=2)
-                elif line.startswith('### '):
-                    doc.add_heading(line[4:], level=3)
-                elif line.startswith('- ') or line.startswith('* '):
-                    doc.add_paragraph(line[2:], style='List Bullet')
-                elif line.strip():
-                    doc.add_paragraph(line)
-            
-            byte_io = io.BytesIO()
-            doc.save(byte_io)
-            byte_io.seek(0)
-            
-            headers = {
-                'Content-Disposition': f'attachment; filename="{filename}.docx"'
-            }
-            from fastapi.responses import StreamingResponse
-            return StreamingResponse(byte_io, media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document', headers=headers)
+            # Rendered in a worker process (or served from the export cache) and streamed from disk
+            path = await document_exporter.export(content, 'docx')
+            return FileResponse(path, media_type=DOCX_MEDIA_TYPE, filename=f"{filename}.docx")
         
         # Default to MD
         headers = {
             'Content-Disposition': f'attachment; filename="{filename}.md"'
         }
-        return StreamingResponse(io.BytesIO(content.encode('utf-8')), media_type='text/markdown', headers=headers)
+        return Response(content.encode('utf-8'), media_type='text/markdown', headers=headers)
     except Exception as e:
         logger.error(f"Export error: {e}")
         return JSONResponse({"error": f'Export failed: {str(e)}'}, status_code=500)
 
+@app.get("/api/admin/llm-metrics")
+async def llm_metrics(request: Request):
+    """Counters for the shared LLM layer."""
+    admin_required(request)
+    return {
+        "single_flight": single_flight.stats(),
+        "scheduler": llm_scheduler.stats(),
+        "circuit_breaker": llm_breaker.stats(),
+        "retries": dict(retry_stats),
+        "cancellations": cancellation_stats.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "rice_cache": rice_cache.stats()
+    }
+
+@app.get("/api/admin/llm-usage")
+async def llm_usage_report(request: Request, days: int = 7, top: int = 20):
+    """LLM tokens, latency and cost by endpoint, user, model and workflow thread."""
+    admin_required(request)
+    return usage_meter.report(days=days, top=top)
+
+@app.get("/api/admin/workflow-metrics")
+async def workflow_metrics(request: Request):
+    """Size of the workflow checkpoint store."""
+    admin_required(request)
+    return await asyncio.to_thread(checkpointer.stats)
+
+@app.get("/api/admin/rice-batch")
+async def rice_batch_status(request: Request):
+    """Progress of the portfolio RICE scoring job."""
+    admin_required(request)
+    return rice_batch.status()
+
+@app.post("/api/admin/rice-batch")
+async def start_rice_batch(request: Request):
+    """Score every unscored or stale roadmap item in the background.
+
+    An interrupted run is resumed; pass {"restart": true} to start over.
+    """
+    admin_required(request)
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    return rice_batch.start(restart=bool(data.get('restart')))
+
 @app.post("/api/admin/load-sample")
 async def load_sample_data(request: Request):
     admin_required(request)
     try:
-        # Logic to append to roadmaps.json
-        from dependencies import get_roadmaps_data, save_roadmaps_data
-        
         sample_raw = [
             {"name": "Forms 2.0: Richer Fields, Seamless Migration, Unified Experience", "desc": "Introduce Rich Text Editor, Attachment, and Formula fields in all forms...", "bu": "EX", "type": "Major Feature", "priority": "P2", "q": "Q2"},
             {"name": "Automated Change Risk scoring and Assessment", "desc": "Introduce a native, scalable risk assessment framework within Change Management...", "bu": "EX", "type": "Major Feature", "priority": "P1", "q": "Q1"},
@@ -430,8 +466,6 @@ async def load_sample_data(request: Request):
             {"name": "Multi-departments", "desc": "Improved RBAC and isolation for tickets, contacts, analytics and admin setup...", "bu": "CX", "type": "Major Feature", "priority": "P2", "q": "Q1"}
         ]
 
-        roadmaps = get_roadmaps_data()
-        
         new_items = []
         for s in sample_raw:
             bu_map = {"EX": "EX BU", "AI": "AI BU", "CX": "CX BU", "CE": "CE BU"}
@@ -452,8 +486,7 @@ async def load_sample_data(request: Request):
             }
             new_items.append(item)
             
-        roadmaps.extend(new_items)
-        save_roadmaps_data(roadmaps)
+        add_roadmap_items(new_items)
         
         return {"success": True, "count": len(new_items)}
     except Exception as e:
@@ -472,6 +505,7 @@ async def delete_prd(filename: str, request: Request):
         os.remove(filepath)
     if meta_path.exists():
         os.remove(meta_path)
+    structure_cache.discard(filename)
         
     return {"success": True}
 
@@ -526,9 +560,7 @@ async def create_roadmap_request(request: Request):
                         'path': str(filepath)
                     })
         
-        roadmaps = get_roadmaps_data()
-        roadmaps.append(data)
-        save_roadmaps_data(roadmaps)
+        add_roadmap_items([data])
         
         return {'success': True, 'id': request_id}
     except Exception as e:
@@ -548,15 +580,9 @@ async def get_roadmap_request(id: str, request: Request):
 async def update_roadmap_request(id: str, request: Request):
     login_required(request)
     try:
-        roadmaps = get_roadmaps_data()
-        idx = next((i for i, r in enumerate(roadmaps) if r['id'] == id), None)
-        
-        if idx is None:
-            raise HTTPException(status_code=404, detail="Not found")
-            
         update_data = await request.json()
-        roadmaps[idx].update(update_data)
-        save_roadmaps_data(roadmaps)
+        if update_roadmap_item(id, update_data) is None:
+            raise HTTPException(status_code=404, detail="Not found")
         
         return {'success': True}
     except Exception as e:
@@ -567,14 +593,8 @@ async def update_roadmap_request(id: str, request: Request):
 async def delete_roadmap_request(id: str, request: Request):
     login_required(request)
     try:
-        roadmaps = get_roadmaps_data()
-        initial_len = len(roadmaps)
-        roadmaps = [r for r in roadmaps if r['id'] != id]
-        
-        if len(roadmaps) == initial_len:
+        if not delete_roadmap_item(id):
              raise HTTPException(status_code=404, detail="Not found")
-             
-        save_roadmaps_data(roadmaps)
         
         # Delete associated files
         request_upload_dir = ROADMAP_ATTACHMENTS_DIR / id
@@ -1,101 +1,239 @@
 import uuid
-from typing import Dict, Any, Optional, List
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
+import json
+import asyncio
+from typing import Dict, Any, Optional, List, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, field_validator
 
-from workflows.prd_agent import app_graph, checkpointer
-from dependencies import logger
+from workflows.prd_agent import app_graph, PROMPT_TEMPLATES
+from workflows.runner import WorkflowRunner, WorkflowBusyError, snapshot_payload
+from dependencies import logger, DEFAULT_MODEL, get_async_llm_client
+from services.llm import chat_completion, stream_chat_completion
+from services.tracing import tracer
+from services.llm_scheduler import llm_request
+from services.resilience import llm_deadline
+from services.cancellation import cancel_on_disconnect, cancellation_stats, ClientDisconnected
+from services.chat_sessions import chat_sessions, ChatSession, ChatSessionExpired
+from services.cache import content_hash
 
 router = APIRouter(prefix="/api/workflow", tags=["workflow"])
 
+# Background executor for graph runs started by /start and /review
+workflow_runner = WorkflowRunner(app_graph)
+
+# Disable proxy buffering so tokens reach the browser as they are generated
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 class WorkflowStartRequest(BaseModel):
     prd_content: str
     improvement_type: str = "comprehensive"
+    # "sections" improves each PRD section in parallel; see workflows.prd_agent
+    mode: str = "document"
+    # Several types run as parallel "variants" branches, reviewed side by side
+    improvement_types: Optional[List[str]] = None
+
+    @field_validator("improvement_type", "improvement_types")
+    @classmethod
+    def known_improvement_types(cls, value):
+        # Raised as-is rather than as a ValueError, so the client gets a 400
+        # instead of an unknown type silently running the comprehensive prompt
+        for improvement_type in [value] if isinstance(value, str) else value or []:
+            if improvement_type not in PROMPT_TEMPLATES:
+                raise HTTPException(status_code=400, detail=f"Unknown improvement type: {improvement_type}")
+        return value
 
 class FeedbackRequest(BaseModel):
     feedback: Optional[str] = None
     approve: bool = True
+    # Section keys to regenerate in "sections" mode; inferred from feedback when omitted
+    sections: Optional[List[str]] = None
+    # Variant picked in "variants" mode; feedback then reworks only that variant
+    variant: Optional[str] = None
 
 class ChatRequest(BaseModel):
-    messages: List[Dict[str, str]]
-    prd_context: Optional[str] = ""
+    # With a server-side session only the new message is sent, and
+    # prd_context only when the editor content changed since the last turn
+    session_id: Optional[str] = None
+    message: Optional[str] = None
+    # Whole transcript ending with the new user message: for clients without
+    # a session, or to reseed one that expired
+    messages: Optional[List[Dict[str, str]]] = None
+    prd_context: Optional[str] = None
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def session_user(http_request: Request) -> Optional[str]:
+    """Username of the logged-in user, used for per-user LLM limits."""
+    return (http_request.session.get('user') or {}).get('username')
+
+def initial_workflow_state(request: WorkflowStartRequest) -> Dict[str, Any]:
+    improvement_types = list(dict.fromkeys(request.improvement_types or []))
+    return {
+        "prd_content": request.prd_content,
+        "improvement_type": improvement_types[0] if improvement_types else request.improvement_type,
+        "improvement_types": improvement_types,
+        "mode": "variants" if improvement_types else request.mode,
+        "messages": []
+    }
+
+def open_chat_turn(request: ChatRequest, user: Optional[str]) -> Tuple[ChatSession, str, Optional[str]]:
+    """Session, new user message and changed PRD context for a chat request.
+
+    The context is left for the caller to apply with update_chat_context
+    under the session lock. Raises 409 for an expired session id, so the
+    browser can resend its transcript without one, and 400 when there is
+    no message.
+    """
+    prd_context = None
+    if request.session_id:
+        try:
+            session = chat_sessions.get(request.session_id, user)
+        except ChatSessionExpired:
+            raise HTTPException(status_code=409, detail="Chat session expired")
+        message = request.message
+        prd_context = request.prd_context
+    else:
+        history = list(request.messages or [])
+        message = request.message
+        if message is None and history and history[-1].get("role") == "user":
+            message = history.pop()["content"]
+        session = chat_sessions.create(request.prd_context or "", user, history)
+    if not message:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    return session, message, prd_context
+
+def update_chat_context(session: ChatSession, prd_context: Optional[str]):
+    """Switch the session to a changed PRD context; call with session.lock held."""
+    if prd_context is not None and content_hash(prd_context) != session.context_hash:
+        session.set_context(prd_context)
 
 @router.post("/chat")
-async def chat_with_assistant(request: ChatRequest):
-    """Context-aware AI assistant for PRD refinement."""
-    from dependencies import get_llm_client, logger
-    
-    client = get_llm_client()
+async def chat_with_assistant(request: ChatRequest, http_request: Request):
+    """Context-aware AI assistant for PRD refinement.
+
+    The conversation is kept server-side; the reply carries the session_id
+    to send with the next message.
+    """
+    client = get_async_llm_client()
     if not client:
         return {"success": False, "error": "AI features are currently disabled."}
-        
-    if not request.messages:
-         return {"success": False, "error": "No messages provided"}
+
+    user = session_user(http_request)
+    session, message, prd_context = open_chat_turn(request, user)
 
     try:
-        # Construct system prompt with PRD context
-        system_message = {
-            "role": "system",
-            "content": (
-                "You are an expert Product Manager assistant helping to refine a Product Requirements Document (PRD).\n"
-                "Your goal is to provide specific, actionable advice or content for the PRD.\n"
-                "When asked to write or improve a section, keep it consistent with the existing tone.\n"
-                "CURRENT PRD CONTEXT:\n"
-                f"\"\"\"\n{request.prd_context}\n\"\"\"\n\n"
-                "If the user asks for a new section, provide it in clear Markdown format."
-            )
-        }
-        
-        # Prepare full message list for LLM
-        llm_messages = [system_message] + request.messages
-        
-        # Use simple client call since this is stateless chat (not the agent workflow)
-        # Note: We hardcode model for now or get from env
-        response = client.chat.completions.create(
-            model="Azure-GPT-5-chat", # Configurable
-            messages=llm_messages,
-            temperature=0.7
-        )
-        
-        reply = response.choices[0].message.content
-        return {"success": True, "reply": reply}
+        async with session.lock:
+            update_chat_context(session, prd_context)
+            with llm_request("interactive", user, "/api/workflow/chat"), llm_deadline("chat"):
+                response = await cancel_on_disconnect(
+                    http_request,
+                    chat_completion(session.prompt(message), model=DEFAULT_MODEL, temperature=0.7),
+                    "/api/workflow/chat"
+                )
+            reply = response.choices[0].message.content
+            chat_sessions.record_turn(session, message, reply)
+        chat_sessions.schedule_compaction(session, "/api/workflow/chat")
+        return {"success": True, "reply": reply, "session_id": session.session_id}
         
+    except ClientDisconnected:
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": str(e), "session_id": session.session_id}
+
+@router.post("/chat/stream")
+async def chat_with_assistant_stream(request: ChatRequest, http_request: Request):
+    """Streaming variant of /chat: tokens are sent as server-sent events."""
+    if not get_async_llm_client():
+        return {"success": False, "error": "AI features are currently disabled."}
+
+    user = session_user(http_request)
+    session, message, prd_context = open_chat_turn(request, user)
+
+    async def events():
+        parts = []
+        try:
+            yield sse_event({"session_id": session.session_id}, event="session")
+            async with session.lock:
+                update_chat_context(session, prd_context)
+                with llm_request("interactive", user, "/api/workflow/chat/stream"), llm_deadline("chat"):
+                    async for delta in stream_chat_completion(session.prompt(message), model=DEFAULT_MODEL, temperature=0.7):
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+                reply = "".join(parts)
+                chat_sessions.record_turn(session, message, reply)
+            chat_sessions.schedule_compaction(session, "/api/workflow/chat/stream")
+            yield sse_event({"reply": reply, "session_id": session.session_id}, event="done")
+        except asyncio.CancelledError:
+            # Starlette cancels the stream when the client disconnects
+            cancellation_stats.record_disconnect("/api/workflow/chat/stream")
+            raise
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.post("/start")
-async def start_workflow(request: WorkflowStartRequest):
-    """Start a new document improvement workflow."""
-    logger.info("Received workflow start request")
+async def start_workflow(request: WorkflowStartRequest, http_request: Request):
+    """Start a new document improvement workflow.
+
+    The graph run is queued on the workflow runner and this returns at once;
+    follow /{thread_id}/events for progress and the review payload.
+    """
     thread_id = str(uuid.uuid4())
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    initial_state = {
-        "prd_content": request.prd_content,
-        "improvement_type": request.improvement_type,
-        "messages": []
+    workflow_runner.submit(thread_id, initial_workflow_state(request), user=session_user(http_request))
+    logger.info(f"Queued workflow run for thread {thread_id}")
+    return {
+        "thread_id": thread_id,
+        "status": "queued",
+        "events": f"/api/workflow/{thread_id}/events"
     }
-    
-    try:
-        logger.info(f"Invoking graph for thread {thread_id}...")
-        result = await app_graph.ainvoke(initial_state, config=config)
-        logger.info(f"Graph invocation returned for thread {thread_id}")
-        
-        # Get the next state to see where we are
-        state_snapshot = await app_graph.aget_state(config)
-        logger.info(f"Current state next: {state_snapshot.next}")
-        
-        return {
-            "thread_id": thread_id,
-            "status": "waiting_for_review",
-            "next_step": state_snapshot.next,
-            "current_content": state_snapshot.values.get("improved_content"),
-            "original_content": request.prd_content
-        }
-    except Exception as e:
-        logger.error(f"Workflow start error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/start/stream")
+async def start_workflow_stream(request: WorkflowStartRequest, http_request: Request):
+    """Streaming variant of /start: generated tokens are sent as server-sent events.
+
+    The graph runs inside this request rather than on the workflow runner, so
+    tokens can be relayed as they arrive; the result is checkpointed the same
+    way and the final event carries the review payload.
+    """
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    initial_state = initial_workflow_state(request)
+    user = session_user(http_request)
+
+    async def events():
+        yield sse_event({"thread_id": thread_id}, event="started")
+        try:
+            # Parallel section branches interleave their tokens, so in
+            # "sections" mode each section is sent whole as it completes.
+            with llm_request("workflow", user), llm_deadline("workflow"):
+                async for stream_mode, payload in app_graph.astream(initial_state, config=config, stream_mode=["messages", "updates"]):
+                    if stream_mode == "messages":
+                        chunk, metadata = payload
+                        if metadata.get("langgraph_node") == "generate" and chunk.content:
+                            yield sse_event({"delta": chunk.content})
+                    elif "improve_section" in payload:
+                        for index, content in payload["improve_section"]["improved_sections"].items():
+                            yield sse_event({"index": index, "content": content}, event="section")
+                    elif "generate_variant" in payload:
+                        for improvement_type, content in payload["generate_variant"]["variants"].items():
+                            yield sse_event({"improvement_type": improvement_type, "content": content}, event="variant")
+            state_snapshot = await app_graph.aget_state(config)
+            yield sse_event(snapshot_payload(thread_id, state_snapshot), event="done")
+        except asyncio.CancelledError:
+            cancellation_stats.record_disconnect("/api/workflow/start/stream")
+            raise
+        except Exception as e:
+            logger.error(f"Workflow stream error: {e}", exc_info=True)
+            yield sse_event({"error": str(e)}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.get("/{thread_id}/state")
 async def get_workflow_state(thread_id: str):
@@ -104,26 +242,85 @@ async def get_workflow_state(thread_id: str):
     
     if not state_snapshot:
         raise HTTPException(status_code=404, detail="Thread not found")
+
+    if workflow_runner.is_running(thread_id):
+        status = "running"
+    else:
+        status = "active" if state_snapshot.next else "completed"
         
     return {
         "thread_id": thread_id,
-        "status": "active" if state_snapshot.next else "completed",
+        "status": status,
         "next_step": state_snapshot.next,
-        "current_content": state_snapshot.values.get("improved_content")
+        "current_content": state_snapshot.values.get("improved_content"),
+        "variants": state_snapshot.values.get("variants"),
+        "selected_variant": state_snapshot.values.get("selected_variant")
     }
 
-from fastapi import BackgroundTasks
+@router.get("/{thread_id}/events")
+async def workflow_events(thread_id: str):
+    """Server-sent progress of the thread's current graph run.
+
+    Events are queued, running, node (a node started or finished) and one
+    of waiting_for_review, completed, error or cancelled, after which the
+    stream closes. Events already published are replayed first. Without a
+    run in this process the thread's checkpointed state is sent instead.
+    """
+    if not workflow_runner.has_run(thread_id):
+        state_snapshot = await app_graph.aget_state({"configurable": {"thread_id": thread_id}})
+        if not state_snapshot.values:
+            raise HTTPException(status_code=404, detail="Thread not found")
+        payload = snapshot_payload(thread_id, state_snapshot)
+
+        async def snapshot_events():
+            yield sse_event(payload, event=payload["status"])
+
+        return StreamingResponse(snapshot_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def events():
+        async for event, data in workflow_runner.events(thread_id):
+            yield sse_event(data, event=event)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/{thread_id}/trace")
+async def workflow_trace(thread_id: str):
+    """Timing summary of the thread from the local trace file.
+
+    Totals per graph node, for LLM calls (with prompt size and token counts)
+    and for checkpoint writes, followed by the most recent spans in order.
+    """
+    summary = await asyncio.to_thread(tracer.summary, thread_id)
+    if not summary["spans"]:
+        raise HTTPException(status_code=404, detail="No trace recorded for this thread")
+    return summary
 
 @router.post("/{thread_id}/review")
-async def review_workflow(thread_id: str, request: FeedbackRequest, backgroundTasks: BackgroundTasks):
-    """Provide human review/feedback."""
+async def review_workflow(thread_id: str, request: FeedbackRequest, http_request: Request):
+    """Provide human review/feedback.
+
+    Approval finishes the thread immediately (no LLM call is involved);
+    feedback queues a regeneration run, reported on /{thread_id}/events.
+    """
+    if workflow_runner.is_running(thread_id):
+        raise HTTPException(status_code=409, detail="Workflow is still running")
+
     config = {"configurable": {"thread_id": thread_id}}
     state_snapshot = await app_graph.aget_state(config)
     
     if not state_snapshot.next:
         raise HTTPException(status_code=400, detail="Workflow already completed or not active")
+
+    update = {}
+    if request.variant:
+        variants = state_snapshot.values.get("variants") or {}
+        if request.variant not in variants:
+            raise HTTPException(status_code=400, detail=f"Unknown variant: {request.variant}")
+        update = {"selected_variant": request.variant, "improved_content": variants[request.variant]}
     
     if request.approve:
+        if update:
+            await app_graph.aupdate_state(config, update)
         result = await app_graph.ainvoke(None, config=config)
         return {
             "thread_id": thread_id,
@@ -133,11 +330,18 @@ async def review_workflow(thread_id: str, request: FeedbackRequest, backgroundTa
     else:
         await app_graph.aupdate_state(
             config, 
-            {"feedback": request.feedback}
+            {**update, "feedback": request.feedback, "target_sections": request.sections}
         )
         
-        # Resume the graph in the background
-        backgroundTasks.add_task(app_graph.ainvoke, None, config=config)
+        # Resume the graph on the runner; progress is published per thread
+        try:
+            workflow_runner.submit(thread_id, None, user=session_user(http_request))
+        except WorkflowBusyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
         
-        return {"status": "rejected", "message": "Feedback sent to AI."}
+        return {
+            "status": "rejected",
+            "message": "Feedback sent to AI.",
+            "events": f"/api/workflow/{thread_id}/events"
+        }
 
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger("aop_planner.cache")
+
+def content_hash(text: str) -> str:
+    """Hash of text with whitespace normalized, so reformatting is a cache hit."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Small persistent key/value cache backed by a JSON file.
+
+    Entries expire after ttl seconds; when more than max_entries are stored
+    the least recently used ones are evicted. The whole file is rewritten
+    atomically on every change, so keep max_entries modest.
+    """
+
+    def __init__(self, path: Path, ttl: float, max_entries: int):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.path.exists():
+                try:
+                    self._entries = json.loads(self.path.read_text())
+                except Exception as e:
+                    logger.error(f"Error reading cache {self.path.name}: {e}")
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp_path.write_text(json.dumps(self._entries))
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or now - entry['stored_at'] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                    self._save()
+                self.misses += 1
+                return None
+            # Access time is kept in memory only; it is persisted with the next write
+            entry['accessed_at'] = now
+            self.hits += 1
+            return entry['value']
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._load()
+            now = time.time()
+            self._entries[key] = {'value': value, 'stored_at': now, 'accessed_at': now}
+            expired = [k for k, e in self._entries.items() if now - e['stored_at'] > self.ttl]
+            for k in expired:
+                del self._entries[k]
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                by_age = sorted(self._entries, key=lambda k: self._entries[k]['accessed_at'])
+                for k in by_age[:overflow]:
+                    del self._entries[k]
+            try:
+                self._save()
+            except Exception as e:
+                logger.error(f"Error writing cache {self.path.name}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load()
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
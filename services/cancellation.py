@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Dict
+
+from fastapi import Request
+
+logger = logging.getLogger("aop_planner.cancellation")
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before its LLM work finished."""
+
+class CancellationStats:
+    """Counts work abandoned because nobody was waiting for it any more.
+
+    Token savings are estimates: a call cancelled while still queued saves
+    its prompt and its expected completion, one cancelled after it was sent
+    saves the part of the expected completion not yet generated.
+    """
+
+    def __init__(self):
+        self.disconnects: Dict[str, int] = defaultdict(int)
+        self.cancelled_calls = 0
+        self.cancelled_while_queued = 0
+        self.prompt_tokens_saved = 0
+        self.completion_tokens_saved = 0
+
+    def record_disconnect(self, endpoint: str):
+        self.disconnects[endpoint] += 1
+
+    def record_llm_call(self, queued: bool, prompt_tokens: int, completion_tokens: int):
+        self.cancelled_calls += 1
+        if queued:
+            self.cancelled_while_queued += 1
+            self.prompt_tokens_saved += prompt_tokens
+        self.completion_tokens_saved += max(0, completion_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'client_disconnects': dict(self.disconnects),
+            'cancelled_llm_calls': self.cancelled_calls,
+            'cancelled_while_queued': self.cancelled_while_queued,
+            'estimated_prompt_tokens_saved': self.prompt_tokens_saved,
+            'estimated_completion_tokens_saved': self.completion_tokens_saved,
+        }
+
+cancellation_stats = CancellationStats()
+
+async def wait_for_disconnect(request: Request):
+    """Return once the client has closed the connection.
+
+    Must only be used after the request body has been read: it consumes the
+    remaining ASGI messages, the next of which is then the disconnect.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def cancel_on_disconnect(request: Request, work: Awaitable, endpoint: str) -> Any:
+    """Await work, cancelling it (and the LLM calls it is waiting on) if the client leaves.
+
+    Raises ClientDisconnected in that case; the caller answers with
+    status 499, which no one will read.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        cancellation_stats.record_disconnect(endpoint)
+        logger.info(f"Client disconnected from {endpoint}; cancelled its LLM work")
+        raise ClientDisconnected(endpoint)
+    return task.result()
@@ -0,0 +1,195 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from dependencies import DEFAULT_MODEL
+from services.cache import content_hash
+from services.llm import chat_completion, estimate_tokens
+from services.llm_scheduler import llm_request
+from services.resilience import llm_deadline
+
+logger = logging.getLogger("aop_planner.chat_sessions")
+
+# Idle sessions are dropped after this many seconds
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", str(2 * 3600)))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+# Tokens of verbatim turns kept in the prompt; past this, the oldest turns are
+# folded into a running summary until half the budget is left
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+
+ASSISTANT_INSTRUCTIONS = (
+    "You are an expert Product Manager assistant helping to refine a Product Requirements Document (PRD).\n"
+    "Your goal is to provide specific, actionable advice or content for the PRD.\n"
+    "When asked to write or improve a section, keep it consistent with the existing tone.\n"
+    "If the user asks for a new section, provide it in clear Markdown format."
+)
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a product manager and an assistant about their PRD. "
+    "Keep decisions, requests still open and any text the user accepted; drop pleasantries. "
+    "Reply with the summary only."
+)
+
+class ChatSessionExpired(Exception):
+    """Raised for a session id the store no longer (or never) held."""
+
+def chat_prompt(prd_context: str, summary: Optional[str], turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Messages for one turn, ordered from most to least stable.
+
+    The fixed instructions come first, then the PRD, then the summary of
+    older turns and the recent turns in order, so consecutive turns share
+    a long identical prefix that provider-side prompt caching can reuse.
+    """
+    messages = [
+        {"role": "system", "content": ASSISTANT_INSTRUCTIONS},
+        {"role": "system", "content": f"CURRENT PRD CONTEXT:\n\"\"\"\n{prd_context}\n\"\"\""}
+    ]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    return messages + turns
+
+class ChatSession:
+    def __init__(self, session_id: str, prd_context: str = "", user: Optional[str] = None):
+        self.session_id = session_id
+        self.user = user
+        self.prd_context = prd_context
+        self.context_hash = content_hash(prd_context)
+        self.summary: Optional[str] = None
+        self.turns: List[Dict[str, str]] = []
+        self.summarized_turns = 0
+        self.updated_at = time.time()
+        # Held while a turn or a compaction is reading or changing the history
+        self.lock = asyncio.Lock()
+        self.compacting = False
+
+    def set_context(self, prd_context: str):
+        self.prd_context = prd_context
+        self.context_hash = content_hash(prd_context)
+
+    def prompt(self, message: Optional[str] = None) -> List[Dict[str, str]]:
+        turns = self.turns + ([{"role": "user", "content": message}] if message is not None else [])
+        return chat_prompt(self.prd_context, self.summary, turns)
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(turn["content"]) for turn in self.turns)
+
+class ChatSessionStore:
+    """Assistant conversations kept server-side, so the browser sends only new messages.
+
+    Sessions live in memory (they are cheap to rebuild: the browser keeps
+    the transcript and can reseed an expired session) and are evicted after
+    ttl seconds idle or when more than max_sessions exist.
+    """
+
+    def __init__(self, ttl: float = CHAT_SESSION_TTL, max_sessions: int = CHAT_MAX_SESSIONS,
+                 history_budget: int = CHAT_HISTORY_TOKEN_BUDGET, model: str = DEFAULT_MODEL):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.history_budget = history_budget
+        self.model = model
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._compacting: set = set()
+        self.compactions = 0
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [sid for sid, s in self._sessions.items() if now - s.updated_at > self.ttl]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def create(self, prd_context: str = "", user: Optional[str] = None,
+               history: Optional[List[Dict[str, str]]] = None) -> ChatSession:
+        """New session, optionally seeded with a transcript the browser kept."""
+        session = ChatSession(str(uuid.uuid4()), prd_context, user)
+        session.turns = [{"role": m["role"], "content": m["content"]} for m in history or []
+                         if m.get("role") in ("user", "assistant")]
+        self._sessions[session.session_id] = session
+        self._evict()
+        return session
+
+    def get(self, session_id: str, user: Optional[str] = None) -> ChatSession:
+        self._evict()
+        session = self._sessions.get(session_id)
+        if session is None or session.user != user:
+            raise ChatSessionExpired(session_id)
+        self._sessions.move_to_end(session_id)
+        session.updated_at = time.time()
+        return session
+
+    def record_turn(self, session: ChatSession, message: str, reply: str):
+        session.turns += [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+        session.updated_at = time.time()
+
+    def needs_compaction(self, session: ChatSession) -> bool:
+        return session.history_tokens() > self.history_budget
+
+    def schedule_compaction(self, session: ChatSession, endpoint: Optional[str] = None):
+        """Compact in the background once a reply is out, on behalf of the endpoint that served the turn."""
+        if self.needs_compaction(session) and not session.compacting:
+            task = asyncio.create_task(self.compact(session, endpoint))
+            self._compacting.add(task)
+            task.add_done_callback(self._compacting.discard)
+
+    async def compact(self, session: ChatSession, endpoint: Optional[str] = None):
+        """Fold the oldest turns into the summary until half the history budget is left.
+
+        Compacting well below the budget means it happens every few turns
+        rather than on each one, so the cached prompt prefix survives most
+        turns. Falls back to dropping those turns if summarizing fails.
+
+        The summary call runs as an interactive request of the session's
+        user, without the session lock, so the next turn is not held up by
+        it; turns recorded meanwhile are kept when the summary is swapped in.
+        """
+        async with session.lock:
+            if session.compacting or not self.needs_compaction(session):
+                return
+            keep, kept_tokens = len(session.turns), 0
+            # Keep whole user/assistant pairs, newest first
+            while keep >= 2 and kept_tokens + self._pair_tokens(session, keep - 2) <= self.history_budget // 2:
+                kept_tokens += self._pair_tokens(session, keep - 2)
+                keep -= 2
+            folded, summary = session.turns[:keep], session.summary
+            session.compacting = True
+
+        try:
+            try:
+                with llm_request("interactive", session.user, endpoint), llm_deadline("chat"):
+                    summary = await self._summarize(summary, folded)
+            except Exception as e:
+                logger.warning(f"Chat summary failed for {session.session_id}, dropping old turns: {e}")
+
+            async with session.lock:
+                # Turns are only appended, so the folded ones are still the oldest
+                session.summary = summary
+                session.turns = session.turns[len(folded):]
+                session.summarized_turns += len(folded)
+                self.compactions += 1
+        finally:
+            session.compacting = False
+
+    @staticmethod
+    def _pair_tokens(session: ChatSession, start: int) -> int:
+        return sum(estimate_tokens(turn["content"]) for turn in session.turns[start:start + 2])
+
+    async def _summarize(self, summary: Optional[str], turns: List[Dict[str, str]]) -> str:
+        transcript = "\n\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in turns)
+        if summary:
+            transcript = f"EARLIER SUMMARY: {summary}\n\n{transcript}"
+        response = await chat_completion(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            model=self.model, temperature=0, max_tokens=CHAT_SUMMARY_MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+
+    def stats(self) -> Dict[str, Any]:
+        self._evict()
+        return {"sessions": len(self._sessions), "compactions": self.compactions}
+
+chat_sessions = ChatSessionStore()
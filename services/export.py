@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import docx
+
+from dependencies import DATA_DIR
+
+logger = logging.getLogger("aop_planner.export")
+
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", str(DATA_DIR / "exports")))
+EXPORT_MAX_WORKERS = int(os.getenv("EXPORT_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Rendered files kept on disk; the least recently exported are removed first
+EXPORT_CACHE_MAX_FILES = int(os.getenv("EXPORT_CACHE_MAX_FILES", "200"))
+# Files exported this recently are never evicted, so a response still being
+# opened or streamed does not lose its file
+EXPORT_EVICT_GRACE = float(os.getenv("EXPORT_EVICT_GRACE", "10"))
+# Bump whenever render_docx changes its output so cached files are not reused
+EXPORT_TEMPLATE_VERSION = "1"
+
+DOCX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+def render_docx(content: str, path: str):
+    """Write Markdown-ish PRD content as a DOCX file at path.
+
+    Runs in a worker process. Style ids are resolved once: assigning a
+    style by name or object makes python-docx scan every style in the
+    document, which dominated the render time of long PRDs.
+    """
+    doc = docx.Document()
+    doc.add_heading('Product Requirements Document', 0)
+    style_ids = {prefix: doc.styles[name].style_id for prefix, name in
+                 (('# ', 'Heading 1'), ('## ', 'Heading 2'), ('### ', 'Heading 3'),
+                  ('- ', 'List Bullet'), ('* ', 'List Bullet'))}
+
+    def add(text: str, style_id: Optional[str] = None):
+        paragraph = doc.add_paragraph(text)
+        if style_id:
+            paragraph._p.style = style_id
+
+    # Simple markdown parsing for the docx
+    for line in content.split('\n'):
+        prefix = line[:line.find(' ') + 1] if line[:1] in '#-*' else ''
+        if prefix in style_ids:
+            add(line[len(prefix):], style_ids[prefix])
+        elif line.strip():
+            add(line)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    doc.save(tmp_path)
+    os.replace(tmp_path, path)
+
+RENDERERS = {'docx': render_docx}
+
+def export_key(content: str, target_format: str, template_version: str = EXPORT_TEMPLATE_VERSION) -> str:
+    # Exact bytes, not whitespace-normalized: line breaks change the document
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return f"{digest}-{target_format}-v{template_version}"
+
+class DocumentExporter:
+    """Renders PRD exports in a process pool and keeps the files on disk.
+
+    Files are named by (content hash, format, template version), so
+    exporting the same content again streams the existing file without
+    rendering. Concurrent exports of the same content share one render.
+    """
+
+    def __init__(self, directory: Path = EXPORT_DIR, max_workers: int = EXPORT_MAX_WORKERS,
+                 max_files: int = EXPORT_CACHE_MAX_FILES, template_version: str = EXPORT_TEMPLATE_VERSION,
+                 evict_grace: float = EXPORT_EVICT_GRACE):
+        self.directory = Path(directory)
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self.evict_grace = evict_grace
+        self.template_version = template_version
+        self.renders = 0
+        self.hits = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._rendering: Dict[str, asyncio.Future] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned, not forked: the server process has threads and an event loop running
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def export(self, content: str, target_format: str) -> Path:
+        """Path of the rendered file, rendering it first if it is not cached."""
+        renderer = RENDERERS[target_format]
+        key = export_key(content, target_format, self.template_version)
+        path = self.directory / f"{key}.{target_format}"
+        try:
+            # Mark as recently used, which also keeps it out of eviction for a while
+            os.utime(path)
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            # Not rendered yet, or evicted by a concurrent export: render it
+            pass
+
+        pending = self._rendering.get(key)
+        if pending is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            loop = asyncio.get_running_loop()
+            pending = asyncio.ensure_future(loop.run_in_executor(self._pool(), renderer, content, str(path)))
+            self._rendering[key] = pending
+            pending.add_done_callback(lambda _: self._rendering.pop(key, None))
+            self.renders += 1
+            logger.info(f"Rendering {target_format} export {key[:12]} ({len(content)} chars)")
+        await asyncio.shield(pending)
+        await asyncio.to_thread(self._evict, path)
+        return path
+
+    def _evict(self, keep: Path):
+        recent = time.time() - self.evict_grace
+        files = []
+        for file in self.directory.iterdir():
+            if file.name.endswith('.tmp'):
+                continue
+            try:
+                files.append((file.stat().st_mtime, file))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        for mtime, old in files[:max(0, len(files) - self.max_files)]:
+            if old != keep and mtime < recent:
+                old.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {'renders': self.renders, 'cache_hits': self.hits, 'rendering': len(self._rendering)}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+document_exporter = DocumentExporter()
@@ -0,0 +1,200 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from dependencies import get_async_llm_client, model_registry, DEFAULT_MODEL
+from services.tracing import tracer
+from services.llm_scheduler import llm_scheduler, LLM_EXPECTED_COMPLETION_TOKENS
+from services.resilience import call_with_retries
+from services.cancellation import cancellation_stats
+from services.usage import usage_meter
+
+logger = logging.getLogger("aop_planner.llm")
+
+class LLMUnavailableError(Exception):
+    """Raised when no LLM client is configured."""
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Share one in-flight upstream call among identical concurrent requests.
+
+    The upstream task is cancelled only when every waiter has gone away, so
+    one caller disconnecting does not fail the others.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.upstream_calls += 1
+        else:
+            self.coalesced_calls += 1
+            logger.info(f"Coalesced LLM request onto in-flight call ({flight.waiters} waiting)")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            'upstream_calls': self.upstream_calls,
+            'coalesced_calls': self.coalesced_calls,
+            'in_flight': len(self._flights),
+        }
+
+single_flight = SingleFlight()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return len(text) // 4 + 1
+
+def prompt_chars(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(message.get('content') or '')) for message in messages)
+
+def token_budget(prompt_size: int, params: Dict[str, Any]) -> int:
+    """Tokens a request is charged against the provider rate limit before it runs."""
+    return prompt_size // 4 + 1 + (params.get('max_tokens') or LLM_EXPECTED_COMPLETION_TOKENS)
+
+def llm_usage(response, prompt_size: int) -> Dict[str, Any]:
+    """Token counts reported for a completion, estimated when the upstream omits them.
+
+    Accepts an OpenAI chat completion or a LangChain message.
+    """
+    usage = getattr(response, 'usage', None)
+    if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+        return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    if usage_metadata:
+        return {'prompt_tokens': usage_metadata.get('input_tokens'), 'completion_tokens': usage_metadata.get('output_tokens')}
+    content = getattr(response, 'content', None)
+    if content is None and getattr(response, 'choices', None):
+        content = response.choices[0].message.content
+    return {
+        'prompt_tokens': prompt_size // 4 + 1,
+        'completion_tokens': estimate_tokens(content or ''),
+        'tokens_estimated': True
+    }
+
+def request_key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    """Stable hash of everything that determines an LLM response."""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def completion_budget(params: Dict[str, Any]) -> int:
+    return params.get('max_tokens') or LLM_EXPECTED_COMPLETION_TOKENS
+
+async def scheduled_call(model: str, prompt_size: int, params: Dict[str, Any], request_fn: Callable[[], Awaitable[Any]]):
+    """One logical upstream call: admitted by the scheduler, retried, metered, and counted if cancelled."""
+    sent = False
+
+    async def attempt():
+        nonlocal sent
+        async with llm_scheduler.slot(model, token_budget(prompt_size, params)):
+            sent = True
+            started = time.monotonic()
+            response = await request_fn()
+            usage_meter.record(model, llm_usage(response, prompt_size), (time.monotonic() - started) * 1000)
+            return response
+
+    try:
+        return await call_with_retries(attempt)
+    except asyncio.CancelledError:
+        cancellation_stats.record_llm_call(not sent, prompt_size // 4 + 1, completion_budget(params))
+        raise
+
+async def chat_completion(messages: List[Dict[str, Any]], model: str = DEFAULT_MODEL, **params):
+    """Run a chat completion on the shared async client.
+
+    Identical concurrent requests (same model, messages and params) share a
+    single upstream call. Each attempt waits for a slot from the LLM
+    scheduler at the priority set with llm_request(); transient failures
+    are retried with backoff within the deadline set with llm_deadline().
+    """
+    client = get_async_llm_client()
+    if not client:
+        raise LLMUnavailableError("AI features are currently disabled.")
+
+    usage_meter.check_budget()
+    size = prompt_chars(messages)
+
+    async def call():
+        return await scheduled_call(model, size, params, lambda: client.chat.completions.create(
+            model=model, messages=messages, **params
+        ))
+
+    with tracer.span("chat_completion", "llm", model=model, prompt_chars=size) as span:
+        response = await single_flight.do(request_key(model, messages, params), call)
+        span.update(llm_usage(response, size))
+    return response
+
+async def invoke_chat_model(messages, model: str = DEFAULT_MODEL, temperature: float = 0.7):
+    """Invoke a registry chat model with LangChain messages, coalescing identical calls."""
+    llm = model_registry.chat_model(model, temperature=temperature)
+    serialized = [{'role': message.type, 'content': message.content} for message in messages]
+
+    usage_meter.check_budget()
+    size = prompt_chars(serialized)
+
+    async def call():
+        return await scheduled_call(model, size, {}, lambda: llm.ainvoke(messages))
+
+    with tracer.span("chat_model", "llm", model=model, prompt_chars=size) as span:
+        response = await single_flight.do(request_key(model, serialized, {'temperature': temperature}), call)
+        span.update(llm_usage(response, size))
+    return response
+
+async def stream_chat_completion(messages: List[Dict[str, Any]], model: str = DEFAULT_MODEL, **params):
+    """Yield content deltas of a streamed chat completion as they arrive."""
+    client = get_async_llm_client()
+    if not client:
+        raise LLMUnavailableError("AI features are currently disabled.")
+
+    usage_meter.check_budget()
+    size = prompt_chars(messages)
+    stream, received_chars, started = None, 0, 0.0
+    try:
+        async with llm_scheduler.slot(model, token_budget(size, params)):
+            # Only opening the stream is retried; tokens already sent can't be taken back
+            started = time.monotonic()
+            stream = await call_with_retries(
+                lambda: client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        received_chars += len(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+    except (asyncio.CancelledError, GeneratorExit):
+        # The consumer went away: the rest of the completion is never generated
+        cancellation_stats.record_llm_call(stream is None, size // 4 + 1, completion_budget(params) - received_chars // 4)
+        raise
+    finally:
+        if stream is not None:
+            # Streamed chunks carry no usage, so what was generated is estimated
+            usage_meter.record(model, {'prompt_tokens': size // 4 + 1, 'completion_tokens': received_chars // 4 + 1,
+                                       'tokens_estimated': True}, (time.monotonic() - started) * 1000)
@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from dependencies import LLM_MODEL_CONCURRENCY, LLM_MODEL_LIMITS
+
+logger = logging.getLogger("aop_planner.llm_scheduler")
+
+# Lower value is served first. Interactive requests are those a user is
+# actively waiting on (chat, analyze); workflow runs are long but still
+# user-facing; batch jobs run in the background.
+PRIORITIES = {"interactive": 0, "workflow": 1, "batch": 2}
+DEFAULT_PRIORITY = "workflow"
+
+# Upstream requests in flight across all models and users
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Requests one user may have in flight; background work has no user
+LLM_USER_CONCURRENCY = int(os.getenv("LLM_USER_CONCURRENCY", "4"))
+# Slots only interactive requests may take, so batch work can't fill the pool
+LLM_INTERACTIVE_RESERVE = int(os.getenv("LLM_INTERACTIVE_RESERVE", "2"))
+# Provider rate limits; 0 disables the corresponding bucket
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+# Completion tokens charged to the bucket when a request sets no max_tokens
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "1000"))
+# Recent queue waits kept per priority for the wait-time metrics
+LLM_SCHEDULER_WAIT_SAMPLES = 1000
+
+class LLMRequest(NamedTuple):
+    priority: str = DEFAULT_PRIORITY
+    user: Optional[str] = None
+    # Feature the calls are made for, e.g. "/api/analyze"; used for usage accounting
+    endpoint: Optional[str] = None
+
+# The LLM request the work started in this context belongs to
+_request_context: contextvars.ContextVar = contextvars.ContextVar("llm_request", default=LLMRequest())
+
+@contextmanager
+def llm_request(priority: str = DEFAULT_PRIORITY, user: Optional[str] = None,
+                endpoint: Optional[str] = None) -> Iterator[None]:
+    """Schedule LLM calls made inside the block (and tasks it starts) at this priority, for this user."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    token = _request_context.set(LLMRequest(priority, user, endpoint))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+def current_request() -> LLMRequest:
+    return _request_context.get()
+
+class TokenBucket:
+    """Continuously refilled budget of per_minute units; per_minute <= 0 means unlimited."""
+
+    def __init__(self, per_minute: int, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.clock = clock
+        self._updated = clock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self):
+        now = self.clock()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken; requests above capacity wait for a full bucket."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available) / self.rate)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self._refill()
+            self.available -= min(amount, self.capacity)
+
+class _Waiter:
+    def __init__(self, priority: str, seq: int, model: str, user: Optional[str], tokens: int,
+                 future: asyncio.Future):
+        self.priority = priority
+        self.rank = (PRIORITIES[priority], seq)
+        self.model = model
+        self.user = user
+        self.tokens = tokens
+        self.future = future
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+class LLMScheduler:
+    """Admits upstream LLM requests by priority within concurrency and rate limits.
+
+    Waiting requests are served highest priority first, oldest first within
+    a priority. A request is admitted when the global cap, its model's cap
+    and its user's cap all have room; one blocked only by its own user or
+    model cap lets the next request go ahead. Rate limits are strict: when
+    the token or request bucket is short for the next admissible request,
+    nothing behind it is admitted until the bucket refills, so large
+    high-priority requests are not starved by small batch ones.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, user_concurrency: int = LLM_USER_CONCURRENCY,
+                 interactive_reserve: int = LLM_INTERACTIVE_RESERVE,
+                 model_limits: Optional[Dict[str, int]] = None, model_concurrency: int = LLM_MODEL_CONCURRENCY,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE):
+        self.max_concurrency = max_concurrency
+        self.user_concurrency = user_concurrency
+        self.interactive_reserve = min(interactive_reserve, max_concurrency - 1)
+        self.model_limits = LLM_MODEL_LIMITS if model_limits is None else model_limits
+        self.model_concurrency = model_concurrency
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self._seq = itertools.count()
+        self._waiting: List[_Waiter] = []
+        self._active = 0
+        self._active_by_model: Dict[str, int] = defaultdict(int)
+        self._active_by_user: Dict[str, int] = defaultdict(int)
+        self._active_by_priority: Dict[str, int] = defaultdict(int)
+        self._timer: Optional[tuple] = None
+        self._admitted: Dict[str, int] = defaultdict(int)
+        self._abandoned: Dict[str, int] = defaultdict(int)
+        self._waits: Dict[str, deque] = defaultdict(lambda: deque(maxlen=LLM_SCHEDULER_WAIT_SAMPLES))
+
+    def model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_concurrency)
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0):
+        """Hold one upstream request slot for model, charging tokens to the rate limit."""
+        priority, user, _ = _request_context.get()
+        waiter = _Waiter(priority, next(self._seq), model, user, tokens,
+                         asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.granted:
+                self._release(waiter)
+            else:
+                self._waiting.remove(waiter)
+                self._abandoned[priority] += 1
+                self._dispatch()
+            raise
+        self._waits[priority].append(time.monotonic() - waiter.enqueued)
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _admissible(self, waiter: _Waiter) -> bool:
+        if PRIORITIES[waiter.priority] > 0 and self._active >= self.max_concurrency - self.interactive_reserve:
+            return False
+        if waiter.user is not None and self._active_by_user.get(waiter.user, 0) >= self.user_concurrency:
+            return False
+        return self._active_by_model[waiter.model] < self.model_limit(waiter.model)
+
+    def _dispatch(self):
+        for waiter in sorted(self._waiting, key=lambda w: w.rank):
+            if self._active >= self.max_concurrency:
+                break
+            if not self._admissible(waiter):
+                continue
+            delay = max(self.tokens.wait_time(waiter.tokens), self.requests.wait_time(1))
+            if delay > 0:
+                self._schedule(delay)
+                break
+            self.tokens.take(waiter.tokens)
+            self.requests.take(1)
+            self._grant(waiter)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        # A timer left on a loop that has since closed would never fire
+        if self._timer is None or self._timer[0] is not loop:
+            self._timer = (loop, loop.call_later(delay, self._on_timer))
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _grant(self, waiter: _Waiter):
+        self._waiting.remove(waiter)
+        waiter.granted = True
+        self._active += 1
+        self._active_by_model[waiter.model] += 1
+        self._active_by_priority[waiter.priority] += 1
+        if waiter.user is not None:
+            self._active_by_user[waiter.user] += 1
+        self._admitted[waiter.priority] += 1
+        if not waiter.future.done():
+            waiter.future.set_result(None)
+
+    def _release(self, waiter: _Waiter):
+        self._active -= 1
+        self._active_by_model[waiter.model] -= 1
+        self._active_by_priority[waiter.priority] -= 1
+        if waiter.user is not None:
+            self._active_by_user[waiter.user] -= 1
+            if not self._active_by_user[waiter.user]:
+                del self._active_by_user[waiter.user]
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        priorities = {}
+        for priority in PRIORITIES:
+            waits = sorted(self._waits[priority])
+            queued = [w for w in self._waiting if w.priority == priority]
+            priorities[priority] = {
+                'queued': len(queued),
+                'in_flight': self._active_by_priority[priority],
+                'admitted': self._admitted[priority],
+                'abandoned': self._abandoned[priority],
+                'oldest_queued_ms': round(max((now - w.enqueued for w in queued), default=0) * 1000, 1),
+                'wait_ms_avg': round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                'wait_ms_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                'wait_ms_max': round(waits[-1] * 1000, 1) if waits else 0.0,
+            }
+        return {
+            'in_flight': self._active,
+            'queued': len(self._waiting),
+            'max_concurrency': self.max_concurrency,
+            'user_concurrency': self.user_concurrency,
+            'interactive_reserve': self.interactive_reserve,
+            'tokens_available': None if self.tokens.unlimited else round(self.tokens.available),
+            'requests_available': None if self.requests.unlimited else round(self.requests.available),
+            'by_model': {model: count for model, count in self._active_by_model.items() if count},
+            'by_priority': priorities,
+        }
+
+llm_scheduler = LLMScheduler()
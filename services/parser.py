@@ -1,13 +1,211 @@
 import os
+import re
 import logging
+import threading
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from datetime import datetime
 import docx
+from docx.oxml.ns import qn
 import PyPDF2
 import fitz  # PyMuPDF
 import markdown
 
 logger = logging.getLogger("aop_planner.parser")
 
+# PDF extraction tuning. PyMuPDF holds the GIL while extracting, so large
+# documents are split into page chunks and extracted in worker processes.
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", "64"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "128"))
+PDF_MAX_WORKERS = int(os.getenv("PDF_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+def _pypdf2_page_text(reader, index):
+    """Extract a single page with PyPDF2, returning '' on failure."""
+    try:
+        return reader.pages[index].extract_text() or ""
+    except Exception as e:
+        logger.warning(f"PyPDF2 failed on page {index}: {e}")
+        return ""
+
+def _extract_pdf_chunk(filepath, start, stop):
+    """Extract pages [start, stop) with PyMuPDF, falling back to PyPDF2 per page."""
+    pages = []
+    fallback_reader = None
+    doc = fitz.open(filepath)
+    try:
+        for index in range(start, stop):
+            try:
+                page_text = doc[index].get_text()
+            except Exception as e:
+                logger.warning(f"PyMuPDF failed on page {index}: {e}")
+                page_text = ""
+            if not page_text.strip():
+                if fallback_reader is None:
+                    fallback_reader = PyPDF2.PdfReader(filepath)
+                page_text = _pypdf2_page_text(fallback_reader, index)
+            pages.append(page_text)
+    finally:
+        doc.close()
+    return pages
+
+# Shared by all parses and created on first use. Workers are spawned rather
+# than forked: the server process runs threads (event loop, to_thread workers)
+# that a fork would copy mid-flight.
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _pdf_executor():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+def _pdf_chunks(page_count):
+    return [(start, min(start + PDF_CHUNK_PAGES, page_count))
+            for start in range(0, page_count, PDF_CHUNK_PAGES)]
+
+def iter_pdf_pages(filepath):
+    """Yield the text of every PDF page, in order.
+
+    PyMuPDF is used as the primary engine since it is several times faster
+    than PyPDF2; PyPDF2 is only consulted for pages PyMuPDF returns empty.
+    Documents above PDF_PARALLEL_MIN_PAGES are extracted in parallel chunks,
+    with at most one chunk per worker held in memory ahead of the consumer.
+    """
+    try:
+        with fitz.open(filepath) as doc:
+            page_count = doc.page_count
+    except Exception as e:
+        # PyMuPDF cannot open the file at all, try PyPDF2 for the whole document
+        logger.warning(f"PyMuPDF could not open PDF, falling back to PyPDF2: {e}")
+        with open(filepath, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for i in range(len(reader.pages)):
+                yield _pypdf2_page_text(reader, i)
+        return
+
+    chunks = _pdf_chunks(page_count)
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_MAX_WORKERS <= 1 or len(chunks) == 1:
+        for start, stop in chunks:
+            yield from _extract_pdf_chunk(filepath, start, stop)
+        return
+
+    workers = min(PDF_MAX_WORKERS, len(chunks))
+    executor = _pdf_executor()
+    pending = deque()
+    remaining = iter(chunks)
+    try:
+        for start, stop in islice(remaining, workers):
+            pending.append(executor.submit(_extract_pdf_chunk, filepath, start, stop))
+        while pending:
+            pages = pending.popleft().result()
+            for start, stop in islice(remaining, 1):
+                pending.append(executor.submit(_extract_pdf_chunk, filepath, start, stop))
+            yield from pages
+    finally:
+        # The consumer stopped early: don't leave chunks queued on the shared pool
+        for future in pending:
+            future.cancel()
+
+def extract_pdf_pages(filepath):
+    """Extract the text of every PDF page, in order."""
+    return list(iter_pdf_pages(filepath))
+
+# Structured DOCX content. kind is 'heading', 'paragraph', 'list_item' or
+# 'table_row'; level is the heading level (0 for the Title style).
+DocEvent = namedtuple('DocEvent', ['kind', 'text', 'level'])
+
+W_P, W_TBL, W_TR, W_TC, W_SDT, W_SDT_CONTENT = (
+    qn('w:p'), qn('w:tbl'), qn('w:tr'), qn('w:tc'), qn('w:sdt'), qn('w:sdtContent'))
+W_T, W_OUTLINE_LVL = qn('w:t'), qn('w:outlineLvl')
+DOCX_TEXT_NODES = {W_T: None, qn('w:tab'): '\t', qn('w:br'): '\n', qn('w:cr'): '\n'}
+
+def _docx_text(element):
+    """Text of all runs under an element, joined once."""
+    return "".join((node.text or '') if node.tag == W_T else DOCX_TEXT_NODES[node.tag]
+                   for node in element.iter(*DOCX_TEXT_NODES))
+
+def _docx_heading_level(paragraph, style_names):
+    """Heading level from the paragraph style or outline level, else None."""
+    name = style_names.get(paragraph.style, '')
+    if name == 'Title':
+        return 0
+    if name.startswith('Heading '):
+        suffix = name[len('Heading '):]
+        if suffix.isdigit():
+            return int(suffix)
+    if paragraph.pPr is not None:
+        outline = paragraph.pPr.find(W_OUTLINE_LVL)
+        if outline is not None and outline.get(qn('w:val'), '').isdigit():
+            return int(outline.get(qn('w:val'))) + 1
+    return None
+
+def _iter_docx_blocks(container, style_names):
+    for child in container.iterchildren():
+        if child.tag == W_P:
+            level = _docx_heading_level(child, style_names)
+            if level is not None:
+                yield DocEvent('heading', _docx_text(child), level)
+            elif style_names.get(child.style, '').startswith('List'):
+                yield DocEvent('list_item', _docx_text(child), None)
+            else:
+                yield DocEvent('paragraph', _docx_text(child), None)
+        elif child.tag == W_TBL:
+            for row in child.iterchildren(W_TR):
+                cells = (" ".join(_docx_text(p) for p in cell.iter(W_P)) for cell in row.iterchildren(W_TC))
+                yield DocEvent('table_row', " | ".join(cells), None)
+        elif child.tag == W_SDT:
+            content = child.find(W_SDT_CONTENT)
+            if content is not None:
+                yield from _iter_docx_blocks(content, style_names)
+
+def iter_docx_events(filepath):
+    """Walk a DOCX body once, in order, yielding headings, paragraphs and table rows."""
+    doc = docx.Document(filepath)
+    style_names = {style.style_id: style.name for style in doc.styles}
+    yield from _iter_docx_blocks(doc.element.body, style_names)
+
+def render_docx_event(event):
+    """Render a DocEvent as a Markdown line."""
+    if event.kind == 'heading':
+        return '#' * min(max(event.level, 1), 6) + ' ' + event.text
+    if event.kind == 'list_item':
+        return '- ' + event.text
+    if event.kind == 'table_row':
+        return '| ' + event.text + ' |'
+    return event.text
+
+def iter_document(filepath, filename):
+    """Yield a document's text piece by piece as it is extracted.
+
+    PDFs yield one page at a time, DOCX files one Markdown-rendered block at
+    a time and text/markdown files one line at a time, so peak memory is bounded by the
+    largest piece. The concatenation of all pieces equals parse_document's
+    content.
+    """
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+    if ext in ['txt', 'md']:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from f
+    elif ext == 'pdf':
+        for page in iter_pdf_pages(filepath):
+            yield page + "\n"
+    elif ext in ['doc', 'docx']:
+        for event in iter_docx_events(filepath):
+            yield render_docx_event(event) + "\n"
+
 def parse_document(filepath, filename):
     """Parse different document formats and extract text."""
     ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -19,33 +217,16 @@ def parse_document(filepath, filename):
                 text = f.read()
                 
         elif ext == 'pdf':
-            # Method 1: Try PyPDF2
             try:
-                with open(filepath, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    for page in pdf_reader.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + "\n"
-            except:
-                pass
-                
-            # Method 2: Fallback to PyMuPDF if empty or failed
-            if not text.strip():
-                try:
-                    doc = fitz.open(filepath)
-                    for page in doc:
-                        text += page.get_text() + "\n"
-                except Exception as e:
-                    logger.error(f"PDF parsing error: {e}")
-                    if not text:
-                        text = f"Error parsing PDF: {str(e)}"
-                    
+                pages = extract_pdf_pages(filepath)
+                text = "".join(page + "\n" for page in pages)
+            except Exception as e:
+                logger.error(f"PDF parsing error: {e}")
+                text = f"Error parsing PDF: {str(e)}"
+
         elif ext in ['doc', 'docx']:
             try:
-                doc = docx.Document(filepath)
-                for paragraph in doc.paragraphs:
-                    text += paragraph.text + "\n"
+                text = "".join(render_docx_event(event) + "\n" for event in iter_docx_events(filepath))
             except Exception as e:
                 logger.error(f"DOCX parsing error: {e}")
                 text = f"Error parsing DOCX: {str(e)}"
@@ -58,6 +239,9 @@ def parse_document(filepath, filename):
         logger.error(f"Error parsing document {filename}: {e}")
         text = f"Error parsing document: {str(e)}"
     
+    return _document_result(filename, text)
+
+def _document_result(filename, text):
     return {
         'filename': filename,
         'content': text,
@@ -66,45 +250,225 @@ def parse_document(filepath, filename):
         'parsed_at': datetime.now().isoformat()
     }
 
-def parse_prd_structure(text):
-    """Parse PRD and extract structured information."""
-    sections = {
-        'overview': '',
-        'objectives': '',
-        'scope': '',
-        'features': '',
-        'user_stories': '',
-        'requirements': '',
-        'success_metrics': '',
-        'timeline': '',
-        'risks': ''
-    }
-    
-    lines = text.split('\n')
-    current_section = None
-    
-    for line in lines:
-        line_lower = line.strip().lower()
-        
-        if any(keyword in line_lower for keyword in ['overview', 'introduction', 'background']):
-            current_section = 'overview'
-        elif any(keyword in line_lower for keyword in ['objectives', 'goals', 'purpose']):
-            current_section = 'objectives'
-        elif any(keyword in line_lower for keyword in ['scope', 'in scope', 'out of scope']):
-            current_section = 'scope'
-        elif any(keyword in line_lower for keyword in ['features', 'functionality']):
-            current_section = 'features'
-        elif any(keyword in line_lower for keyword in ['user stories', 'user personas', 'user journey']):
-            current_section = 'user_stories'
-        elif any(keyword in line_lower for keyword in ['requirements', 'functional requirements', 'non-functional']):
-            current_section = 'requirements'
-        elif any(keyword in line_lower for keyword in ['success metrics', 'kpis', 'metrics']):
-            current_section = 'success_metrics'
-        elif any(keyword in line_lower for keyword in ['timeline', 'milestones', 'schedule']):
-            current_section = 'timeline'
-        elif any(keyword in line_lower for keyword in ['risks', 'assumptions', 'constraints']):
-            current_section = 'risks'
-        elif line.strip() and current_section:
-            sections[current_section] += line + '\n'
-    
-    return sections
+def parse_docx_document(filepath, filename, classifier=None):
+    """Parse a DOCX file and its PRD structure from a single walk of the body.
+
+    Returns (parsed_data, structure). Sections come from the document's
+    heading styles rather than from guessing which lines look like titles.
+    """
+    try:
+        events = list(iter_docx_events(filepath))
+    except Exception as e:
+        logger.error(f"DOCX parsing error: {e}")
+        text = f"Error parsing DOCX: {str(e)}"
+        return _document_result(filename, text), parse_prd_structure(text, classifier)
+
+    text = "".join(render_docx_event(event) + "\n" for event in events)
+    return _document_result(filename, text), parse_prd_structure(events, classifier)
+
+# Section vocabulary: section key -> heading keywords, matched on whole words.
+# Pass a different mapping to SectionClassifier to recognise other templates.
+SECTION_VOCABULARY = {
+    'overview': ['overview', 'introduction', 'background', 'executive summary', 'summary'],
+    'objectives': ['objectives', 'objective', 'goals', 'goal', 'purpose'],
+    'scope': ['scope', 'in scope', 'out of scope'],
+    'features': ['features', 'feature', 'functionality'],
+    'user_stories': ['user stories', 'user story', 'user personas', 'personas', 'user journey', 'use cases'],
+    'requirements': ['requirements', 'requirement', 'functional requirements', 'non-functional'],
+    'success_metrics': ['success metrics', 'kpis', 'kpi', 'metrics'],
+    'timeline': ['timeline', 'milestones', 'schedule'],
+    'risks': ['risks', 'risk', 'assumptions', 'constraints'],
+}
+
+PRD_SECTIONS = list(SECTION_VOCABULARY)
+
+# A run of PRD text under one heading. key is None for text before the first heading.
+Section = namedtuple('Section', ['key', 'heading', 'content'])
+
+MARKDOWN_HEADING = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)[\s#]*$')
+EMPHASIS_HEADING = re.compile(r'^\s*(\*\*|__)(.+?)\1\s*:?\s*$')
+NUMBERED_HEADING = re.compile(r'^\s*(?:\d+(?:\.\d+)*[.)]?|[IVX]+\.)\s+(.+)$')
+# Small words allowed in lower case inside a plain title ("Goals and Objectives")
+TITLE_CONNECTORS = {'and', 'or', 'of', 'the', 'for', 'to', 'in', 'on', 'a', 'an', 'vs', 'with'}
+
+class SectionClassifier:
+    """Map heading-like lines to PRD sections with a single compiled regex.
+
+    Only Markdown headings, bold/numbered titles and short title lines are
+    considered, so body text that merely mentions "metrics" or "scope" does
+    not open a new section. The leftmost (then longest) keyword wins.
+    Numbered and plain lines look like list items and sentences as often as
+    like titles, so they must start with the keyword and read as a title
+    ("2. Success Metrics", not "2. Track conversion metrics weekly").
+    """
+
+    def __init__(self, vocabulary=None, max_title_words=8, max_title_chars=80):
+        self.vocabulary = vocabulary or SECTION_VOCABULARY
+        self.sections = list(self.vocabulary)
+        self.max_title_words = max_title_words
+        self.max_title_chars = max_title_chars
+        self._keyword_section = {}
+        for section, keywords in self.vocabulary.items():
+            for keyword in keywords:
+                self._keyword_section.setdefault(keyword.lower(), section)
+        alternation = '|'.join(re.escape(k) for k in sorted(self._keyword_section, key=len, reverse=True))
+        self._pattern = re.compile(rf'\b(?:{alternation})\b', re.IGNORECASE)
+
+    def _heading(self, line):
+        """(title, explicit) of a heading-like line, or (None, False) for body text.
+
+        explicit is True for Markdown and bold headings, which are headings
+        whatever their wording.
+        """
+        stripped = line.strip()
+        if not stripped:
+            return None, False
+        if stripped[0] == '#':
+            match = MARKDOWN_HEADING.match(stripped)
+            return (match.group(1), True) if match else (None, False)
+        match = EMPHASIS_HEADING.match(stripped)
+        if match:
+            return match.group(2), True
+        if len(stripped) > self.max_title_chars or stripped[0] in '-*+>|':
+            return None, False
+        match = NUMBERED_HEADING.match(stripped)
+        if match:
+            stripped = match.group(1)
+        if stripped[-1] in '.,;!?':
+            return None, False
+        head, colon, tail = stripped.partition(':')
+        if colon and tail.strip():
+            return None, False
+        if head.count(' ') >= self.max_title_words:
+            return None, False
+        return head, False
+
+    def heading_text(self, line):
+        """Return the title of a heading-like line, or None for body text."""
+        return self._heading(line)[0]
+
+    def _title_section(self, title):
+        """Section of a plain or numbered title that starts with a keyword and reads as a title."""
+        title = title.strip()
+        match = self._pattern.match(title)
+        if not match:
+            return None
+        rest = re.sub(r'\([^)]*\)', ' ', title[match.end():])
+        for word in re.findall(r'[^\W_]+', rest):
+            if not (word[0].isupper() or word[0].isdigit() or word.lower() in TITLE_CONNECTORS
+                    or word.lower() in self._keyword_section):
+                return None
+        return self._keyword_section[match.group(0).lower()]
+
+    def classify_heading(self, title):
+        """Return the section a known heading opens, or None."""
+        match = self._pattern.search(title)
+        return self._keyword_section[match.group(0).lower()] if match else None
+
+    def classify_line(self, line):
+        """Return the PRD section a line opens, or None for body text."""
+        title, explicit = self._heading(line)
+        if not title:
+            return None
+        return self.classify_heading(title) if explicit else self._title_section(title)
+
+    def mentioned_sections(self, text):
+        """Return the sections whose keywords occur anywhere in text, in order of first mention."""
+        found = []
+        for match in self._pattern.finditer(text):
+            section = self._keyword_section[match.group(0).lower()]
+            if section not in found:
+                found.append(section)
+        return found
+
+default_classifier = SectionClassifier()
+
+def classify_line(line):
+    """Return the PRD section a line opens, or None for body text."""
+    return default_classifier.classify_line(line)
+
+def iter_lines(chunks):
+    """Re-split a stream of text chunks into lines, without trailing newlines."""
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        if '\n' not in chunk:
+            continue
+        lines = pending.split('\n')
+        pending = lines.pop()
+        yield from lines
+    yield pending
+
+def iter_prd_sections(chunks, classifier=None):
+    """Incrementally split a stream of text chunks into PRD sections.
+
+    Each Section is yielded as soon as the next heading (or the end of the
+    stream) closes it, so callers see the first sections before the last
+    page has been extracted. Only the section being built is held in memory.
+    """
+    classify = (classifier or default_classifier).classify_line
+    key, heading, body = None, None, []
+
+    for line in iter_lines(chunks):
+        section = classify(line)
+        if section:
+            if key or body:
+                yield Section(key, heading, "".join(body))
+            key, heading, body = section, line, []
+        elif line.strip():
+            body.append(line + '\n')
+
+    if key or body:
+        yield Section(key, heading, "".join(body))
+
+def iter_event_sections(events, classifier=None):
+    """Split DocEvents into PRD sections.
+
+    Heading events open sections. Documents whose headings are only plain
+    or bold Normal paragraphs (no heading opens a known section) fall back
+    to classifying paragraph lines the way plain text is classified.
+    """
+    classifier = classifier or default_classifier
+    events = list(events)
+    styled = any(event.kind == 'heading' and classifier.classify_heading(event.text) for event in events)
+    key, heading, body = None, None, []
+
+    for event in events:
+        if event.kind == 'heading':
+            section = classifier.classify_heading(event.text)
+        elif event.kind == 'paragraph' and not styled:
+            section = classifier.classify_line(event.text)
+        else:
+            section = None
+        if section:
+            if key or body:
+                yield Section(key, heading, "".join(body))
+            key, heading, body = section, event.text, []
+        elif event.text.strip():
+            body.append(render_docx_event(event) + '\n')
+
+    if key or body:
+        yield Section(key, heading, "".join(body))
+
+def iter_document_sections(filepath, filename, classifier=None):
+    """Stream a document from disk straight into PRD sections."""
+    return iter_prd_sections(iter_document(filepath, filename), classifier)
+
+def parse_prd_structure(text, classifier=None):
+    """Parse PRD and extract structured information.
+
+    text may also be a sequence of DocEvents from iter_docx_events, in which
+    case headings are taken from the document instead of being guessed.
+    """
+    classifier = classifier or default_classifier
+    parts = {key: [] for key in classifier.sections}
+    if isinstance(text, str):
+        sections = iter_prd_sections([text], classifier)
+    else:
+        sections = iter_event_sections(text, classifier)
+
+    for section in sections:
+        if section.key:
+            parts[section.key].append(section.content)
+
+    return {key: "".join(contents) for key, contents in parts.items()}
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import openai
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception
+
+logger = logging.getLogger("aop_planner.resilience")
+
+# Attempts per LLM call, the first one included
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "4"))
+# Exponential backoff with full jitter: up to base * 2^n seconds, capped at max
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+# Consecutive upstream failures that open the circuit, and how long it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Seconds an endpoint may spend on its LLM work, retries and queueing included;
+# LLM_DEADLINES overrides per endpoint, e.g. '{"chat": 30}'
+LLM_DEADLINES = {
+    "chat": 60.0,
+    "analyze": 120.0,
+    "workflow": 300.0,
+    "batch": 600.0,
+    **json.loads(os.getenv("LLM_DEADLINES", "{}"))
+}
+
+# Status codes worth another attempt: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429}
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when an endpoint's LLM work runs past its deadline."""
+
+# Absolute time.monotonic() deadline of the LLM work in this context
+_deadline: contextvars.ContextVar = contextvars.ContextVar("llm_deadline", default=None)
+
+@contextmanager
+def llm_deadline(endpoint: str) -> Iterator[None]:
+    """Bound the LLM calls made inside the block by the endpoint's deadline.
+
+    Nested deadlines never extend an outer one.
+    """
+    seconds = LLM_DEADLINES[endpoint]
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def _status(exc: BaseException) -> Optional[int]:
+    return exc.status_code if isinstance(exc, openai.APIStatusError) else None
+
+def is_retryable(exc: BaseException) -> bool:
+    status = _status(exc)
+    return isinstance(exc, openai.APIConnectionError) or (status is not None and (status in RETRYABLE_STATUS or status >= 500))
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Failures that say the upstream is unhealthy; rate limiting and bad requests don't."""
+    status = _status(exc)
+    return isinstance(exc, openai.APIConnectionError) or (status is not None and status >= 500)
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the upstream asked us to wait, from Retry-After or retry-after-ms."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """Fails fast while the upstream is down.
+
+    After threshold consecutive upstream failures (transport errors and
+    5xx replies; any other reply resets the count) the circuit opens and
+    calls raise CircuitOpenError at once. When the cooldown has passed one
+    trial call is let through (half-open): success closes the circuit,
+    failure opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial):
+            self.rejected += 1
+            raise CircuitOpenError("The AI service is temporarily unavailable; please retry shortly.")
+        if state == "half_open":
+            self._trial = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self, exc: BaseException):
+        if not is_upstream_failure(exc):
+            # Any 4xx is an answer from an upstream that is up, so it breaks
+            # a run of failures like a success does
+            if self._trial or _status(exc) is not None:
+                self.record_success()
+            return
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            if self.opened_at is None or self._trial:
+                logger.warning(f"LLM circuit opened after {self.failures} consecutive failures: {exc}")
+                self.opened += 1
+            self.opened_at = self.clock()
+            self._trial = False
+
+    def release_trial(self):
+        """Give up a trial call that ended without an outcome (e.g. cancelled)."""
+        self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.opened,
+            "rejected_calls": self.rejected,
+        }
+
+llm_breaker = CircuitBreaker()
+
+# Process-wide counters reported next to the breaker state
+retry_stats = {"retries": 0, "deadline_exceeded": 0}
+
+class _RetryPolicy:
+    """tenacity stop and wait sharing one planned delay per retry."""
+
+    def __init__(self, attempts: int, base_delay: float, max_delay: float):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _plan(self, retry_state: RetryCallState) -> float:
+        delay = retry_after(retry_state.outcome.exception())
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry_state.attempt_number - 1)))
+        return delay
+
+    def stop(self, retry_state: RetryCallState) -> bool:
+        if retry_state.attempt_number >= self.attempts:
+            return True
+        retry_state.planned_delay = self._plan(retry_state)
+        if retry_state.planned_delay > self.max_delay:
+            # The upstream wants a longer pause than we are willing to wait
+            return True
+        remaining = remaining_time()
+        # No point sleeping past the deadline
+        return remaining is not None and retry_state.planned_delay >= remaining
+
+    def wait(self, retry_state: RetryCallState) -> float:
+        return retry_state.planned_delay
+
+def _log_retry(retry_state: RetryCallState):
+    retry_stats["retries"] += 1
+    logger.warning(f"LLM call failed ({retry_state.outcome.exception()}); "
+                   f"retry {retry_state.attempt_number} in {retry_state.next_action.sleep:.1f}s")
+
+async def call_with_retries(fn: Callable[[], Awaitable[Any]], breaker: Optional[CircuitBreaker] = None,
+                            attempts: int = LLM_RETRY_ATTEMPTS, base_delay: float = LLM_RETRY_BASE_DELAY,
+                            max_delay: float = LLM_RETRY_MAX_DELAY) -> Any:
+    """Run fn, retrying transient upstream errors within the current deadline.
+
+    Rate limits (429) and server errors are retried with jittered
+    exponential backoff, or after the delay the upstream sent in
+    Retry-After (giving up if that is longer than max_delay). Every attempt first checks the circuit breaker, and the
+    whole call raises LLMDeadlineExceeded once the deadline set with
+    llm_deadline() has passed.
+    """
+    breaker = breaker or llm_breaker
+    policy = _RetryPolicy(attempts, base_delay, max_delay)
+    retrying = AsyncRetrying(
+        retry=retry_if_exception(is_retryable),
+        stop=policy.stop,
+        wait=policy.wait,
+        before_sleep=_log_retry,
+        reraise=True
+    )
+    async for attempt in retrying:
+        with attempt:
+            breaker.before_call()
+            remaining = remaining_time()
+            try:
+                if remaining is None:
+                    result = await fn()
+                elif remaining <= 0:
+                    raise asyncio.TimeoutError()
+                else:
+                    result = await asyncio.wait_for(fn(), remaining)
+            except asyncio.TimeoutError:
+                breaker.release_trial()
+                retry_stats["deadline_exceeded"] += 1
+                raise LLMDeadlineExceeded("The AI request did not finish within its deadline.")
+            except asyncio.CancelledError:
+                breaker.release_trial()
+                raise
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            breaker.record_success()
+    return result
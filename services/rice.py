@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import logging
+
+from dependencies import get_async_llm_client, DEFAULT_MODEL, DATA_DIR
+from services.cache import ResultCache, content_hash
+from services.llm import chat_completion, estimate_tokens
+from services.parser import iter_prd_sections
+from services.usage import LLMBudgetExceeded
+
+logger = logging.getLogger("aop_planner.rice")
+
+# Bump whenever RICE_SYSTEM_PROMPT changes so cached results are not reused
+RICE_PROMPT_VERSION = "1"
+RICE_SYSTEM_PROMPT = "You are a product management consultant. Analyze the provided PRD and extract RICE (Reach, Impact, Confidence, Effort) scores.\n\nReach: Number of users/customers affected (e.g., 500, 10000).\nImpact: Value to the user (0.25 to 3.0: 3=Massive, 2=High, 1=Medium, 0.5=Low, 0.25=Minimal).\nConfidence: Percentage certainty (50% to 100%).\nEffort: Person-months (e.g., 0.5, 3.0).\n\nReturn ONLY a JSON object with keys: reach, impact, confidence, effort, total_score, and verdict (a 1-sentence strategic summary)."
+
+RICE_EVIDENCE_PROMPT = "You are a product management consultant. The text is one part of a larger PRD. Extract only the evidence relevant to RICE scoring: who and how many users are affected (reach), the value delivered (impact), facts or unknowns affecting certainty (confidence) and the work involved (effort).\n\nReturn ONLY a JSON object with keys: reach, impact, confidence, effort (each a short string of evidence, empty if the part has none)."
+RICE_MERGE_PROMPT = "You are a product management consultant. Merge the RICE evidence collected from several parts of a PRD into one concise summary, keeping concrete numbers.\n\nReturn ONLY a JSON object with keys: reach, impact, confidence, effort (each a short string of evidence)."
+
+# Upper bound on prompt tokens for any single RICE request; larger PRDs are
+# split into section-aligned chunks and analyzed map-reduce style.
+RICE_MAX_PROMPT_TOKENS = int(os.getenv("RICE_MAX_PROMPT_TOKENS", "12000"))
+RICE_MAP_CONCURRENCY = int(os.getenv("RICE_MAP_CONCURRENCY", "4"))
+
+rice_cache = ResultCache(
+    DATA_DIR / "rice_cache.json",
+    ttl=float(os.getenv("RICE_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("RICE_CACHE_MAX_ENTRIES", "500")),
+)
+
+def rice_cache_key(content: str, model: str = DEFAULT_MODEL) -> str:
+    return f"{content_hash(content)}:{model}:{RICE_PROMPT_VERSION}"
+
+async def get_rice_analysis(content: str, model: str = DEFAULT_MODEL):
+    """Extract RICE scores from PRD content using AI."""
+    cache_key = rice_cache_key(content, model)
+    # The cache reads and rewrites its whole JSON file; keep that off the event loop
+    cached = await asyncio.to_thread(rice_cache.get, cache_key)
+    if cached is not None:
+        logger.info("RICE analysis served from cache")
+        return cached
+
+    client = get_async_llm_client()
+    if not client:
+        return None
+
+    try:
+        if estimate_tokens(content) + estimate_tokens(RICE_SYSTEM_PROMPT) <= RICE_MAX_PROMPT_TOKENS:
+            rice_data = await _ask_json(RICE_SYSTEM_PROMPT, f"Analyze this PRD for RICE scores:\n\n{content}", model)
+        else:
+            rice_data = await _map_reduce_rice(content, model)
+    except LLMBudgetExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"RICE extraction error: {e}")
+        return None
+
+    await asyncio.to_thread(rice_cache.set, cache_key, rice_data)
+    return rice_data
+
+async def _ask_json(system_prompt: str, user_content: str, model: str) -> dict:
+    response = await chat_completion(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ],
+        model=model,
+        response_format={ "type": "json_object" }
+    )
+    return json.loads(response.choices[0].message.content)
+
+def _split_oversized(text: str, budget: int):
+    """Split text on line boundaries into pieces of at most budget tokens."""
+    piece, piece_tokens = [], 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line)
+        if piece and piece_tokens + line_tokens > budget:
+            yield "".join(piece)
+            piece, piece_tokens = [], 0
+        if line_tokens > budget:
+            # A single enormous line: cut it by characters
+            step = budget * 4
+            for start in range(0, len(line), step):
+                yield line[start:start + step]
+            continue
+        piece.append(line)
+        piece_tokens += line_tokens
+    if piece:
+        yield "".join(piece)
+
+def pack_chunks(pieces, budget: int):
+    """Greedily pack consecutive pieces into chunks of at most budget tokens."""
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > budget:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def chunk_prd(content: str, budget: int):
+    """Split a PRD into section-aligned chunks of at most budget tokens."""
+    pieces = []
+    for section in iter_prd_sections([content]):
+        text = f"{section.heading}\n{section.content}" if section.heading else section.content
+        pieces.extend(_split_oversized(text, budget))
+    return pack_chunks(pieces, budget)
+
+def _evidence_line(evidence: str, budget: int) -> str:
+    """One evidence entry on its own line, cut to at most budget tokens."""
+    if estimate_tokens(evidence + "\n") > budget:
+        evidence = evidence[:max(0, budget - 2) * 4] + "..."
+    return evidence + "\n"
+
+async def _map_chunks(system_prompt: str, chunks, model: str):
+    """Run one JSON request per chunk, at most RICE_MAP_CONCURRENCY at a time."""
+    semaphore = asyncio.Semaphore(RICE_MAP_CONCURRENCY)
+
+    async def one(chunk):
+        async with semaphore:
+            return await _ask_json(system_prompt, chunk, model)
+
+    return await asyncio.gather(*(one(chunk) for chunk in chunks))
+
+async def _map_reduce_rice(content: str, model: str) -> dict:
+    """RICE analysis for PRDs that do not fit in one request."""
+    budget = RICE_MAX_PROMPT_TOKENS - estimate_tokens(RICE_EVIDENCE_PROMPT + RICE_MERGE_PROMPT + RICE_SYSTEM_PROMPT)
+    chunks = chunk_prd(content, budget)
+    logger.info(f"RICE map-reduce over {len(chunks)} chunks")
+    evidence = await _map_chunks(RICE_EVIDENCE_PROMPT, chunks, model)
+
+    # Merge evidence in groups until it fits into the final scoring request
+    evidence_lines = [_evidence_line(json.dumps(e), budget) for e in evidence]
+    while estimate_tokens("".join(evidence_lines)) > budget:
+        groups = pack_chunks(evidence_lines, budget)
+        if len(groups) == len(evidence_lines):
+            # No two entries fit in one merge request: give each an equal share
+            # of the budget rather than send an oversized scoring request
+            share = budget // len(evidence_lines) - 1
+            evidence_lines = [_evidence_line(line.rstrip("\n"), share) for line in evidence_lines]
+            break
+        merged = await _map_chunks(RICE_MERGE_PROMPT, groups, model)
+        evidence_lines = [_evidence_line(json.dumps(e), budget) for e in merged]
+
+    return await _ask_json(
+        RICE_SYSTEM_PROMPT,
+        "Analyze this PRD for RICE scores. The PRD was too large to send whole; "
+        f"this is the RICE evidence extracted from each part:\n\n{''.join(evidence_lines)}",
+        model
+    )
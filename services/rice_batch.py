@@ -0,0 +1,215 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from dependencies import (
+    BASE_DIR, DATA_DIR, DEFAULT_MODEL,
+    get_roadmaps_data, update_roadmap_item, roadmap_lock
+)
+from services.cache import content_hash
+from services.parser import parse_document
+from services.rice import get_rice_analysis, RICE_PROMPT_VERSION
+from services.llm_scheduler import llm_request
+from services.resilience import llm_deadline
+
+logger = logging.getLogger("aop_planner.rice_batch")
+
+RICE_BATCH_CONCURRENCY = int(os.getenv("RICE_BATCH_CONCURRENCY", "3"))
+RICE_BATCH_STATE_FILE = DATA_DIR / "rice_batch.json"
+
+# Marks rice blocks written by this job; blocks without it were entered by hand
+# in roadmap.html and are never overwritten.
+BATCH_SOURCE = "ai_batch"
+
+def roadmap_item_content(item: Dict) -> str:
+    """Text scored for a roadmap item: its summary plus any PRD attachments."""
+    parts = [f"Title: {item.get('title', '')}\nDescription: {item.get('description', '')}\nBU: {item.get('business_unit', '')}"]
+    for attachment in item.get('attachments', []):
+        if attachment.get('type') != 'prd':
+            continue
+        path = Path(attachment.get('path', ''))
+        if not path.is_absolute():
+            path = BASE_DIR / path
+        if not path.is_file():
+            continue
+        try:
+            parsed = parse_document(str(path), attachment.get('filename', path.name))
+            parts.append(f"PRD ({attachment.get('filename', path.name)}):\n{parsed['content']}")
+        except Exception as e:
+            logger.warning(f"Could not parse attachment {path.name} of {item.get('id')}: {e}")
+    return "\n\n".join(parts)
+
+def rice_fingerprint(content: str) -> str:
+    return f"{content_hash(content)}:{RICE_PROMPT_VERSION}"
+
+def needs_scoring(item: Dict, fingerprint: str) -> bool:
+    """Unscored items, and batch-scored items whose content or prompt changed."""
+    rice = item.get('rice')
+    if not rice:
+        return True
+    return rice.get('source') == BATCH_SOURCE and rice.get('fingerprint') != fingerprint
+
+def _number(value, default: float) -> float:
+    try:
+        return float(str(value).replace(',', '').rstrip('%'))
+    except (TypeError, ValueError):
+        return default
+
+def rice_block(analysis: Dict, fingerprint: str) -> Dict:
+    """Normalize an AI analysis into the numeric rice block roadmap.html reads."""
+    return {
+        'reach': _number(analysis.get('reach'), 0),
+        'impact': _number(analysis.get('impact'), 1),
+        'confidence': _number(analysis.get('confidence'), 50),
+        'effort': _number(analysis.get('effort'), 1) or 1,
+        'verdict': analysis.get('verdict', ''),
+        'source': BATCH_SOURCE,
+        'fingerprint': fingerprint,
+        'scored_at': datetime.now().isoformat()
+    }
+
+class RiceBatchJob:
+    """Scores every unscored or stale roadmap item in the background.
+
+    Progress is written to a JSON state file after every item, so a job cut
+    short by a restart resumes where it stopped: finished items are skipped
+    and the rest are re-checked against the current roadmap.
+    """
+
+    def __init__(self, state_path: Path = RICE_BATCH_STATE_FILE,
+                 concurrency: int = RICE_BATCH_CONCURRENCY, model: str = DEFAULT_MODEL):
+        self.state_path = Path(state_path)
+        self.concurrency = concurrency
+        self.model = model
+        self._task: Optional[asyncio.Task] = None
+        self.state = self._load()
+
+    def _load(self) -> Dict:
+        if self.state_path.exists():
+            try:
+                return json.loads(self.state_path.read_text())
+            except Exception as e:
+                logger.error(f"Error reading batch state: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = self.state_path.with_suffix(self.state_path.suffix + '.tmp')
+        tmp_path.write_text(json.dumps(self.state, indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def status(self) -> Dict:
+        state = dict(self.state)
+        if state.get('status') == 'running' and not self.running:
+            # Left behind by a process that stopped mid-run
+            state['status'] = 'interrupted'
+        if state:
+            processed = len(state['done']) + len(state['skipped']) + len(state['failed'])
+            state['progress'] = {
+                'scored': len(state['done']),
+                'skipped': len(state['skipped']),
+                'failed': len(state['failed']),
+                'remaining': max(state.get('total', 0) - processed, 0)
+            }
+        return state
+
+    def start(self, restart: bool = False) -> Dict:
+        """Start a run, resuming an unfinished one unless restart is set."""
+        if self.running:
+            return self.status()
+        resume = not restart and self.status().get('status') == 'interrupted'
+        if not resume:
+            self.state = {
+                'job_id': str(uuid.uuid4()),
+                'started_at': datetime.now().isoformat(),
+                'done': [],
+                'skipped': [],
+                'failed': {}
+            }
+        self.state.update({'status': 'running', 'finished_at': None, 'error': None})
+        self._save()
+        self._task = asyncio.create_task(self._run())
+        return self.status()
+
+    async def stop(self):
+        """Cancel a running job, leaving it resumable."""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        try:
+            finished = set(self.state['done']) | set(self.state['skipped'])
+            items = [item for item in get_roadmaps_data() if item.get('id') not in finished]
+            self.state['total'] = len(finished) + len(items)
+            self._save()
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def one(item):
+                async with semaphore:
+                    await self._score_item(item)
+
+            # Background work: interactive and workflow requests are served first
+            with llm_request("batch", endpoint="rice_batch"):
+                await asyncio.gather(*(one(item) for item in items))
+            self.state['status'] = 'completed'
+        except asyncio.CancelledError:
+            self.state['status'] = 'interrupted'
+            raise
+        except Exception as e:
+            logger.error(f"RICE batch failed: {e}")
+            self.state.update({'status': 'failed', 'error': str(e)})
+        finally:
+            if self.state['status'] != 'running':
+                self.state['finished_at'] = datetime.now().isoformat()
+            self._save()
+
+    async def _score_item(self, item: Dict):
+        item_id = item['id']
+        content = await asyncio.to_thread(roadmap_item_content, item)
+        fingerprint = rice_fingerprint(content)
+        if not needs_scoring(item, fingerprint):
+            self._record(item_id, 'skipped')
+            return
+
+        with llm_deadline("batch"):
+            analysis = await get_rice_analysis(content, self.model)
+        if not analysis:
+            self._record(item_id, 'failed', "RICE analysis unavailable")
+            return
+
+        written = await asyncio.to_thread(self._write_back, item_id, rice_block(analysis, fingerprint))
+        self._record(item_id, 'done' if written else 'skipped')
+
+    @staticmethod
+    def _write_back(item_id: str, rice: Dict) -> bool:
+        # Re-check the row under the lock: a score entered by hand while the
+        # analysis was running wins, and deleted items stay deleted.
+        with roadmap_lock:
+            current = next((r for r in get_roadmaps_data() if r.get('id') == item_id), None)
+            if current is None or (current.get('rice') and current['rice'].get('source') != BATCH_SOURCE):
+                return False
+            return update_roadmap_item(item_id, {'rice': rice}) is not None
+
+    def _record(self, item_id: str, outcome: str, error: Optional[str] = None):
+        if outcome == 'failed':
+            self.state['failed'][item_id] = error
+        else:
+            self.state['failed'].pop(item_id, None)
+            self.state[outcome].append(item_id)
+        self._save()
+        logger.info(f"RICE batch: {item_id} {outcome}")
+
+rice_batch = RiceBatchJob()
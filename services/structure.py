@@ -0,0 +1,120 @@
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from services.parser import default_classifier
+
+logger = logging.getLogger("aop_planner.structure")
+
+STRUCTURE_CACHE_SIZE = 256
+
+class IncrementalStructure:
+    """PRD structure that can be updated by re-classifying only edited lines.
+
+    The document is kept as lines, a section label per line and a list of
+    segments (one per heading, plus the preamble). On update the unchanged
+    line prefix and suffix are found, only the lines in between are
+    classified, and only the segments touching that block are rebuilt. The
+    result always equals parse_prd_structure on the same text.
+    """
+
+    def __init__(self, text="", classifier=None):
+        self.classifier = classifier or default_classifier
+        self.lines = []
+        self.labels = []
+        # Each segment is [start_line, stop_line, key, content]
+        self.segments = []
+        self.reclassified_lines = 0
+        self.update(text)
+
+    def _build_segments(self, start, stop):
+        """Build segments over new lines [start, stop); start must open a segment."""
+        segments = []
+        key, seg_start, body = self.labels[start] if start < stop else None, start, []
+        for index in range(start, stop):
+            label = self.labels[index]
+            if label and index != seg_start:
+                segments.append([seg_start, index, key, "".join(body)])
+                key, seg_start, body = label, index, []
+            elif not label and self.lines[index].strip():
+                body.append(self.lines[index] + '\n')
+        if start < stop:
+            segments.append([seg_start, stop, key, "".join(body)])
+        return segments
+
+    def update(self, text):
+        """Apply a new version of the document, returning the structure dict."""
+        new_lines = text.split('\n')
+        old_lines = self.lines
+        old_count, new_count = len(old_lines), len(new_lines)
+
+        # Unchanged line block at the start and end of the document
+        prefix = 0
+        limit = min(old_count, new_count)
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        limit -= prefix
+        while suffix < limit and old_lines[old_count - 1 - suffix] == new_lines[new_count - 1 - suffix]:
+            suffix += 1
+
+        if prefix == old_count == new_count:
+            return self.structure()
+
+        changed = new_lines[prefix:new_count - suffix]
+        classify = self.classifier.classify_line
+        self.labels[prefix:old_count - suffix] = [classify(line) for line in changed]
+        self.lines = new_lines
+        self.reclassified_lines += len(changed)
+
+        # Rebuild from the segment holding the line before the edit up to the
+        # first heading inside the unchanged suffix; later segments only shift.
+        starts = [segment[0] for segment in self.segments]
+        first = max(bisect_right(starts, max(prefix - 1, 0)) - 1, 0)
+        rebuild_from = self.segments[first][0] if self.segments else 0
+        tail = bisect_right(starts, old_count - suffix - 1)
+        while tail < len(self.segments) and not self.segments[tail][2]:
+            tail += 1
+        shift = new_count - old_count
+        kept_tail = self.segments[tail:]
+        rebuild_to = kept_tail[0][0] + shift if kept_tail else new_count
+
+        for segment in kept_tail:
+            segment[0] += shift
+            segment[1] += shift
+        self.segments[first:] = self._build_segments(rebuild_from, rebuild_to) + kept_tail
+        return self.structure()
+
+    def structure(self):
+        """Return the section dict, as parse_prd_structure would."""
+        parts = {key: [] for key in self.classifier.sections}
+        for _, _, key, content in self.segments:
+            if key:
+                parts[key].append(content)
+        return {key: "".join(contents) for key, contents in parts.items()}
+
+class StructureCache:
+    """Keeps an IncrementalStructure per document, LRU-bounded."""
+
+    def __init__(self, max_documents=STRUCTURE_CACHE_SIZE):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, document_key, text):
+        """Return the structure of text, reusing the document's previous parse."""
+        with self._lock:
+            index = self._documents.pop(document_key, None)
+            if index is None:
+                index = IncrementalStructure()
+            self._documents[document_key] = index
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+            return index.update(text)
+
+    def discard(self, document_key):
+        with self._lock:
+            self._documents.pop(document_key, None)
+
+structure_cache = StructureCache()
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+from dependencies import DATA_DIR
+
+logger = logging.getLogger("aop_planner.tracing")
+
+# Spans are appended to this JSON-lines file, one object per finished span
+WORKFLOW_TRACE_FILE = Path(os.getenv("WORKFLOW_TRACE_FILE", str(DATA_DIR / "workflow_traces.jsonl")))
+WORKFLOW_TRACING = os.getenv("WORKFLOW_TRACING", "true").lower() in ("1", "true", "yes")
+# Past this size the file is rotated to <name>.1, replacing the previous one
+WORKFLOW_TRACE_MAX_BYTES = int(os.getenv("WORKFLOW_TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Spans listed individually in a thread's trace summary
+WORKFLOW_TRACE_TIMELINE = int(os.getenv("WORKFLOW_TRACE_TIMELINE", "200"))
+
+# (thread_id, span_id) of the innermost open span in this context
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Tracer:
+    """Records timed spans for workflow threads in a local trace file.
+
+    A span is opened with span(); spans opened inside it (in the same task,
+    or in tasks it starts) become its children and inherit its thread, so
+    an LLM call made by a graph node is traced under that node. Spans with
+    no thread, given or inherited, are not recorded.
+    """
+
+    def __init__(self, path: Path = WORKFLOW_TRACE_FILE, enabled: bool = WORKFLOW_TRACING,
+                 max_bytes: int = WORKFLOW_TRACE_MAX_BYTES):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: str, thread_id: Optional[str] = None, **attributes) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block; the yielded dict collects extra attributes."""
+        current = _current_span.get()
+        parent_id = None
+        if thread_id is None and current is not None:
+            thread_id, parent_id = current
+        elif current is not None and current[0] == thread_id:
+            parent_id = current[1]
+        if not self.enabled or thread_id is None:
+            yield attributes
+            return
+
+        span_id = uuid.uuid4().hex[:16]
+        token = _current_span.set((thread_id, span_id))
+        started_at = time.time()
+        started = time.perf_counter()
+        status, error = "ok", None
+        try:
+            yield attributes
+        except BaseException as e:
+            if isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+                status = "cancelled"
+            else:
+                status, error = "error", str(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.record({
+                "thread_id": thread_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "kind": kind,
+                "start": started_at,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "status": status,
+                "error": error,
+                "attributes": attributes
+            })
+
+    def record(self, span: Dict[str, Any]):
+        line = json.dumps(span, default=str) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                    os.replace(self.path, self._rotated_path())
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write trace span: {e}")
+
+    def _rotated_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".1")
+
+    def spans(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Recorded spans of one thread, oldest first."""
+        spans = []
+        # Read without the lock: appends and rotation don't disturb an open reader
+        for path in (self._rotated_path(), self.path):
+            if not path.exists():
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    # Cheap substring test before parsing every line of the file
+                    if thread_id not in line:
+                        continue
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue
+                    if span.get("thread_id") == thread_id:
+                        spans.append(span)
+        spans.sort(key=lambda span: span["start"])
+        return spans
+
+    def summary(self, thread_id: str, timeline: int = WORKFLOW_TRACE_TIMELINE) -> Dict[str, Any]:
+        """Where a thread's time went: per node, in LLM calls and in checkpoint writes."""
+        spans = self.spans(thread_id)
+        nodes: Dict[str, Dict[str, Any]] = {}
+        llm = {"calls": 0, "errors": 0, "total_ms": 0.0, "prompt_chars": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        checkpoint = {"writes": 0, "total_ms": 0.0, "max_ms": 0.0}
+        for span in spans:
+            duration = span["duration_ms"]
+            attributes = span.get("attributes") or {}
+            if span["kind"] == "node":
+                node = nodes.setdefault(span["name"], {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+                node["calls"] += 1
+                node["errors"] += span["status"] == "error"
+                node["total_ms"] += duration
+                node["max_ms"] = max(node["max_ms"], duration)
+            elif span["kind"] == "llm":
+                llm["calls"] += 1
+                llm["errors"] += span["status"] == "error"
+                llm["total_ms"] += duration
+                for key in ("prompt_chars", "prompt_tokens", "completion_tokens"):
+                    llm[key] += attributes.get(key) or 0
+            elif span["kind"] == "checkpoint":
+                checkpoint["writes"] += 1
+                checkpoint["total_ms"] += duration
+                checkpoint["max_ms"] = max(checkpoint["max_ms"], duration)
+
+        first = spans[0]["start"] if spans else None
+        wall_ms = max((span["start"] - first) * 1000 + span["duration_ms"] for span in spans) if spans else 0.0
+        return {
+            "thread_id": thread_id,
+            "spans": len(spans),
+            "started_at": datetime.fromtimestamp(first).isoformat() if first else None,
+            "wall_ms": round(wall_ms, 3),
+            "nodes": {name: _rounded(node) for name, node in nodes.items()},
+            "llm": _rounded(llm),
+            "checkpoint": _rounded(checkpoint),
+            "timeline": [
+                {**span, "offset_ms": round((span["start"] - first) * 1000, 3)}
+                for span in spans[-timeline:]
+            ]
+        }
+
+def _rounded(totals: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in totals.items()}
+
+tracer = Tracer()
+
+def traced_node(name: str, fn: Callable) -> Callable:
+    """Wrap a graph node so each execution is recorded as a span of its thread."""
+    def thread_of(config: RunnableConfig) -> Optional[str]:
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        return str(thread_id) if thread_id is not None else None
+
+    if inspect.iscoroutinefunction(fn):
+        async def traced(state, config: RunnableConfig):
+            with tracer.span(name, "node", thread_id=thread_of(config)):
+                return await fn(state)
+    else:
+        def traced(state, config: RunnableConfig):
+            with tracer.span(name, "node", thread_id=thread_of(config)):
+                return fn(state)
+    traced.__name__ = fn.__name__
+    traced.__doc__ = fn.__doc__
+    # Keep the state annotation LangGraph reads to pick the node's input schema
+    annotations = [value for key, value in fn.__annotations__.items() if key != "return"]
+    if annotations:
+        traced.__annotations__ = {"state": annotations[0], "config": RunnableConfig}
+    return traced
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langgraph.config import get_config
+
+from dependencies import DATA_DIR
+from services.llm_scheduler import current_request
+
+logger = logging.getLogger("aop_planner.usage")
+
+USAGE_FILE = Path(os.getenv("LLM_USAGE_FILE", str(DATA_DIR / "llm_usage.json")))
+# Seconds between writes of the usage totals to disk
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "60"))
+# Days of per-day totals kept, and workflow threads tracked (least recent dropped first)
+LLM_USAGE_RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", "31"))
+LLM_USAGE_MAX_THREADS = int(os.getenv("LLM_USAGE_MAX_THREADS", "2000"))
+# USD per 1000 tokens by model, e.g. '{"gpt-4o": {"prompt": 0.0025, "completion": 0.01}}';
+# models without a price are counted in tokens only
+LLM_PRICING = json.loads(os.getenv("LLM_PRICING", "{}"))
+# Tokens (prompt + completion) a user may spend per UTC day; 0 disables the budget.
+# LLM_USER_DAILY_BUDGETS overrides it per user, e.g. '{"alice": 2000000}'
+LLM_USER_DAILY_TOKEN_BUDGET = int(os.getenv("LLM_USER_DAILY_TOKEN_BUDGET", "0"))
+LLM_USER_DAILY_BUDGETS = json.loads(os.getenv("LLM_USER_DAILY_BUDGETS", "{}"))
+
+class LLMBudgetExceeded(Exception):
+    """Raised before an LLM call when the user has spent their daily token budget."""
+
+    def __init__(self, user: str, budget: int):
+        super().__init__(f"Daily LLM budget of {budget} tokens used up for {user}; it resets at midnight UTC.")
+        self.user = user
+        self.budget = budget
+
+def workflow_context() -> Tuple[Optional[str], Optional[str]]:
+    """(thread_id, node) of the workflow graph node running in this context, if any."""
+    try:
+        config = get_config()
+    except RuntimeError:
+        return None, None
+    return config.get("configurable", {}).get("thread_id"), config.get("metadata", {}).get("langgraph_node")
+
+def _empty_totals() -> Dict[str, int]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_calls": 0,
+            "latency_ms": 0, "cost_usd": 0.0}
+
+def _add(table: Dict[str, Dict], key: str, sample: Dict[str, Any]) -> Dict[str, Any]:
+    totals = table.get(key)
+    if totals is None:
+        totals = table[key] = _empty_totals()
+    totals["calls"] += 1
+    totals["prompt_tokens"] += sample["prompt_tokens"]
+    totals["completion_tokens"] += sample["completion_tokens"]
+    totals["estimated_calls"] += sample["estimated"]
+    totals["latency_ms"] += sample["latency_ms"]
+    totals["cost_usd"] += sample["cost_usd"]
+    return totals
+
+def _report_row(key_name: str, key: str, totals: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key_name: key,
+        **totals,
+        "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"],
+        "cost_usd": round(totals["cost_usd"], 6),
+        "avg_latency_ms": round(totals["latency_ms"] / totals["calls"], 1) if totals["calls"] else 0.0,
+    }
+
+class UsageMeter:
+    """Token, latency and cost totals of upstream LLM calls.
+
+    Every completed call is added to running totals by endpoint, user,
+    model and workflow thread, plus per-day totals by endpoint and user.
+    Recording only bumps a few counters in memory; the totals are written
+    to a JSON file every flush interval and on shutdown, so a crash loses
+    at most one interval. Calls coalesced onto another caller's upstream
+    call are counted once, for the caller that started it.
+    """
+
+    def __init__(self, path: Path = USAGE_FILE, pricing: Optional[Dict[str, Dict[str, float]]] = None,
+                 daily_budget: int = LLM_USER_DAILY_TOKEN_BUDGET, user_budgets: Optional[Dict[str, int]] = None,
+                 retention_days: int = LLM_USAGE_RETENTION_DAYS, max_threads: int = LLM_USAGE_MAX_THREADS,
+                 clock: Callable[[], float] = time.time):
+        self.path = Path(path)
+        self.pricing = LLM_PRICING if pricing is None else pricing
+        self.daily_budget = daily_budget
+        self.user_budgets = LLM_USER_DAILY_BUDGETS if user_budgets is None else user_budgets
+        self.retention_days = retention_days
+        self.max_threads = max_threads
+        self.clock = clock
+        self.rejected_calls = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._totals: Dict[str, Dict[str, Dict]] = {"endpoints": {}, "users": {}, "models": {}}
+        self._threads: "OrderedDict[str, Dict]" = OrderedDict()
+        self._days: Dict[str, Dict[str, Dict]] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self._totals.update(data.get("totals", {}))
+            self._threads.update(data.get("threads", {}))
+            self._days.update(data.get("days", {}))
+        except Exception as e:
+            logger.error(f"Error reading LLM usage {self.path.name}: {e}")
+
+    def _today(self) -> str:
+        return datetime.fromtimestamp(self.clock(), timezone.utc).date().isoformat()
+
+    def _cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        price = self.pricing.get(model)
+        if not price:
+            return 0.0
+        return (prompt_tokens * price.get("prompt", 0) + completion_tokens * price.get("completion", 0)) / 1000
+
+    def record(self, model: str, usage: Dict[str, Any], latency_ms: float):
+        """Add one upstream call, attributed to the endpoint, user and thread of this context."""
+        request = current_request()
+        thread_id, node = workflow_context()
+        # Workflow calls are attributed to the graph node that made them
+        endpoint = f"workflow.{node}" if node else (request.endpoint or "unattributed")
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        sample = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated": int(bool(usage.get("tokens_estimated"))),
+            "latency_ms": int(latency_ms),
+            "cost_usd": self._cost(model, prompt_tokens, completion_tokens),
+        }
+        today = self._today()
+        with self._lock:
+            _add(self._totals["endpoints"], endpoint, sample)
+            _add(self._totals["models"], model, sample)
+            if request.user:
+                _add(self._totals["users"], request.user, sample)
+            if thread_id:
+                _add(self._threads, thread_id, sample)
+                self._threads.move_to_end(thread_id)
+                while len(self._threads) > self.max_threads:
+                    self._threads.popitem(last=False)
+            if today not in self._days:
+                self._days[today] = {"endpoints": {}, "users": {}}
+                for day in sorted(self._days)[:-self.retention_days]:
+                    del self._days[day]
+            _add(self._days[today]["endpoints"], endpoint, sample)
+            if request.user:
+                _add(self._days[today]["users"], request.user, sample)
+            self._dirty = True
+
+    def budget_for(self, user: str) -> int:
+        return int(self.user_budgets.get(user, self.daily_budget))
+
+    def tokens_today(self, user: str) -> int:
+        with self._lock:
+            totals = self._days.get(self._today(), {}).get("users", {}).get(user)
+            return totals["prompt_tokens"] + totals["completion_tokens"] if totals else 0
+
+    def check_budget(self, user: Optional[str] = None):
+        """Raise LLMBudgetExceeded if the user (by default the one of this context) is over budget.
+
+        Calls without a user, such as the RICE batch job, are never limited.
+        A call already under way when the budget runs out is allowed to finish.
+        """
+        user = user if user is not None else current_request().user
+        if not user:
+            return
+        budget = self.budget_for(user)
+        if budget > 0 and self.tokens_today(user) >= budget:
+            self.rejected_calls += 1
+            raise LLMBudgetExceeded(user, budget)
+
+    def flush(self):
+        """Write the totals to disk if anything was recorded since the last flush."""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({"totals": self._totals, "threads": self._threads, "days": self._days})
+            self._dirty = False
+        try:
+            tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+            tmp_path.write_text(payload)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Error writing LLM usage {self.path.name}: {e}")
+
+    async def flush_periodically(self, interval: float = LLM_USAGE_FLUSH_INTERVAL):
+        """Flush every interval seconds until cancelled, then once more."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.flush()
+
+    def report(self, days: int = 7, top: int = 20) -> Dict[str, Any]:
+        """Totals for the admin report: all-time, the last `days` days and the `top` threads."""
+        today = self._today()
+        with self._lock:
+            def rows(table: Dict[str, Dict], key_name: str):
+                return sorted((_report_row(key_name, key, totals) for key, totals in table.items()),
+                              key=lambda row: row["total_tokens"], reverse=True)
+
+            recent = sorted(self._days)[-days:] if days > 0 else []
+            report = {
+                "today": today,
+                "totals": {
+                    "endpoints": rows(self._totals["endpoints"], "endpoint"),
+                    "users": rows(self._totals["users"], "user"),
+                    "models": rows(self._totals["models"], "model"),
+                },
+                "daily": [
+                    {"date": day,
+                     "endpoints": rows(self._days[day]["endpoints"], "endpoint"),
+                     "users": rows(self._days[day]["users"], "user")}
+                    for day in reversed(recent)
+                ],
+                "threads": rows(self._threads, "thread_id")[:top],
+            }
+            users_today = self._days.get(today, {}).get("users", {})
+            report["budgets"] = {
+                "daily_tokens": self.daily_budget,
+                "rejected_calls": self.rejected_calls,
+                "users": [
+                    {"user": user, "budget": self.budget_for(user),
+                     "used_today": totals["prompt_tokens"] + totals["completion_tokens"]}
+                    for user, totals in users_today.items() if self.budget_for(user) > 0
+                ],
+            }
+        return report
+
+usage_meter = UsageMeter()
@@ -0,0 +1,29 @@
+import time
+
+from services.cache import ResultCache, content_hash
+
+def test_content_hash_ignores_formatting():
+    assert content_hash("# Goals\n\nship   fast\n") == content_hash("# Goals ship fast")
+    assert content_hash("# Goals ship fast") != content_hash("# Goals ship slow")
+
+def test_entries_persist_across_instances(tmp_path):
+    path = tmp_path / "cache.json"
+    ResultCache(path, ttl=60, max_entries=10).set("k", {"reach": 100})
+    assert ResultCache(path, ttl=60, max_entries=10).get("k") == {"reach": 100}
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path / "cache.json", ttl=10, max_entries=10)
+    cache.set("k", 1)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("k") is None
+    assert cache.stats() == {'entries': 0, 'hits': 0, 'misses': 1}
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(tmp_path / "cache.json", ttl=60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
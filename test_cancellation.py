@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import llm, cancellation
+from services.cancellation import CancellationStats, ClientDisconnected, cancel_on_disconnect
+from services.llm import SingleFlight, chat_completion
+from services.llm_scheduler import LLMScheduler
+from test_llm import completion_payload, use_mock_upstream
+
+class FakeRequest:
+    """Request whose client disconnects when the event is set."""
+
+    def __init__(self, disconnected: asyncio.Event):
+        self.disconnected = disconnected
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+def use_fresh_stats(monkeypatch):
+    stats = CancellationStats()
+    monkeypatch.setattr(llm, "cancellation_stats", stats)
+    monkeypatch.setattr(cancellation, "cancellation_stats", stats)
+    return stats
+
+def test_disconnect_cancels_the_upstream_call(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    stats = use_fresh_stats(monkeypatch)
+    upstream = {"started": 0, "cancelled": 0}
+    disconnected = []
+
+    async def handler(request):
+        upstream["started"] += 1
+        # The client leaves once the call has reached the upstream
+        disconnected[0].set()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            upstream["cancelled"] += 1
+            raise
+        return httpx.Response(200, json=completion_payload())
+    use_mock_upstream(monkeypatch, handler)
+
+    async def scenario():
+        disconnected.append(asyncio.Event())
+        work = chat_completion([{"role": "user", "content": "x" * 400}], model="m", max_tokens=300)
+        with pytest.raises(ClientDisconnected):
+            await cancel_on_disconnect(FakeRequest(disconnected[0]), work, "/api/workflow/chat")
+
+    asyncio.run(scenario())
+    assert upstream == {"started": 1, "cancelled": 1}
+    assert stats.stats() == {
+        'client_disconnects': {"/api/workflow/chat": 1},
+        'cancelled_llm_calls': 1,
+        'cancelled_while_queued': 0,
+        'estimated_prompt_tokens_saved': 0,
+        'estimated_completion_tokens_saved': 300,
+    }
+
+def test_disconnect_while_queued_drops_the_queued_call(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    stats = use_fresh_stats(monkeypatch)
+    scheduler = LLMScheduler(max_concurrency=1, interactive_reserve=0, model_limits={})
+    monkeypatch.setattr(llm, "llm_scheduler", scheduler)
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=completion_payload())
+    use_mock_upstream(monkeypatch, handler)
+
+    async def scenario():
+        async with scheduler.slot("m"):
+            disconnected = asyncio.Event()
+            asyncio.get_running_loop().call_later(0.05, disconnected.set)
+            work = chat_completion([{"role": "user", "content": "x" * 400}], model="m", max_tokens=300)
+            with pytest.raises(ClientDisconnected):
+                await cancel_on_disconnect(FakeRequest(disconnected), work, "/api/analyze")
+            assert scheduler.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+    assert calls == []
+    assert stats.cancelled_while_queued == 1
+    assert stats.prompt_tokens_saved == 101
+    assert stats.completion_tokens_saved == 300
+
+def test_connected_client_gets_the_result():
+    async def scenario():
+        async def work():
+            await asyncio.sleep(0.01)
+            return "reply"
+        return await cancel_on_disconnect(FakeRequest(asyncio.Event()), work(), "/api/analyze")
+
+    assert asyncio.run(scenario()) == "reply"
@@ -0,0 +1,126 @@
+import json
+import asyncio
+
+import httpx
+
+from services import llm
+from services.llm import SingleFlight
+from services.llm_scheduler import LLMRequest, current_request
+from services.chat_sessions import ChatSessionStore, ASSISTANT_INSTRUCTIONS, chat_sessions
+from test_llm import completion_payload, use_mock_upstream
+
+def recording_handler(prompts, reply=lambda body: f"reply {len(body['messages'])}"):
+    async def handler(request):
+        body = json.loads(request.content)
+        prompts.append(body["messages"])
+        return httpx.Response(200, json=completion_payload(reply(body)))
+    return handler
+
+def test_follow_up_turns_send_only_the_new_message(monkeypatch):
+    from main import app
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    prompts = []
+    use_mock_upstream(monkeypatch, recording_handler(prompts))
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            first = (await client.post("/api/workflow/chat", json={
+                "messages": [{"role": "user", "content": "Add metrics"}],
+                "prd_context": "# Overview\nCheckout"
+            })).json()
+            second = (await client.post("/api/workflow/chat", json={
+                "session_id": first["session_id"], "message": "Shorter please"
+            })).json()
+            expired = await client.post("/api/workflow/chat", json={"session_id": "gone", "message": "hi"})
+            return first, second, expired
+
+    first, second, expired = asyncio.run(scenario())
+    assert first["success"] and second["session_id"] == first["session_id"]
+    assert expired.status_code == 409
+
+    # The second prompt extends the first one, so a provider prefix cache can hit
+    assert prompts[1][:len(prompts[0])] == prompts[0]
+    assert prompts[0][0]["content"] == ASSISTANT_INSTRUCTIONS
+    assert "# Overview\nCheckout" in prompts[0][1]["content"]
+    assert prompts[1][len(prompts[0]):] == [
+        {"role": "assistant", "content": first["reply"]},
+        {"role": "user", "content": "Shorter please"}
+    ]
+
+def test_prd_context_changes_wait_for_the_turn_in_flight(monkeypatch):
+    from main import app
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    prompts = []
+    recording = recording_handler(prompts)
+
+    async def slow_handler(request):
+        await asyncio.sleep(0.2)
+        return await recording(request)
+
+    use_mock_upstream(monkeypatch, slow_handler)
+    session = chat_sessions.create("# Overview\nCheckout")
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            first = asyncio.create_task(client.post("/api/workflow/chat", json={
+                "session_id": session.session_id, "message": "Add metrics"
+            }))
+            await asyncio.sleep(0.05)
+            second = asyncio.create_task(client.post("/api/workflow/chat", json={
+                "session_id": session.session_id, "message": "And payments", "prd_context": "# Overview\nPayments"
+            }))
+            await asyncio.sleep(0.05)
+            during_first_turn = session.prd_context
+            await asyncio.gather(first, second)
+            return during_first_turn
+
+    assert asyncio.run(scenario()) == "# Overview\nCheckout"
+    assert session.prd_context == "# Overview\nPayments"
+    assert "Payments" in prompts[1][1]["content"] and "Payments" not in prompts[0][1]["content"]
+
+def test_old_turns_are_folded_into_a_summary_within_budget(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    prompts = []
+    use_mock_upstream(monkeypatch, recording_handler(prompts, reply=lambda body: "They want metrics."))
+    store = ChatSessionStore(history_budget=100)
+    session = store.create("# PRD")
+    for turn in range(6):
+        store.record_turn(session, f"question {turn} " + "x" * 80, f"answer {turn} " + "y" * 80)
+    assert store.needs_compaction(session)
+
+    asyncio.run(store.compact(session))
+
+    assert session.summary == "They want metrics."
+    assert session.history_tokens() <= 50
+    assert session.summarized_turns + len(session.turns) == 12
+    assert session.turns[-1]["content"].startswith("answer 5")
+    # Summary goes after the PRD and before the recent turns
+    prompt = session.prompt("next")
+    assert [m["role"] for m in prompt[:3]] == ["system"] * 3
+    assert prompt[2]["content"].endswith("They want metrics.")
+    assert prompt[-1] == {"role": "user", "content": "next"}
+    assert "question 0" in prompts[0][1]["content"]
+
+def test_compaction_summarizes_outside_the_lock_as_the_users_request():
+    store = ChatSessionStore(history_budget=100)
+    session = store.create("# PRD", user="pm@example.com")
+    for turn in range(6):
+        store.record_turn(session, f"question {turn} " + "x" * 80, f"answer {turn} " + "y" * 80)
+    seen = {}
+
+    async def summarize(summary, turns):
+        seen["request"], seen["locked"] = current_request(), session.lock.locked()
+        # A turn that completes while the summary is being written
+        async with session.lock:
+            store.record_turn(session, "late question", "late answer")
+        return "Summary."
+
+    store._summarize = summarize
+    asyncio.run(store.compact(session, "/api/workflow/chat"))
+
+    assert seen["request"] == LLMRequest("interactive", "pm@example.com", "/api/workflow/chat")
+    assert seen["locked"] is False
+    assert session.summary == "Summary." and not session.compacting
+    assert session.turns[-2:] == [{"role": "user", "content": "late question"},
+                                  {"role": "assistant", "content": "late answer"}]
+    assert session.summarized_turns + len(session.turns) == 14
@@ -0,0 +1,112 @@
+import time
+import uuid
+import asyncio
+import sqlite3
+
+import pytest
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import StateGraph, END
+from typing import TypedDict
+
+from services.tracing import tracer
+from workflows.checkpointer import BoundedSqliteSaver
+
+class CounterState(TypedDict):
+    count: int
+
+class DocumentState(TypedDict):
+    prd: str
+    revision: str
+    round: int
+
+def scratch_saver(tmp_path, monkeypatch, **options):
+    """A saver under tmp_path; its checkpoint-write spans go there too, not to data/."""
+    monkeypatch.setattr(tracer, "path", tmp_path / "traces.jsonl")
+    return BoundedSqliteSaver(tmp_path / "checkpoints.sqlite", **options)
+
+def counter_graph(saver):
+    graph = StateGraph(CounterState)
+    graph.add_node("step", lambda state: {"count": state["count"] + 1})
+    graph.set_entry_point("step")
+    graph.add_edge("step", END)
+    return graph.compile(checkpointer=saver)
+
+def run(graph, thread_id, times=1):
+    async def scenario():
+        config = {"configurable": {"thread_id": thread_id}}
+        for _ in range(times):
+            state = await graph.aget_state(config)
+            await graph.ainvoke({"count": state.values.get("count", 0)}, config=config)
+        return (await graph.aget_state(config)).values
+    return asyncio.run(scenario())
+
+def test_threads_survive_a_restart(tmp_path, monkeypatch):
+    run(counter_graph(scratch_saver(tmp_path, monkeypatch)), "t1", times=2)
+    assert run(counter_graph(scratch_saver(tmp_path, monkeypatch)), "t1") == {"count": 3}
+
+def test_checkpoints_per_thread_are_capped(tmp_path, monkeypatch):
+    saver = scratch_saver(tmp_path, monkeypatch, max_checkpoints=3)
+    assert run(counter_graph(saver), "t1", times=5) == {"count": 5}
+    stats = saver.stats()
+    assert stats["threads"] == 1
+    assert stats["checkpoints"] == 3
+    assert stats["trimmed_checkpoints"] > 0
+
+def test_abandoned_threads_expire(tmp_path, monkeypatch):
+    saver = scratch_saver(tmp_path, monkeypatch, ttl=60, prune_interval=3600)
+    graph = counter_graph(saver)
+    run(graph, "old")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    run(graph, "new")
+    assert saver.prune_expired() == 1
+    assert saver.get_tuple({"configurable": {"thread_id": "old", "checkpoint_ns": ""}}) is None
+    assert run(graph, "new") == {"count": 2}
+    assert saver.stats()["threads"] == 1
+
+def test_documents_are_stored_once_and_restored(tmp_path, monkeypatch):
+    saver = scratch_saver(tmp_path, monkeypatch, max_checkpoints=2, document_min_chars=100)
+    graph = StateGraph(DocumentState)
+    graph.add_node("revise", lambda state: {"revision": f"revision {state['round']}\n" + "y" * 500, "round": state["round"] + 1})
+    graph.set_entry_point("revise")
+    graph.add_edge("revise", END)
+    graph = graph.compile(checkpointer=saver)
+    prd = "x" * 10000
+
+    async def scenario():
+        config = {"configurable": {"thread_id": "t1"}}
+        for round_number in range(5):
+            await graph.ainvoke({"prd": prd, "round": round_number}, config=config)
+        return (await graph.aget_state(config)).values
+
+    values = asyncio.run(scenario())
+    assert values["prd"] == prd
+    assert values["revision"].startswith("revision 4\n")
+    stats = saver.stats()
+    # One copy of the PRD plus the revisions still referenced by retained checkpoints
+    assert stats["documents"] <= 3
+    assert stats["checkpoint_bytes"] < len(prd)
+    saver.delete_thread("t1")
+    assert saver.stats()["documents"] == 0
+
+def test_failed_put_leaves_no_orphan_documents(tmp_path, monkeypatch):
+    saver = scratch_saver(tmp_path, monkeypatch, document_min_chars=100)
+    checkpoint = {**empty_checkpoint(), "channel_values": {"prd": "x" * 1000}}
+    config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+
+    put = SqliteSaver.put
+
+    def failing_put(self, *args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(SqliteSaver, "put", failing_put)
+    with pytest.raises(sqlite3.OperationalError):
+        saver.put(config, checkpoint, {}, {})
+    assert saver.stats()["documents"] == 0
+
+    monkeypatch.setattr(SqliteSaver, "put", put)
+    saver.put(config, checkpoint, {}, {})
+    assert saver.stats()["documents"] == 1
+    assert saver.get_tuple(config).checkpoint["channel_values"]["prd"] == "x" * 1000
@@ -0,0 +1,86 @@
+import io
+import asyncio
+
+import docx
+import httpx
+
+import main
+from services.export import DocumentExporter, DOCX_MEDIA_TYPE
+
+PRD = "# Checkout PRD\n## Goals\nReduce abandonment.\n- Faster payment\n* Fewer fields\n### Risks\nFraud."
+
+def test_docx_export_is_rendered_once_and_served_from_disk(monkeypatch, tmp_path):
+    exporter = DocumentExporter(tmp_path, max_workers=1)
+    monkeypatch.setattr(main, "document_exporter", exporter)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as client:
+            body = {"content": PRD, "filename": "checkout", "format": "docx"}
+            concurrent = await asyncio.gather(*(client.post("/api/export", json=body) for _ in range(3)))
+            again = await client.post("/api/export", json=body)
+            return concurrent, again
+
+    try:
+        concurrent, again = asyncio.run(scenario())
+    finally:
+        exporter.shutdown()
+
+    assert all(r.status_code == 200 for r in concurrent + [again])
+    assert again.headers["content-type"] == DOCX_MEDIA_TYPE
+    assert 'filename="checkout.docx"' in again.headers["content-disposition"]
+    assert len({r.content for r in concurrent + [again]}) == 1
+    assert exporter.stats() == {'renders': 1, 'cache_hits': 1, 'rendering': 0}
+
+    doc = docx.Document(io.BytesIO(again.content))
+    assert [(p.style.name, p.text) for p in doc.paragraphs] == [
+        ("Title", "Product Requirements Document"),
+        ("Heading 1", "Checkout PRD"),
+        ("Heading 2", "Goals"),
+        ("Normal", "Reduce abandonment."),
+        ("List Bullet", "Faster payment"),
+        ("List Bullet", "Fewer fields"),
+        ("Heading 3", "Risks"),
+        ("Normal", "Fraud."),
+    ]
+
+def test_markdown_export_and_cache_eviction(monkeypatch, tmp_path):
+    exporter = DocumentExporter(tmp_path, max_workers=1, max_files=2, evict_grace=0)
+    monkeypatch.setattr(main, "document_exporter", exporter)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as client:
+            markdown = await client.post("/api/export", json={"content": PRD, "filename": "checkout"})
+            for version in range(3):
+                await client.post("/api/export", json={"content": f"{PRD}\nv{version}", "format": "docx"})
+            return markdown
+
+    try:
+        markdown = asyncio.run(scenario())
+    finally:
+        exporter.shutdown()
+
+    assert markdown.status_code == 200
+    assert markdown.text == PRD
+    assert markdown.headers["content-type"].startswith("text/markdown")
+    assert len(list(tmp_path.iterdir())) == 2
+
+def test_evicted_cache_hit_is_rendered_again_and_recent_files_are_kept(tmp_path):
+    exporter = DocumentExporter(tmp_path, max_workers=1, max_files=1)
+
+    async def scenario():
+        first = await exporter.export(PRD, "docx")
+        # Another export evicted the file between lookups
+        first.unlink()
+        again = await exporter.export(PRD, "docx")
+        other = await exporter.export(f"{PRD}\nv2", "docx")
+        assert exporter._pool()._mp_context.get_start_method() == "spawn"
+        return again, other
+
+    try:
+        again, other = asyncio.run(scenario())
+    finally:
+        exporter.shutdown()
+
+    assert exporter.stats()["renders"] == 3
+    # Over max_files, but exported within the grace period: still served
+    assert again.exists() and other.exists()
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+from dependencies import llm_service, create_llm_http_client, ChatModelRegistry
+from services import llm
+from services.llm import SingleFlight, chat_completion
+
+def completion_payload(content="ok"):
+    return {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": int(time.time()), "model": "test",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+def use_mock_upstream(monkeypatch, handler):
+    """Point the shared async client at an in-process mock transport."""
+    client = AsyncOpenAI(api_key="test", base_url="http://llm.test/v1", max_retries=0,
+                         http_client=create_llm_http_client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_service, "async_client", client)
+    return client
+
+def use_mock_chat_models(monkeypatch, handler):
+    """Serve registry (LangChain) chat models from an in-process mock transport."""
+    registry = ChatModelRegistry()
+    registry.configure("test", "http://llm.test/v1")
+    registry._http_clients[registry.base_url] = create_llm_http_client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm, "model_registry", registry)
+    return registry
+
+def test_identical_requests_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("same", upstream) for _ in range(5)))
+        assert results == ["result"] * 5
+        assert calls == [1]
+        assert flight.stats() == {'upstream_calls': 1, 'coalesced_calls': 4, 'in_flight': 0}
+
+    asyncio.run(scenario())
+
+def test_one_waiter_cancelling_does_not_cancel_others():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("k", upstream))
+        second = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "result"
+
+    asyncio.run(scenario())
+
+def test_upstream_cancelled_when_all_waiters_leave():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()['in_flight'] == 0
+
+    asyncio.run(scenario())
+
+def test_chat_completion_coalesces_identical_prompts(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=completion_payload())
+
+    async def scenario():
+        use_mock_upstream(monkeypatch, handler)
+        messages = [{"role": "user", "content": "Analyze"}]
+        await asyncio.gather(chat_completion(messages), chat_completion(messages),
+                             chat_completion([{"role": "user", "content": "Different"}]))
+
+    asyncio.run(scenario())
+    assert len(requests) == 2
@@ -0,0 +1,79 @@
+import asyncio
+
+from services.llm_scheduler import LLMScheduler, TokenBucket, llm_request
+
+async def hold(scheduler, order, name, release, model="m", tokens=0):
+    async with scheduler.slot(model, tokens):
+        order.append(name)
+        await release.wait()
+
+def test_higher_priority_requests_are_admitted_first():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, interactive_reserve=0, model_limits={})
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, order, "first", release))
+        await asyncio.sleep(0)
+        with llm_request("batch"):
+            batch = asyncio.create_task(hold(scheduler, order, "batch", release))
+        with llm_request("interactive"):
+            interactive = asyncio.create_task(hold(scheduler, order, "interactive", release))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queued"] == 2
+        release.set()
+        await asyncio.gather(first, batch, interactive)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["first", "interactive", "batch"]
+    assert stats["in_flight"] == 0
+    assert stats["by_priority"]["batch"]["admitted"] == 1
+
+def test_user_cap_lets_other_users_go_ahead_and_reserve_holds_back_batch():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=3, user_concurrency=1, interactive_reserve=1, model_limits={})
+        order, release = [], asyncio.Event()
+        tasks = []
+        with llm_request("interactive", "alice"):
+            tasks += [asyncio.create_task(hold(scheduler, order, f"alice{i}", release)) for i in range(2)]
+        with llm_request("interactive", "bob"):
+            tasks.append(asyncio.create_task(hold(scheduler, order, "bob", release)))
+        with llm_request("batch"):
+            tasks.append(asyncio.create_task(hold(scheduler, order, "batch", release)))
+        await asyncio.sleep(0.01)
+        admitted = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return admitted
+
+    # alice's second request waits on her cap; batch may not take the reserved slot
+    assert asyncio.run(scenario()) == ["alice0", "bob"]
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(600, clock=lambda: now[0])
+    assert bucket.wait_time(600) == 0
+    bucket.take(600)
+    assert bucket.wait_time(100) == 10.0
+    now[0] = 5.0
+    assert bucket.wait_time(100) == 5.0
+    # Requests larger than the bucket wait for it to fill completely
+    assert bucket.wait_time(10 ** 6) == 55.0
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, interactive_reserve=0, model_limits={})
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, order, "first", release))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(scheduler, order, "waiting", release))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        release.set()
+        await first
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["first"]
+    assert stats["queued"] == 0 and stats["in_flight"] == 0
+    assert stats["by_priority"]["workflow"]["abandoned"] == 1
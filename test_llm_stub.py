@@ -0,0 +1,106 @@
+import json
+import uuid
+import asyncio
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from dependencies import llm_service, create_llm_http_client
+from services import llm
+from services.llm import SingleFlight, chat_completion, stream_chat_completion
+from llm_stub_server import StubLLM, create_stub_app, cassette_key
+from test_llm import completion_payload, use_mock_chat_models
+from test_prd_agent import PRD, fresh_graph
+
+def stub_client(app) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url="http://stub.test/v1", max_retries=0,
+                       http_client=create_llm_http_client(transport=httpx.ASGITransport(app=app)))
+
+def test_stub_answers_plain_json_and_streamed_requests(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    app = create_stub_app()
+    monkeypatch.setattr(llm_service, "async_client", stub_client(app))
+    messages = [{"role": "user", "content": "Improve the goals"}]
+
+    async def scenario():
+        plain = await chat_completion(messages, model="m", max_tokens=50)
+        again = await chat_completion(messages, model="m", max_tokens=50)
+        streamed = "".join([delta async for delta in stream_chat_completion(messages, model="m", max_tokens=50)])
+        rice = await chat_completion(messages, model="m", response_format={"type": "json_object"})
+        return plain, again, streamed, rice
+
+    plain, again, streamed, rice = asyncio.run(scenario())
+    content = plain.choices[0].message.content
+    assert content == again.choices[0].message.content == streamed
+    assert len(content) <= 200 and plain.usage.completion_tokens > 0
+    assert json.loads(rice.choices[0].message.content)["total_score"] == 400.0
+    assert app.state.stub.stats["streamed"] == 1
+
+def test_record_then_replay_offline(tmp_path):
+    upstream_calls = []
+
+    async def upstream(request):
+        upstream_calls.append(json.loads(request.content))
+        return httpx.Response(200, json=completion_payload("recorded answer"))
+
+    recorder = create_stub_app(mode="record", cassette_dir=tmp_path, upstream="http://real.test/v1",
+                               api_key="key", transport=httpx.MockTransport(upstream))
+    player = create_stub_app(mode="replay", cassette_dir=tmp_path)
+    request = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+
+    async def scenario():
+        recorded = await stub_client(recorder).chat.completions.create(**request)
+        replayed = await stub_client(player).chat.completions.create(**request)
+        with pytest.raises(openai.NotFoundError):
+            await stub_client(player).chat.completions.create(**{**request, "temperature": 1})
+        return recorded, replayed
+
+    recorded, replayed = asyncio.run(scenario())
+    assert recorded.choices[0].message.content == replayed.choices[0].message.content == "recorded answer"
+    assert len(upstream_calls) == 1 and "stream" not in upstream_calls[0]
+    assert (tmp_path / f"{cassette_key(request)}.json").exists()
+
+def test_injected_errors_are_reproducible():
+    async def statuses(seed):
+        client = stub_client(create_stub_app(error_rate=0.5, error_status=[429, 503], seed=seed))
+        seen = []
+        for _ in range(20):
+            try:
+                await client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+                seen.append(200)
+            except openai.APIStatusError as e:
+                seen.append(e.status_code)
+        return seen
+
+    first, second = asyncio.run(statuses(7)), asyncio.run(statuses(7))
+    assert first == second
+    assert {200, 429, 503} <= set(first)
+
+def test_workflow_runs_offline_against_the_stub(tmp_path, monkeypatch):
+    app_graph = fresh_graph(tmp_path, monkeypatch)
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    stub = StubLLM()
+    registry = use_mock_chat_models(monkeypatch, None)
+    registry._http_clients[registry.base_url] = create_llm_http_client(
+        transport=httpx.ASGITransport(app=create_stub_app(stub)))
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+
+    async def scenario():
+        await app_graph.ainvoke({"prd_content": PRD, "improvement_type": "comprehensive", "messages": []}, config=config)
+        paused = await app_graph.aget_state(config)
+        await app_graph.aupdate_state(config, {"feedback": None}, as_node="human_review")
+        await app_graph.ainvoke(None, config=config)
+        return paused, await app_graph.aget_state(config)
+
+    paused, finished = asyncio.run(scenario())
+    assert paused.next == ("human_review",)
+    assert finished.next == ()
+    assert finished.values["improved_content"].startswith("# Stub response")
+    assert stub.stats["requests"] == 1
+
+def test_cassette_key_ignores_streaming_but_not_choice_count():
+    request = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+    assert cassette_key({**request, "stream": True, "stream_options": {"include_usage": True}}) == cassette_key(request)
+    assert cassette_key({**request, "n": 2}) != cassette_key(request)
@@ -0,0 +1,181 @@
+import docx
+import fitz  # PyMuPDF
+
+from services import parser
+from services.parser import (
+    parse_document, parse_prd_structure, extract_pdf_pages, iter_document,
+    iter_document_sections, iter_prd_sections, Section, SectionClassifier, classify_line,
+    DocEvent, iter_docx_events, parse_docx_document
+)
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {i + 1} body text")
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+def test_pdf_pages_in_order(tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", 5)
+    pages = extract_pdf_pages(path)
+    assert [p.strip() for p in pages] == [f"Page {i + 1} body text" for i in range(5)]
+
+def test_pdf_parallel_chunks_match_serial(tmp_path, monkeypatch):
+    path = make_pdf(tmp_path / "doc.pdf", 12)
+    serial = extract_pdf_pages(path)
+    monkeypatch.setattr(parser, "PDF_CHUNK_PAGES", 5)
+    monkeypatch.setattr(parser, "PDF_PARALLEL_MIN_PAGES", 1)
+    monkeypatch.setattr(parser, "PDF_MAX_WORKERS", 2)
+    assert extract_pdf_pages(path) == serial
+    # Later parses reuse the spawned pool instead of starting their own
+    pool = parser._pdf_pool
+    assert pool._mp_context.get_start_method() == "spawn"
+    assert extract_pdf_pages(path) == serial
+    assert parser._pdf_pool is pool
+
+def test_pdf_empty_page_falls_back_per_page(tmp_path, monkeypatch):
+    path = make_pdf(tmp_path / "doc.pdf", 3)
+    calls = []
+
+    def fake_fallback(reader, index):
+        calls.append(index)
+        return "fallback text"
+
+    monkeypatch.setattr(parser, "_pypdf2_page_text", fake_fallback)
+    original_get_text = fitz.Page.get_text
+    monkeypatch.setattr(fitz.Page, "get_text",
+                        lambda self, *a, **k: "" if self.number == 1 else original_get_text(self, *a, **k))
+    pages = extract_pdf_pages(path)
+    assert calls == [1]
+    assert pages[1] == "fallback text"
+    assert pages[0].strip() == "Page 1 body text"
+
+def test_parse_document_pdf(tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", 2)
+    result = parse_document(path, "doc.pdf")
+    assert "Page 1 body text" in result['content']
+    assert "Page 2 body text" in result['content']
+    assert result['word_count'] == 8
+
+SAMPLE_PRD = """Intro line before any heading
+# Overview
+The planner helps PMs.
+
+## Goals
+Ship faster.
+## Timeline
+Q1 beta
+Q2 GA
+"""
+
+def test_prd_sections_stream_matches_whole_text():
+    whole = list(iter_prd_sections([SAMPLE_PRD]))
+    for size in [1, 3, 7, 50]:
+        chunks = [SAMPLE_PRD[i:i + size] for i in range(0, len(SAMPLE_PRD), size)]
+        assert list(iter_prd_sections(chunks)) == whole
+    assert [s.key for s in whole] == [None, 'overview', 'objectives', 'timeline']
+    assert whole[3] == Section('timeline', '## Timeline', 'Q1 beta\nQ2 GA\n')
+
+def test_prd_sections_yielded_before_stream_ends():
+    def chunks():
+        yield "# Overview\nfirst page\n"
+        yield "# Timeline\n"
+        raise AssertionError("stream read past the first section")
+
+    sections = iter_prd_sections(chunks())
+    assert next(sections) == Section('overview', '# Overview', 'first page\n')
+
+def test_iter_document_matches_parse_document(tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", 3)
+    assert "".join(iter_document(path, "doc.pdf")) == parse_document(path, "doc.pdf")['content']
+    md = tmp_path / "doc.md"
+    md.write_text(SAMPLE_PRD)
+    assert "".join(iter_document(str(md), "doc.md")) == SAMPLE_PRD
+    sections = {s.key: s.content for s in iter_document_sections(str(md), "doc.md") if s.key}
+    assert sections == {k: v for k, v in parse_prd_structure(SAMPLE_PRD).items() if v}
+
+def test_body_lines_mentioning_keywords_are_not_headings():
+    text = "# Overview\nWe will track metrics weekly and refine scope.\n- metrics dashboard\n"
+    structure = parse_prd_structure(text)
+    assert structure['overview'] == "We will track metrics weekly and refine scope.\n- metrics dashboard\n"
+    assert structure['success_metrics'] == ''
+    assert structure['scope'] == ''
+
+def test_heading_styles():
+    assert classify_line("# PRD Executive Summary") == 'overview'
+    assert classify_line("## Success Metrics (KPIs)") == 'success_metrics'
+    assert classify_line("**Goals**") == 'objectives'
+    assert classify_line("2.1 Timeline") == 'timeline'
+    assert classify_line("Out of Scope:") == 'scope'
+    assert classify_line("Metrics: 20% uplift") is None
+    assert classify_line("3. Success Metrics") == 'success_metrics'
+    assert classify_line("Goals and Objectives") == 'objectives'
+
+def test_numbered_requirements_stay_in_their_section():
+    for line in ["1. Track conversion metrics weekly", "2. Out of scope for v1",
+                 "3) Add a feature flag", "Scope creep is a known risk"]:
+        assert classify_line(line) is None, line
+    structure = parse_prd_structure(
+        "## Requirements\n1. Track conversion metrics weekly\n2. Out of scope for v1\n3) Add a feature flag\n"
+        "2. Success Metrics\nConversion +5%\n"
+    )
+    assert structure['requirements'] == (
+        "1. Track conversion metrics weekly\n2. Out of scope for v1\n3) Add a feature flag\n"
+    )
+    assert structure['success_metrics'] == "Conversion +5%\n"
+    assert structure['scope'] == structure['features'] == ''
+
+def test_custom_vocabulary():
+    classifier = SectionClassifier({'pricing': ['pricing', 'packaging'], 'faq': ['faq']})
+    structure = parse_prd_structure("# Pricing\n$10 per seat\n# FAQ\nWhy?\n# Overview\nignored\n", classifier)
+    assert structure == {'pricing': "$10 per seat\n", 'faq': "Why?\n# Overview\nignored\n"}
+
+def make_docx(path):
+    doc = docx.Document()
+    doc.add_heading('Checkout Revamp', 0)
+    doc.add_paragraph('Intro paragraph mentioning metrics and scope.')
+    doc.add_heading('Success Metrics', 1)
+    table = doc.add_table(rows=2, cols=2)
+    for row, values in zip(table.rows, [('Metric', 'Target'), ('Conversion', '+5%')]):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    doc.add_paragraph('Timeline:')
+    doc.add_heading('Requirements', 2)
+    doc.add_paragraph('Guest checkout', style='List Bullet')
+    doc.save(str(path))
+    return str(path)
+
+def test_docx_events_in_body_order(tmp_path):
+    events = list(iter_docx_events(make_docx(tmp_path / "prd.docx")))
+    assert events == [
+        DocEvent('heading', 'Checkout Revamp', 0),
+        DocEvent('paragraph', 'Intro paragraph mentioning metrics and scope.', None),
+        DocEvent('heading', 'Success Metrics', 1),
+        DocEvent('table_row', 'Metric | Target', None),
+        DocEvent('table_row', 'Conversion | +5%', None),
+        DocEvent('paragraph', 'Timeline:', None),
+        DocEvent('heading', 'Requirements', 2),
+        DocEvent('list_item', 'Guest checkout', None),
+    ]
+
+def test_docx_structure_uses_heading_styles(tmp_path):
+    parsed, structure = parse_docx_document(make_docx(tmp_path / "prd.docx"), "prd.docx")
+    assert structure['success_metrics'] == "| Metric | Target |\n| Conversion | +5% |\nTimeline:\n"
+    assert structure['timeline'] == ''
+    assert structure['requirements'] == "- Guest checkout\n"
+    assert "## Requirements\n- Guest checkout\n" in parsed['content']
+    assert parsed['content'] == parse_document(str(tmp_path / "prd.docx"), "prd.docx")['content']
+
+def test_docx_without_heading_styles_falls_back_to_title_lines(tmp_path):
+    doc = docx.Document()
+    doc.add_paragraph('Overview')
+    doc.add_paragraph('Guest checkout for first-time buyers.')
+    doc.add_paragraph().add_run('Goals').bold = True
+    doc.add_paragraph('1. Track conversion metrics weekly')
+    doc.save(str(tmp_path / "plain.docx"))
+
+    parsed, structure = parse_docx_document(str(tmp_path / "plain.docx"), "plain.docx")
+    assert structure['overview'] == "Guest checkout for first-time buyers.\n"
+    assert structure['objectives'] == "1. Track conversion metrics weekly\n"
+    assert structure == parse_prd_structure(parsed['content'])
@@ -0,0 +1,128 @@
+import json
+import uuid
+import asyncio
+
+import httpx
+
+from services import llm
+from services.llm import SingleFlight
+from services.tracing import tracer
+from test_llm import completion_payload, use_mock_chat_models
+from workflows.checkpointer import BoundedSqliteSaver
+from workflows.prd_agent import compile_graph, split_sections, merge_sections, improvement_prompt, PROMPT_TEMPLATES
+
+PRD = (
+    "# Checkout PRD\n"
+    "## Overview\nMerchants abandon checkout.\n"
+    "## Goals\nReduce abandonment.\n"
+    "## Timeline\nShip in Q3.\n"
+)
+
+def fresh_graph(tmp_path, monkeypatch):
+    """A graph with a scratch checkpoint store; its spans go to tmp_path, not data/."""
+    monkeypatch.setattr(tracer, "path", tmp_path / "traces.jsonl")
+    return compile_graph(BoundedSqliteSaver(tmp_path / "checkpoints.sqlite"))
+
+def echo_handler(calls, peak=None):
+    """Mock upstream that upper-cases the user message it receives."""
+    active = [0]
+
+    async def handler(request):
+        body = json.loads(request.content)
+        user = body["messages"][-1]["content"]
+        calls.append(user)
+        active[0] += 1
+        if peak is not None:
+            peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+        return httpx.Response(200, json=completion_payload(user.upper()))
+    return handler
+
+def test_sections_are_improved_in_parallel_and_merged_in_order(tmp_path, monkeypatch):
+    app_graph = fresh_graph(tmp_path, monkeypatch)
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    calls, peak = [], [0]
+    use_mock_chat_models(monkeypatch, echo_handler(calls, peak))
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+
+    async def scenario():
+        await app_graph.ainvoke({"prd_content": PRD, "improvement_type": "clarify", "mode": "sections", "messages": []}, config=config)
+        return await app_graph.aget_state(config)
+
+    state = asyncio.run(scenario())
+    assert len(calls) == len(split_sections(PRD)) == 4
+    assert peak[0] == 4
+    assert state.next == ("human_review",)
+    assert state.values["improved_content"] == PRD.upper()
+
+def test_feedback_regenerates_only_targeted_sections(tmp_path, monkeypatch):
+    app_graph = fresh_graph(tmp_path, monkeypatch)
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    calls = []
+    use_mock_chat_models(monkeypatch, echo_handler(calls))
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+
+    async def scenario():
+        await app_graph.ainvoke({"prd_content": PRD, "improvement_type": "clarify", "mode": "sections", "messages": []}, config=config)
+        calls.clear()
+        await app_graph.aupdate_state(config, {"feedback": "The timeline is too vague"})
+        await app_graph.ainvoke(None, config=config)
+        return await app_graph.aget_state(config)
+
+    state = asyncio.run(scenario())
+    assert calls == ["## Timeline\nShip in Q3.\n"]
+    assert state.next == ("human_review",)
+    assert state.values["improved_content"].startswith("# CHECKOUT PRD\n## OVERVIEW")
+    assert state.values["feedback"] is None
+
+def test_sections_keep_their_exact_text():
+    prd = "Intro line.\n\n## Overview\n\nPara one.\n\nPara two.\n\n## Appendix\n\nfoo\n\n## Goals\r\nGrow.\n\n"
+    sections = split_sections(prd)
+    assert [section["key"] for section in sections] == [None, "overview", "objectives"]
+    assert sections[1]["text"] == "## Overview\n\nPara one.\n\nPara two.\n\n## Appendix\n\nfoo\n\n"
+    assert merge_sections({"sections": sections})["improved_content"] == prd
+    merged = merge_sections({"sections": sections, "improved_sections": {1: "## Overview\nImproved."}})
+    assert merged["improved_content"] == "Intro line.\n\n## Overview\nImproved.\n\n## Goals\r\nGrow.\n\n"
+
+def system_echo_handler(calls, peak):
+    """Mock upstream that answers with the system prompt it was given."""
+    active = [0]
+
+    async def handler(request):
+        system = json.loads(request.content)["messages"][0]["content"]
+        calls.append(system)
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+        return httpx.Response(200, json=completion_payload(system))
+    return handler
+
+def test_variants_run_as_parallel_branches_and_review_picks_one(tmp_path, monkeypatch):
+    app_graph = fresh_graph(tmp_path, monkeypatch)
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    calls, peak = [], [0]
+    use_mock_chat_models(monkeypatch, system_echo_handler(calls, peak))
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    types = ["comprehensive", "clarify", "expand"]
+
+    async def scenario():
+        await app_graph.ainvoke({"prd_content": PRD, "improvement_type": "comprehensive", "improvement_types": types,
+                                 "mode": "variants", "messages": []}, config=config)
+        review = await app_graph.aget_state(config)
+        calls.clear()
+        await app_graph.aupdate_state(config, {"selected_variant": "expand", "feedback": "Add more edge cases"})
+        await app_graph.ainvoke(None, config=config)
+        return review, await app_graph.aget_state(config)
+
+    review, revised = asyncio.run(scenario())
+    assert peak[0] == 3
+    assert sorted(review.values["variants"]) == sorted(types)
+    assert review.values["improved_content"] == PROMPT_TEMPLATES["comprehensive"]
+    assert review.next == ("human_review",)
+    # Feedback on the picked variant regenerates only that branch
+    assert calls == [improvement_prompt("expand", "Add more edge cases")]
+    assert revised.values["selected_variant"] == "expand"
+    assert revised.values["improved_content"] == calls[0]
+    assert revised.values["variants"]["clarify"] == PROMPT_TEMPLATES["clarify"]
@@ -0,0 +1,106 @@
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from services import llm
+from services.llm import SingleFlight, chat_completion
+from services.resilience import (
+    CircuitBreaker, CircuitOpenError, LLMDeadlineExceeded,
+    call_with_retries, llm_deadline, LLM_DEADLINES
+)
+from test_llm import completion_payload, use_mock_upstream
+
+def flaky_handler(responses, calls):
+    """Mock upstream answering with the queued responses, then with success."""
+    async def handler(request):
+        calls.append(time.monotonic())
+        if responses:
+            return responses.pop(0)
+        return httpx.Response(200, json=completion_payload("recovered"))
+    return handler
+
+def test_transient_errors_are_retried_honoring_retry_after(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    calls = []
+    use_mock_upstream(monkeypatch, flaky_handler([
+        httpx.Response(503, json={"error": {"message": "overloaded"}}),
+        httpx.Response(429, headers={"retry-after": "0.2"}, json={"error": {"message": "slow down"}}),
+    ], calls))
+
+    response = asyncio.run(chat_completion([{"role": "user", "content": "hi"}], model="m"))
+
+    assert response.choices[0].message.content == "recovered"
+    assert len(calls) == 3
+    assert calls[2] - calls[1] >= 0.2
+
+def test_client_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    calls = []
+    use_mock_upstream(monkeypatch, flaky_handler([httpx.Response(400, json={"error": {"message": "bad"}})], calls))
+
+    with pytest.raises(Exception):
+        asyncio.run(chat_completion([{"role": "user", "content": "hi"}], model="m"))
+    assert len(calls) == 1
+
+def server_error():
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    return openai.InternalServerError("down", response=httpx.Response(500, request=request), body=None)
+
+def test_breaker_opens_fails_fast_and_recovers_after_cooldown():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=2, cooldown=10, clock=lambda: now[0])
+    upstream_calls = []
+
+    async def down():
+        upstream_calls.append(1)
+        raise server_error()
+
+    async def up():
+        upstream_calls.append(1)
+        return "ok"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await call_with_retries(down, breaker=breaker, attempts=1)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await call_with_retries(up, breaker=breaker, attempts=1)
+        assert len(upstream_calls) == 2
+
+        now[0] = 10
+        assert breaker.state == "half_open"
+        assert await call_with_retries(up, breaker=breaker, attempts=1) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+    assert breaker.stats()["rejected_calls"] == 1
+
+def test_client_errors_between_server_errors_keep_the_breaker_closed():
+    breaker = CircuitBreaker(threshold=2, cooldown=10)
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    bad_request = openai.BadRequestError("bad", response=httpx.Response(400, request=request), body=None)
+
+    for error in [server_error(), bad_request, server_error(), bad_request, server_error()]:
+        breaker.record_failure(error)
+
+    assert breaker.state == "closed"
+    assert breaker.stats()["consecutive_failures"] == 1
+
+def test_deadline_bounds_the_call(monkeypatch):
+    monkeypatch.setitem(LLM_DEADLINES, "chat", 0.05)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def scenario():
+        with llm_deadline("chat"):
+            await call_with_retries(slow, breaker=CircuitBreaker())
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(scenario())
+    assert time.monotonic() - started < 0.5
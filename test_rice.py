@@ -0,0 +1,179 @@
+import json
+import asyncio
+import threading
+
+import httpx
+
+from services import rice
+from services.cache import ResultCache
+from services.llm import estimate_tokens
+from services.rice import chunk_prd, get_rice_analysis
+from test_llm import completion_payload, use_mock_upstream
+
+SECTION = "## {title}\n" + "The checkout flow serves 10000 merchants every day.\n" * 20
+
+def large_prd(sections=12):
+    titles = ["Overview", "Goals", "Requirements", "Timeline"]
+    return "".join(SECTION.format(title=titles[i % len(titles)]) for i in range(sections))
+
+def test_chunks_respect_budget_and_section_boundaries():
+    chunks = chunk_prd(large_prd(), budget=600)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 600 for chunk in chunks)
+    assert all(chunk.startswith("## ") for chunk in chunks)
+
+def test_oversized_section_is_split_on_lines():
+    text = "# Requirements\n" + "A requirement line that is fairly long.\n" * 200
+    chunks = chunk_prd(text, budget=100)
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == text
+
+def test_large_prd_is_analyzed_map_reduce(tmp_path, monkeypatch):
+    monkeypatch.setattr(rice, "rice_cache", ResultCache(tmp_path / "rice.json", ttl=60, max_entries=10))
+    monkeypatch.setattr(rice, "RICE_MAX_PROMPT_TOKENS", 1500)
+    monkeypatch.setattr(rice, "RICE_MAP_CONCURRENCY", 2)
+    prompts, active, peak = [], [0], [0]
+
+    async def handler(request):
+        body = json.loads(request.content)
+        system = body["messages"][0]["content"]
+        prompts.append(system)
+        assert estimate_tokens(system + body["messages"][1]["content"]) <= 1500
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        if system == rice.RICE_SYSTEM_PROMPT:
+            result = {"reach": 10000, "impact": 2, "confidence": 80, "effort": 3, "total_score": 5333, "verdict": "Do it"}
+        else:
+            result = {"reach": "10000 merchants", "impact": "", "confidence": "", "effort": ""}
+        return httpx.Response(200, json=completion_payload(json.dumps(result)))
+
+    async def scenario():
+        use_mock_upstream(monkeypatch, handler)
+        return await get_rice_analysis(large_prd(30))
+
+    result = asyncio.run(scenario())
+    assert result["total_score"] == 5333
+    assert prompts.count(rice.RICE_EVIDENCE_PROMPT) > 1
+    assert prompts[-1] == rice.RICE_SYSTEM_PROMPT
+    assert peak[0] <= 2
+
+def test_cache_file_is_read_and_written_off_the_event_loop(tmp_path, monkeypatch):
+    threads = []
+
+    class RecordingCache(ResultCache):
+        def _load(self):
+            threads.append(threading.get_ident())
+            super()._load()
+
+        def _save(self):
+            threads.append(threading.get_ident())
+            super()._save()
+
+    monkeypatch.setattr(rice, "rice_cache", RecordingCache(tmp_path / "rice.json", ttl=60, max_entries=10))
+    result = {"reach": 10, "impact": 1, "confidence": 80, "effort": 1, "total_score": 8, "verdict": "Fine"}
+
+    async def handler(request):
+        return httpx.Response(200, json=completion_payload(json.dumps(result)))
+
+    async def scenario():
+        use_mock_upstream(monkeypatch, handler)
+        loop_thread = threading.get_ident()
+        return loop_thread, await get_rice_analysis("# Overview\nSmall PRD"), await get_rice_analysis("# Overview\nSmall PRD")
+
+    loop_thread, first, cached = asyncio.run(scenario())
+    assert first == cached == result
+    assert threads and loop_thread not in threads
+    assert (tmp_path / "rice.json").exists()
+
+def test_oversized_evidence_is_truncated_to_the_prompt_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(rice, "rice_cache", ResultCache(tmp_path / "rice.json", ttl=60, max_entries=10))
+    monkeypatch.setattr(rice, "RICE_MAX_PROMPT_TOKENS", 1500)
+    sizes = []
+
+    async def handler(request):
+        body = json.loads(request.content)
+        system = body["messages"][0]["content"]
+        sizes.append(estimate_tokens(system + body["messages"][1]["content"]))
+        if system == rice.RICE_SYSTEM_PROMPT:
+            result = {"reach": 10000, "impact": 2, "confidence": 80, "effort": 3, "total_score": 5333, "verdict": "Do it"}
+        else:
+            # Every part answers with more evidence than one request can carry
+            result = {"reach": "merchants " * 1000, "impact": "", "confidence": "", "effort": ""}
+        return httpx.Response(200, json=completion_payload(json.dumps(result)))
+
+    async def scenario():
+        use_mock_upstream(monkeypatch, handler)
+        return await get_rice_analysis(large_prd(30))
+
+    assert asyncio.run(scenario())["total_score"] == 5333
+    assert max(sizes) <= 1500
+
+def test_batch_scores_unscored_items_and_resumes(tmp_path, monkeypatch):
+    import dependencies
+    from services import rice_batch
+    from services.rice_batch import RiceBatchJob
+
+    roadmap_file = tmp_path / "roadmaps.json"
+    manual = {"reach": 5000, "impact": 2, "confidence": 70, "effort": 4}
+    roadmap_file.write_text(json.dumps([
+        {"id": "a", "title": "Forms 2.0", "rice": manual},
+        {"id": "b", "title": "Omni migration"},
+        {"id": "c", "title": "Portal search"},
+    ]))
+    monkeypatch.setattr(dependencies, "ROADMAP_FILE", roadmap_file)
+    scored = []
+
+    async def fake_analysis(content, model):
+        scored.append(content.splitlines()[0])
+        return {"reach": "1,000", "impact": 2, "confidence": "80%", "effort": 2, "verdict": "Do it"}
+
+    monkeypatch.setattr(rice_batch, "get_rice_analysis", fake_analysis)
+    state_path = tmp_path / "batch.json"
+
+    async def scenario():
+        # A previous run scored "b" before the process stopped
+        state_path.write_text(json.dumps({"job_id": "j", "status": "running", "done": ["b"], "skipped": [], "failed": {}}))
+        job = RiceBatchJob(state_path, concurrency=2)
+        assert job.status()["status"] == "interrupted"
+        job.start()
+        await job._task
+        return job.status()
+
+    status = asyncio.run(scenario())
+    assert status["status"] == "completed"
+    assert status["progress"] == {"scored": 2, "skipped": 1, "failed": 0, "remaining": 0}
+    assert scored == ["Title: Portal search"]
+    items = {item["id"]: item for item in json.loads(roadmap_file.read_text())}
+    assert items["a"]["rice"] == manual
+    assert "rice" not in items["b"]
+    assert items["c"]["rice"]["reach"] == 1000 and items["c"]["rice"]["confidence"] == 80
+
+def test_roadmap_create_and_delete_keep_a_concurrent_batch_write(tmp_path, monkeypatch):
+    import time
+    import threading
+    import dependencies
+    from dependencies import roadmap_lock, update_roadmap_item, add_roadmap_items, delete_roadmap_item
+
+    roadmap_file = tmp_path / "roadmaps.json"
+    roadmap_file.write_text(json.dumps([{"id": "a"}, {"id": "b"}]))
+    monkeypatch.setattr(dependencies, "ROADMAP_FILE", roadmap_file)
+    holding = threading.Event()
+
+    def batch_write_back():
+        with roadmap_lock:
+            holding.set()
+            time.sleep(0.1)
+            update_roadmap_item("a", {"rice": {"reach": 1000}})
+
+    writer = threading.Thread(target=batch_write_back)
+    writer.start()
+    holding.wait()
+    # Both read the file only once the write-back has released the lock
+    assert delete_roadmap_item("b")
+    add_roadmap_items([{"id": "c"}])
+    writer.join()
+
+    assert not delete_roadmap_item("missing")
+    assert json.loads(roadmap_file.read_text()) == [{"id": "a", "rice": {"reach": 1000}}, {"id": "c"}]
@@ -0,0 +1,50 @@
+import random
+
+from services.parser import parse_prd_structure
+from services.structure import IncrementalStructure, StructureCache
+
+LINES = [
+    "# Overview", "## Goals", "## Timeline", "Risks:", "**Success Metrics**", "# Appendix",
+    "We will track metrics weekly.", "- bullet point", "Plain body text.", "", "   ",
+    "Intro line", "2.1 Scope", "| Metric | Target |",
+]
+
+def random_document(rng, max_lines=40):
+    return [rng.choice(LINES) for _ in range(rng.randint(0, max_lines))]
+
+def random_edit(rng, lines):
+    """Replace, insert or delete a random block of lines."""
+    lines = list(lines)
+    start = rng.randint(0, len(lines))
+    stop = rng.randint(start, min(len(lines), start + rng.randint(0, 6)))
+    lines[start:stop] = [rng.choice(LINES) for _ in range(rng.randint(0, 5))]
+    return lines
+
+def test_incremental_matches_full_parse():
+    rng = random.Random(42)
+    for _ in range(300):
+        lines = random_document(rng)
+        index = IncrementalStructure("\n".join(lines))
+        for _ in range(15):
+            lines = random_edit(rng, lines)
+            text = "\n".join(lines)
+            assert index.update(text) == parse_prd_structure(text), text
+
+def test_trailing_newline_and_empty_edits():
+    index = IncrementalStructure("# Overview\nbody\n")
+    for text in ["# Overview\nbody", "", "\n\n# Goals\n", "# Goals\nship\n# Goals\nagain\n"]:
+        assert index.update(text) == parse_prd_structure(text)
+
+def test_single_line_edit_reclassifies_only_that_line():
+    lines = ["# Overview", "text"] * 500 + ["## Timeline", "Q1"]
+    index = IncrementalStructure("\n".join(lines))
+    before = index.reclassified_lines
+    lines[700] = "edited text"
+    assert index.update("\n".join(lines)) == parse_prd_structure("\n".join(lines))
+    assert index.reclassified_lines - before == 1
+
+def test_cache_is_bounded_per_document():
+    cache = StructureCache(max_documents=2)
+    for name in ["a.md", "b.md", "c.md"]:
+        assert cache.update(name, "# Goals\nship\n")['objectives'] == "ship\n"
+    assert list(cache._documents) == ["b.md", "c.md"]
@@ -0,0 +1,39 @@
+import uuid
+import asyncio
+
+from services import llm
+from services.llm import SingleFlight
+from services.tracing import tracer
+from test_llm import use_mock_chat_models
+from test_prd_agent import fresh_graph, echo_handler, PRD
+
+def test_workflow_nodes_llm_calls_and_checkpoint_writes_are_traced(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    use_mock_chat_models(monkeypatch, echo_handler([]))
+    graph = fresh_graph(tmp_path, monkeypatch)
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+
+    asyncio.run(graph.ainvoke({"prd_content": PRD, "improvement_type": "clarify", "mode": "sections", "messages": []}, config=config))
+    summary = tracer.summary(thread_id)
+
+    assert summary["nodes"]["analyze"]["calls"] == 1
+    assert summary["nodes"]["improve_section"]["calls"] == 4
+    assert summary["nodes"]["merge_sections"]["calls"] == 1
+    assert summary["llm"]["calls"] == 4
+    assert summary["llm"]["prompt_chars"] > len(PRD)
+    assert summary["llm"]["prompt_tokens"] > 0 and summary["llm"]["completion_tokens"] > 0
+    assert summary["checkpoint"]["writes"] > 0
+    assert summary["wall_ms"] >= summary["nodes"]["improve_section"]["max_ms"]
+
+    # LLM spans are children of the node that made the call
+    spans = {span["span_id"]: span for span in summary["timeline"]}
+    llm_parents = {spans[span["parent_id"]]["name"] for span in spans.values() if span["kind"] == "llm"}
+    assert llm_parents == {"improve_section"}
+
+def test_spans_without_a_thread_are_not_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracer, "path", tmp_path / "traces.jsonl")
+    with tracer.span("chat_completion", "llm") as span:
+        span["prompt_chars"] = 10
+    assert not (tmp_path / "traces.jsonl").exists()
+    assert tracer.summary("missing")["spans"] == 0
@@ -0,0 +1,90 @@
+import json
+import asyncio
+from typing import TypedDict
+
+import httpx
+import pytest
+from langchain_core.messages import HumanMessage
+from langgraph.graph import StateGraph, START, END
+
+from services import llm
+from services.llm import SingleFlight, chat_completion, invoke_chat_model
+from services.llm_scheduler import llm_request
+from services.usage import UsageMeter, LLMBudgetExceeded
+from test_llm import completion_payload, use_mock_upstream, use_mock_chat_models
+
+async def reply(request):
+    return httpx.Response(200, json=completion_payload("ok"))
+
+class DraftState(TypedDict):
+    draft: str
+
+async def generate(state: DraftState):
+    response = await invoke_chat_model([HumanMessage(content="Write a PRD")], model="test")
+    return {"draft": response.content}
+
+def test_calls_are_attributed_and_survive_a_restart(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    meter = UsageMeter(tmp_path / "usage.json", pricing={"m": {"prompt": 1.0, "completion": 2.0}})
+    monkeypatch.setattr(llm, "usage_meter", meter)
+    use_mock_upstream(monkeypatch, reply)
+    use_mock_chat_models(monkeypatch, reply)
+
+    builder = StateGraph(DraftState)
+    builder.add_node("generate", generate)
+    builder.add_edge(START, "generate")
+    builder.add_edge("generate", END)
+    graph = builder.compile()
+
+    async def scenario():
+        with llm_request("interactive", "alice", "/api/analyze"):
+            await chat_completion([{"role": "user", "content": "one"}], model="m")
+            await chat_completion([{"role": "user", "content": "two"}], model="m")
+        with llm_request("workflow", "bob"):
+            await graph.ainvoke({"draft": ""}, config={"configurable": {"thread_id": "t-1"}})
+
+    asyncio.run(scenario())
+    meter.flush()
+
+    report = UsageMeter(tmp_path / "usage.json").report()
+    endpoints = {row["endpoint"]: row for row in report["totals"]["endpoints"]}
+    assert endpoints["/api/analyze"]["calls"] == 2
+    assert endpoints["/api/analyze"]["total_tokens"] == 30
+    assert endpoints["/api/analyze"]["cost_usd"] == pytest.approx(2 * (10 * 1.0 + 5 * 2.0) / 1000)
+    assert endpoints["workflow.generate"]["calls"] == 1
+    assert {row["user"]: row["calls"] for row in report["totals"]["users"]} == {"alice": 2, "bob": 1}
+    assert [(row["thread_id"], row["calls"]) for row in report["threads"]] == [("t-1", 1)]
+    assert report["daily"][0]["date"] == report["today"]
+    assert json.loads((tmp_path / "usage.json").read_text())["totals"]["models"]["m"]["calls"] == 2
+
+def test_daily_budget_blocks_calls_until_the_next_day(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    now = [1_700_000_000.0]
+    meter = UsageMeter(tmp_path / "usage.json", daily_budget=20, user_budgets={"vip": 0}, clock=lambda: now[0])
+    monkeypatch.setattr(llm, "usage_meter", meter)
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return await reply(request)
+    use_mock_upstream(monkeypatch, handler)
+
+    async def ask(user, text):
+        with llm_request("interactive", user, "/api/workflow/chat"):
+            return await chat_completion([{"role": "user", "content": text}], model="m")
+
+    async def scenario():
+        await ask("alice", "one")
+        await ask("alice", "two")
+        with pytest.raises(LLMBudgetExceeded):
+            await ask("alice", "three")
+        # A budget of 0 means unlimited, and batch work has no user to charge
+        for text in ("a", "b", "c"):
+            await ask("vip", text)
+        await ask(None, "batch")
+        now[0] += 86400
+        await ask("alice", "next day")
+
+    asyncio.run(scenario())
+    assert len(calls) == 7
+    assert meter.report()["budgets"]["rejected_calls"] == 1
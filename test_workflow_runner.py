@@ -0,0 +1,64 @@
+import uuid
+import asyncio
+
+import httpx
+import pytest
+
+from services import llm
+from services.llm import SingleFlight
+from test_llm import completion_payload, use_mock_chat_models
+from test_prd_agent import fresh_graph
+from workflows.runner import WorkflowRunner, WorkflowBusyError
+
+def slow_handler(delay=0.05):
+    async def handler(request):
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=completion_payload("Improved PRD"))
+    return handler
+
+def test_submit_returns_at_once_and_publishes_node_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    use_mock_chat_models(monkeypatch, slow_handler())
+    graph = fresh_graph(tmp_path, monkeypatch)
+    thread_id = str(uuid.uuid4())
+
+    async def scenario():
+        runner = WorkflowRunner(graph)
+        runner.submit(thread_id, {"prd_content": "# Overview\nx", "improvement_type": "comprehensive", "messages": []})
+        assert runner.is_running(thread_id)
+        with pytest.raises(WorkflowBusyError):
+            runner.submit(thread_id, None)
+        events = [item async for item in runner.events(thread_id)]
+        # A late subscriber gets the same events replayed
+        assert [item async for item in runner.events(thread_id)] == events
+        return events
+
+    events = asyncio.run(scenario())
+    names = [event for event, _ in events]
+    assert names[:2] == ["queued", "running"]
+    assert names[-1] == "waiting_for_review"
+    progress = [(data["node"], data["status"]) for event, data in events if event == "node"]
+    assert progress == [("analyze", "started"), ("analyze", "finished"),
+                        ("generate", "started"), ("generate", "finished")]
+    assert events[-1][1]["current_content"] == "Improved PRD"
+
+def test_feedback_run_resumes_the_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    use_mock_chat_models(monkeypatch, slow_handler(0))
+    graph = fresh_graph(tmp_path, monkeypatch)
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+
+    async def scenario():
+        runner = WorkflowRunner(graph, max_concurrent=1)
+        runner.submit(thread_id, {"prd_content": "# Overview\nx", "improvement_type": "comprehensive", "messages": []})
+        await runner.wait(thread_id)
+        await graph.aupdate_state(config, {"feedback": "shorter"})
+        runner.submit(thread_id, None)
+        return [item async for item in runner.events(thread_id)]
+
+    events = asyncio.run(scenario())
+    progress = [(data["node"], data["status"]) for event, data in events if event == "node"]
+    assert progress[0] == ("human_review", "started")
+    assert ("generate", "finished") in progress
+    assert events[-1][0] == "waiting_for_review"
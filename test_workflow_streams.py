@@ -0,0 +1,113 @@
+import json
+import asyncio
+
+import httpx
+
+from dependencies import llm_service, create_llm_http_client
+from routers import workflow
+from services import llm
+from services.llm import SingleFlight
+from services.chat_sessions import chat_sessions
+from llm_stub_server import StubLLM, create_stub_app
+from test_llm import use_mock_chat_models
+from test_llm_stub import stub_client
+from test_prd_agent import PRD, fresh_graph, split_sections
+
+def parse_sse(body: str):
+    """(event, data) pairs of a server-sent event stream; unnamed events are "message"."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+def post_stream(path, body):
+    from main import app
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            return await client.post(path, json=body)
+    return asyncio.run(scenario())
+
+def use_stub_graph(monkeypatch, tmp_path):
+    """Serve the workflow graph's chat models from the stub, with a scratch checkpoint store."""
+    graph = fresh_graph(tmp_path, monkeypatch)
+    monkeypatch.setattr(workflow, "app_graph", graph)
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    registry = use_mock_chat_models(monkeypatch, None)
+    stub = StubLLM()
+    registry._http_clients[registry.base_url] = create_llm_http_client(
+        transport=httpx.ASGITransport(app=create_stub_app(stub)))
+    return graph, stub
+
+def test_chat_stream_sends_session_deltas_then_done(monkeypatch):
+    monkeypatch.setattr(llm, "single_flight", SingleFlight())
+    monkeypatch.setattr(llm_service, "async_client", stub_client(create_stub_app()))
+
+    response = post_stream("/api/workflow/chat/stream", {
+        "messages": [{"role": "user", "content": "Add metrics"}], "prd_context": "# Overview\nCheckout"
+    })
+
+    events = parse_sse(response.text)
+    names = [name for name, _ in events]
+    assert names[0] == "session" and names[-1] == "done"
+    assert set(names[1:-1]) == {"message"} and len(names) > 3
+    done = events[-1][1]
+    assert done["reply"] == "".join(data["delta"] for name, data in events if name == "message")
+    assert done["session_id"] == events[0][1]["session_id"]
+    assert chat_sessions.get(done["session_id"]).turns[-1] == {"role": "assistant", "content": done["reply"]}
+
+def test_chat_stream_reports_disabled_ai_like_chat(monkeypatch):
+    monkeypatch.setattr(llm_service, "async_client", None)
+    response = post_stream("/api/workflow/chat/stream", {"message": "hi"})
+    assert response.json() == {"success": False, "error": "AI features are currently disabled."}
+
+def test_start_stream_relays_tokens_and_checkpoints_the_result(monkeypatch, tmp_path):
+    graph, stub = use_stub_graph(monkeypatch, tmp_path)
+
+    events = parse_sse(post_stream("/api/workflow/start/stream", {"prd_content": PRD}).text)
+
+    names = [name for name, _ in events]
+    assert names[0] == "started" and names[-1] == "done"
+    assert set(names[1:-1]) == {"message"}
+    done = events[-1][1]
+    assert done["status"] == "waiting_for_review"
+    assert done["current_content"] == "".join(data["delta"] for name, data in events if name == "message")
+    state = asyncio.run(graph.aget_state({"configurable": {"thread_id": events[0][1]["thread_id"]}}))
+    assert state.next == ("human_review",)
+    assert state.values["improved_content"] == done["current_content"]
+    assert stub.stats["streamed"] == 1
+
+def test_start_stream_sends_whole_sections_and_variants(monkeypatch, tmp_path):
+    use_stub_graph(monkeypatch, tmp_path)
+
+    sections = parse_sse(post_stream("/api/workflow/start/stream", {"prd_content": PRD, "mode": "sections"}).text)
+    variants = parse_sse(post_stream("/api/workflow/start/stream", {
+        "prd_content": PRD, "improvement_types": ["clarify", "expand"]
+    }).text)
+
+    assert [name for name, _ in sections] == ["started"] + ["section"] * len(split_sections(PRD)) + ["done"]
+    assert sorted(data["index"] for name, data in sections if name == "section") == [0, 1, 2, 3]
+    assert [name for name, _ in variants] == ["started", "variant", "variant", "done"]
+    assert {data["improvement_type"] for name, data in variants if name == "variant"} == {"clarify", "expand"}
+    assert variants[-1][1]["variants"].keys() == {"clarify", "expand"}
+
+def test_start_stream_reports_errors_as_an_event(monkeypatch, tmp_path):
+    use_stub_graph(monkeypatch, tmp_path)
+    registry = llm.model_registry
+    registry._http_clients[registry.base_url] = create_llm_http_client(
+        transport=httpx.ASGITransport(app=create_stub_app(error_rate=1.0, error_status=[400])))
+
+    events = parse_sse(post_stream("/api/workflow/start/stream", {"prd_content": PRD}).text)
+
+    assert [name for name, _ in events] == ["started", "error"]
+    assert "Injected stub error" in events[-1][1]["error"]
+
+def test_unknown_improvement_types_are_rejected(monkeypatch, tmp_path):
+    use_stub_graph(monkeypatch, tmp_path)
+
+    response = post_stream("/api/workflow/start/stream", {"prd_content": PRD, "improvement_types": ["clarify", "concise"]})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown improvement type: concise"}
+    assert post_stream("/api/workflow/start", {"prd_content": PRD, "improvement_type": "shorter"}).status_code == 400
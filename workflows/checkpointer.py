@@ -0,0 +1,338 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+import logging
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from dependencies import DATA_DIR
+from services.tracing import tracer
+
+logger = logging.getLogger("aop_planner.checkpointer")
+
+WORKFLOW_DB_PATH = Path(os.getenv("WORKFLOW_DB_PATH", str(DATA_DIR / "workflow_checkpoints.sqlite")))
+# Threads untouched for this long are treated as abandoned and deleted
+WORKFLOW_THREAD_TTL = float(os.getenv("WORKFLOW_THREAD_TTL", str(24 * 3600)))
+# Older checkpoints beyond this many per thread are dropped; only the latest
+# one is needed to resume a thread or read its state
+WORKFLOW_MAX_CHECKPOINTS = int(os.getenv("WORKFLOW_MAX_CHECKPOINTS", "10"))
+WORKFLOW_PRUNE_INTERVAL = float(os.getenv("WORKFLOW_PRUNE_INTERVAL", "300"))
+# Strings at least this long in checkpointed state are stored once by content
+# hash and referenced from checkpoints and pending writes
+WORKFLOW_DOCUMENT_MIN_CHARS = int(os.getenv("WORKFLOW_DOCUMENT_MIN_CHARS", "1024"))
+
+# Prefix of a document reference; NUL never occurs in PRD text
+DOCUMENT_REF_PREFIX = "\x00doc:"
+
+class BoundedSqliteSaver(SqliteSaver):
+    """SQLite checkpointer that keeps workflow threads on disk, within bounds.
+
+    Every put records the thread's last activity; threads idle for longer
+    than ttl are deleted by a sweep that runs at most every prune_interval
+    seconds, and each thread keeps only its newest max_checkpoints
+    checkpoints. The async interface runs the sync one in a worker thread
+    (the connection is guarded by the saver's lock), so one instance can be
+    shared by every event loop in the process.
+
+    Large strings in the state (the PRD, improved content, variants and
+    sections) would otherwise be copied into every checkpoint and pending
+    write. With compact_documents they are stored once in a documents table
+    keyed by their SHA-256 and replaced by a reference, which is resolved
+    again when checkpoints are read; documents no longer referenced by any
+    retained checkpoint are deleted along with it.
+
+    The graph must not use DeltaChannel: trimming old checkpoints relies on
+    each checkpoint holding complete channel values.
+    """
+
+    def __init__(self, path: Path = WORKFLOW_DB_PATH, ttl: float = WORKFLOW_THREAD_TTL,
+                 max_checkpoints: int = WORKFLOW_MAX_CHECKPOINTS,
+                 prune_interval: float = WORKFLOW_PRUNE_INTERVAL,
+                 compact_documents: bool = True,
+                 document_min_chars: int = WORKFLOW_DOCUMENT_MIN_CHARS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(sqlite3.connect(str(self.path), check_same_thread=False))
+        # Reentrant, so the cursors SqliteSaver opens inside a put's cursor
+        # can take it again
+        self.lock = threading.RLock()
+        # Cursors opened inside another one share its transaction
+        self._cursor_depth = 0
+        self.compact_documents = compact_documents
+        self.document_min_chars = document_min_chars
+        self.ttl = ttl
+        self.max_checkpoints = max(1, max_checkpoints)
+        self.prune_interval = prune_interval
+        self.expired_threads = 0
+        self.trimmed_checkpoints = 0
+        self._last_prune = 0.0
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS documents (hash TEXT PRIMARY KEY, content TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS document_refs (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, hash)
+            );
+            CREATE INDEX IF NOT EXISTS document_refs_hash ON document_refs (hash);
+            """
+        )
+        self.conn.commit()
+
+    @contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[sqlite3.Cursor]:
+        """Like SqliteSaver.cursor, but nestable: only the outermost cursor
+        commits, or rolls back if anything inside it failed, so a put can
+        store its documents and the checkpoint that refers to them atomically.
+        """
+        with self.lock:
+            self.setup()
+            outermost = self._cursor_depth == 0
+            self._cursor_depth += 1
+            cur = self.conn.cursor()
+            try:
+                yield cur
+            except BaseException:
+                if outermost:
+                    self.conn.rollback()
+                raise
+            else:
+                if outermost and (transaction or self.conn.in_transaction):
+                    self.conn.commit()
+            finally:
+                self._cursor_depth -= 1
+                cur.close()
+
+    # Document compaction
+
+    def _compact(self, value: Any, documents: Dict[str, str]) -> Any:
+        """Replace long strings in plain dicts and lists with document references."""
+        if isinstance(value, str):
+            if len(value) < self.document_min_chars or value.startswith(DOCUMENT_REF_PREFIX):
+                return value
+            digest = hashlib.sha256(value.encode('utf-8')).hexdigest()
+            documents[digest] = value
+            return DOCUMENT_REF_PREFIX + digest
+        if type(value) is dict:
+            return {key: self._compact(item, documents) for key, item in value.items()}
+        if type(value) is list:
+            return [self._compact(item, documents) for item in value]
+        return value
+
+    def _collect_refs(self, value: Any, refs: set):
+        if isinstance(value, str):
+            if value.startswith(DOCUMENT_REF_PREFIX):
+                refs.add(value[len(DOCUMENT_REF_PREFIX):])
+        elif type(value) is dict:
+            for item in value.values():
+                self._collect_refs(item, refs)
+        elif type(value) is list:
+            for item in value:
+                self._collect_refs(item, refs)
+
+    def _expand(self, value: Any, documents: Dict[str, str]) -> Any:
+        if isinstance(value, str):
+            if value.startswith(DOCUMENT_REF_PREFIX):
+                return documents[value[len(DOCUMENT_REF_PREFIX):]]
+            return value
+        if type(value) is dict:
+            return {key: self._expand(item, documents) for key, item in value.items()}
+        if type(value) is list:
+            return [self._expand(item, documents) for item in value]
+        return value
+
+    def _store_documents(self, cur: sqlite3.Cursor, config: RunnableConfig, checkpoint_id: str,
+                         documents: Dict[str, str]):
+        if not documents:
+            return
+        cur.executemany("INSERT OR IGNORE INTO documents (hash, content) VALUES (?, ?)", documents.items())
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        cur.executemany(
+            "INSERT OR IGNORE INTO document_refs (thread_id, checkpoint_ns, checkpoint_id, hash) VALUES (?, ?, ?, ?)",
+            [(thread_id, checkpoint_ns, checkpoint_id, digest) for digest in documents]
+        )
+
+    def _resolve(self, checkpoint_tuple: Optional[CheckpointTuple]) -> Optional[CheckpointTuple]:
+        """Expand the document references of a stored checkpoint and its pending writes."""
+        if checkpoint_tuple is None or not self.compact_documents:
+            return checkpoint_tuple
+        refs = set()
+        self._collect_refs(checkpoint_tuple.checkpoint["channel_values"], refs)
+        for _, _, value in checkpoint_tuple.pending_writes or []:
+            self._collect_refs(value, refs)
+        if not refs:
+            return checkpoint_tuple
+        with self.cursor(transaction=False) as cur:
+            placeholders = ",".join("?" * len(refs))
+            cur.execute(f"SELECT hash, content FROM documents WHERE hash IN ({placeholders})", tuple(refs))
+            documents = dict(cur.fetchall())
+        checkpoint = {**checkpoint_tuple.checkpoint,
+                      "channel_values": self._expand(checkpoint_tuple.checkpoint["channel_values"], documents)}
+        pending_writes = [(task_id, channel, self._expand(value, documents))
+                          for task_id, channel, value in checkpoint_tuple.pending_writes or []]
+        return checkpoint_tuple._replace(checkpoint=checkpoint, pending_writes=pending_writes)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self.lock:
+            return self._resolve(super().get_tuple(config))
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None):
+        with self.lock:
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+            return iter([self._resolve(item) for item in items])
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with tracer.span("checkpoint.put", "checkpoint", thread_id=thread_id) as span:
+            documents = {}
+            if self.compact_documents:
+                # Copy: the graph keeps using the checkpoint it passed in
+                checkpoint = {**checkpoint, "channel_values": self._compact(checkpoint["channel_values"], documents)}
+            span["documents"] = len(documents)
+            # One transaction: the documents, the checkpoint row that refers
+            # to them and the trim either all land or none do
+            with self.cursor() as cur:
+                self._store_documents(cur, config, checkpoint["id"], documents)
+                next_config = super().put(config, checkpoint, metadata, new_versions)
+                cur.execute(
+                    "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                    (thread_id, time.time())
+                )
+                self._trim_thread(cur, thread_id, checkpoint_ns)
+        if time.time() - self._last_prune >= self.prune_interval:
+            self.prune_expired()
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        with tracer.span("checkpoint.put_writes", "checkpoint", thread_id=thread_id, writes=len(writes)) as span:
+            documents = {}
+            if self.compact_documents:
+                writes = [(channel, self._compact(value, documents)) for channel, value in writes]
+            span["documents"] = len(documents)
+            with self.cursor() as cur:
+                self._store_documents(cur, config, str(config["configurable"]["checkpoint_id"]), documents)
+                super().put_writes(config, writes, task_id, task_path)
+
+    def _trim_thread(self, cur: sqlite3.Cursor, thread_id: str, checkpoint_ns: str):
+        cur.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_checkpoints)
+        )
+        stale = [(thread_id, checkpoint_ns, row[0]) for row in cur.fetchall()]
+        if not stale:
+            return
+        cur.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", stale)
+        cur.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", stale)
+        cur.executemany("DELETE FROM document_refs WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", stale)
+        self._delete_orphan_documents(cur)
+        self.trimmed_checkpoints += len(stale)
+
+    @staticmethod
+    def _delete_orphan_documents(cur: sqlite3.Cursor):
+        cur.execute("DELETE FROM documents WHERE hash NOT IN (SELECT hash FROM document_refs)")
+
+    def prune_expired(self) -> int:
+        """Delete threads idle for longer than ttl; returns how many were removed."""
+        self._last_prune = time.time()
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (time.time() - self.ttl,))
+            expired = [row[0] for row in cur.fetchall()]
+            for thread_id in expired:
+                self._delete_thread(cur, thread_id)
+        if expired:
+            self.expired_threads += len(expired)
+            logger.info(f"Evicted {len(expired)} abandoned workflow threads")
+        return len(expired)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.cursor() as cur:
+            self._delete_thread(cur, str(thread_id))
+
+    @classmethod
+    def _delete_thread(cls, cur: sqlite3.Cursor, thread_id: str):
+        for table in ("checkpoints", "writes", "document_refs", "thread_activity"):
+            cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        cls._delete_orphan_documents(cur)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Retained threads and checkpoints, their payload size and the database footprint."""
+        with self.cursor(transaction=False) as cur:
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            checkpoints, checkpoint_bytes = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+            ).fetchone()
+            writes, write_bytes = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM writes"
+            ).fetchone()
+            documents, document_bytes = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM documents"
+            ).fetchone()
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+            cache_size = cur.execute("PRAGMA cache_size").fetchone()[0]
+        wal_path = self.path.with_name(self.path.name + "-wal")
+        return {
+            'threads': threads,
+            'checkpoints': checkpoints,
+            'writes': writes,
+            'checkpoint_bytes': checkpoint_bytes,
+            'write_bytes': write_bytes,
+            'documents': documents,
+            'document_bytes': document_bytes,
+            'db_file_bytes': self.path.stat().st_size if self.path.exists() else 0,
+            'wal_file_bytes': wal_path.stat().st_size if wal_path.exists() else 0,
+            # Upper bound on SQLite's page cache (negative cache_size is in KiB)
+            'cache_limit_bytes': -cache_size * 1024 if cache_size < 0 else cache_size * page_size,
+            'expired_threads': self.expired_threads,
+            'trimmed_checkpoints': self.trimmed_checkpoints,
+            'ttl_seconds': self.ttl,
+            'max_checkpoints_per_thread': self.max_checkpoints,
+        }
+
+    # Async interface: the sync methods in a worker thread
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from services.llm_scheduler import llm_request
+from services.resilience import llm_deadline
+
+logger = logging.getLogger("aop_planner.workflow_runner")
+
+# Graph runs executing at once; further runs wait for a slot
+WORKFLOW_MAX_CONCURRENT_RUNS = int(os.getenv("WORKFLOW_MAX_CONCURRENT_RUNS", "8"))
+# Finished runs whose events are kept for late subscribers
+WORKFLOW_RUN_HISTORY = int(os.getenv("WORKFLOW_RUN_HISTORY", "500"))
+
+# Events after which a run publishes nothing more
+TERMINAL_EVENTS = ("waiting_for_review", "completed", "error", "cancelled")
+
+Event = Tuple[str, Dict[str, Any]]
+
+class WorkflowBusyError(Exception):
+    """Raised when a thread already has a graph run queued or executing."""
+
+def snapshot_payload(thread_id: str, state_snapshot) -> Dict[str, Any]:
+    """Review payload for a thread paused at human_review (or finished)."""
+    values = state_snapshot.values
+    return {
+        "thread_id": thread_id,
+        "status": "waiting_for_review" if state_snapshot.next else "completed",
+        "next_step": state_snapshot.next,
+        "current_content": values.get("improved_content"),
+        "original_content": values.get("prd_content"),
+        "variants": values.get("variants"),
+        "selected_variant": values.get("selected_variant")
+    }
+
+class _Run:
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.task: Optional[asyncio.Task] = None
+        self.events: List[Event] = []
+        self.subscribers: set = set()
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.events) and self.events[-1][0] in TERMINAL_EVENTS
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        item = (event, {"thread_id": self.thread_id, **data})
+        self.events.append(item)
+        for queue in self.subscribers:
+            queue.put_nowait(item)
+
+class WorkflowRunner:
+    """Runs workflow graph invocations as background tasks.
+
+    submit() returns as soon as the run is queued; at most max_concurrent
+    runs execute at once. Each run publishes node-level progress (a node
+    started or finished) and ends with waiting_for_review, completed, error
+    or cancelled. events() replays what a run has published so far and then
+    follows it live, so subscribers can connect at any time.
+    """
+
+    def __init__(self, graph, max_concurrent: int = WORKFLOW_MAX_CONCURRENT_RUNS,
+                 history: int = WORKFLOW_RUN_HISTORY):
+        self.graph = graph
+        self.history = history
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._runs: "OrderedDict[str, _Run]" = OrderedDict()
+
+    def has_run(self, thread_id: str) -> bool:
+        return thread_id in self._runs
+
+    def is_running(self, thread_id: str) -> bool:
+        run = self._runs.get(thread_id)
+        return run is not None and not run.finished
+
+    def submit(self, thread_id: str, graph_input: Optional[Dict[str, Any]], user: Optional[str] = None) -> None:
+        """Queue a graph run for a thread; graph_input None resumes a paused thread.
+
+        LLM calls of the run are scheduled at workflow priority for user.
+        """
+        if self.is_running(thread_id):
+            raise WorkflowBusyError(f"Workflow {thread_id} is already running")
+        run = _Run(thread_id)
+        self._runs[thread_id] = run
+        self._runs.move_to_end(thread_id)
+        self._evict_finished()
+        run.publish("queued", {})
+        run.task = asyncio.create_task(self._execute(run, graph_input, user))
+
+    async def _execute(self, run: _Run, graph_input: Optional[Dict[str, Any]], user: Optional[str]):
+        config = {"configurable": {"thread_id": run.thread_id}}
+        try:
+            with llm_request("workflow", user):
+                async with self._slots:
+                    run.publish("running", {})
+                    with llm_deadline("workflow"):
+                        async for task in self.graph.astream(graph_input, config=config, stream_mode="tasks"):
+                            if "result" in task or "error" in task:
+                                run.publish("node", {"node": task["name"], "task_id": task["id"],
+                                                     "status": "failed" if task.get("error") else "finished"})
+                            else:
+                                run.publish("node", {"node": task["name"], "task_id": task["id"], "status": "started"})
+                    state_snapshot = await self.graph.aget_state(config)
+            payload = snapshot_payload(run.thread_id, state_snapshot)
+            run.publish(payload["status"], payload)
+        except asyncio.CancelledError:
+            run.publish("cancelled", {})
+            raise
+        except Exception as e:
+            logger.error(f"Workflow run {run.thread_id} failed: {e}", exc_info=True)
+            run.publish("error", {"error": str(e)})
+
+    def _evict_finished(self):
+        finished = [thread_id for thread_id, run in self._runs.items() if run.finished]
+        for thread_id in finished[:max(0, len(self._runs) - self.history)]:
+            del self._runs[thread_id]
+
+    async def events(self, thread_id: str) -> AsyncIterator[Event]:
+        """Yield a run's events from the start until it reaches a terminal event."""
+        run = self._runs.get(thread_id)
+        if run is None:
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        replay = list(run.events)
+        run.subscribers.add(queue)
+        try:
+            for item in replay:
+                yield item
+            if run.finished:
+                return
+            while True:
+                item = await queue.get()
+                yield item
+                if item[0] in TERMINAL_EVENTS:
+                    return
+        finally:
+            run.subscribers.discard(queue)
+
+    async def wait(self, thread_id: str):
+        """Wait for the current run of a thread to end."""
+        run = self._runs.get(thread_id)
+        if run is not None and run.task is not None:
+            await asyncio.gather(run.task, return_exceptions=True)
+
+    async def shutdown(self):
+        tasks = [run.task for run in self._runs.values() if run.task and not run.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)